@@ -0,0 +1,108 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: Content-hash deduplication of the bodies of a corpus run, so that the reprints and duplicate editions
+of a collection, whose bodies are identical but whose headers are not, are tokenized, normalized and sent to
+CoreNLP once only.
+
+A body is keyed by the hash of its text once its original tags are replaced by <tag> (as the pipeline does before
+tokenizing it) plus the options of the run. The first file of a key is remade as usual and its processed body
+(the tokenized/preprocessed and normalized text and the annotations) is cached. Every other file of the key then
+only has its own header and tags paired with the cached body, so that bodies differing only in the attributes
+of their tags are deduplicated too. A file of a key being processed by another thread waits for it. A cached
+body is a gzipped json file at <cache_dir>/<key[:2]>/<key>.json.gz, as only a few of the bodies are ever needed
+again, and the cache_dir is removed once the run is over.
+'''
+from threading import Condition
+from os.path import join
+from os import makedirs
+from shutil import rmtree
+import hashlib
+import json
+import gzip
+
+
+class bodyDedup:
+    '''A thread-safe cache of the processed bodies of a corpus run, keyed by content.
+
+    Args (initialization):
+        - cache_dir(str): the directory of the cached bodies, created if it does not exist and removed by close().
+        - compresslevel(int): the gzip compression level of the cached bodies, defaults to 1.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> dedup = bodyDedup(join(dst_dir, ".dedup"))
+    >>> key = dedup.key(body_with_tag_placeholders, {"apply_prep_rules": True, "annotation_keys": ["pos"]})
+    >>> value = dedup.claim(key, filename)     # the cached dict, or None: then process the body and
+    >>> dedup.put(key, value)                  # cache it, or dedup.abandon(key) if it failed
+    >>> dedup.stats()                          # {"bodies": ..., "unique": ..., "duplicates": ..., "dedup_ratio": ...}
+    >>> dedup.close()
+    '''
+    def __init__(self, cache_dir, compresslevel=1):
+        self._cache_dir = cache_dir
+        self._compresslevel = compresslevel
+        self._cond = Condition()
+        self._cached = set()
+        # key --> the filename being processed for it
+        self._in_flight = {}
+        self._bodies = 0
+        self._duplicates = 0
+        self._duplicate_chars = 0
+        makedirs(cache_dir, exist_ok=True)
+
+    def key(self, body, config=None):
+        '''Return the key of a body (with its tags replaced by <tag>) given the options it is processed with.'''
+        digest = hashlib.sha1(body.encode("utf-8"))
+        digest.update(json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return join(self._cache_dir, key[:2], key + ".json.gz")
+
+    def claim(self, key, filename, length=0):
+        '''Return the cached value of a key, waiting while another thread processes it. If there is none,
+        return None and leave the key to the caller, who must then put() or abandon() it. The length (chars)
+        of the body counts towards the work saved when it is a duplicate.'''
+        with self._cond:
+            while key in self._in_flight:
+                self._cond.wait()
+            self._bodies += 1
+            if key not in self._cached:
+                self._in_flight[key] = filename
+                return None
+            self._duplicates += 1
+            self._duplicate_chars += length
+        with gzip.open(self._path(key), "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+
+    def put(self, key, value):
+        '''Cache the value (a json serializable dict) of a claimed key.'''
+        makedirs(join(self._cache_dir, key[:2]), exist_ok=True)
+        with open(self._path(key), "wb") as f:
+            f.write(gzip.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), self._compresslevel))
+        with self._cond:
+            self._cached.add(key)
+            self._in_flight.pop(key, None)
+            self._cond.notify_all()
+
+    def abandon(self, key):
+        '''Give a claimed key up without caching it, e.g., when its annotation failed, so that the next file of
+        the key is processed anew.'''
+        with self._cond:
+            self._in_flight.pop(key, None)
+            self._cond.notify_all()
+
+    def stats(self):
+        '''Return the number of bodies claimed, of unique ones and of duplicates, the dedup ratio (duplicates
+        per body) and the chars of the duplicates, which were neither tokenized nor annotated again.'''
+        with self._cond:
+            return {"bodies": self._bodies, "unique": self._bodies - self._duplicates, "duplicates": self._duplicates,
+                    "dedup_ratio": round(self._duplicates / self._bodies, 4) if self._bodies else 0.0,
+                    "duplicate_chars": self._duplicate_chars}
+
+    def close(self):
+        '''Remove the cached bodies.'''
+        rmtree(self._cache_dir, ignore_errors=True)
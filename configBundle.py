@@ -0,0 +1,141 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A compiled bundle of the config folder, so that every process (a CLI call, a process pool worker,
+a shard) loads the rules ready-made instead of re-reading and re-splitting the text and json config files.
+
+compile_config() checks the formats of the config files with config_file_formats_debugger and compiles every
+regex of the rules and verbs once to make sure it is valid. It then writes the bundle next to the config files
+(.config_bundle.json) with:
+    - the parsed preprocessing and normalizing rules, common verbs and irregular verb inflections;
+    - the regex sources of all the rules and verbs, for warm_patterns() to compile in one go;
+    - the mtime, size and sha1 of every source file, and the version of the bundle format.
+
+The loaders of utils.py (preprocessing_rules, normalizing_rules, get_common_verbs and get_irreg_v_past_inflect_dict)
+take a file from the bundle whenever the bundle is up to date for it: the file has the same mtime and size as
+when it was bundled, or the same sha1 (e.g., after a fresh checkout). Otherwise, they read the file itself, so an
+edited rule is never ignored, and compile_config() is to be run again.
+'''
+from os.path import join, dirname, basename
+from os import stat, replace, getpid
+import hashlib
+import json
+import time
+import re
+
+
+bundle_name = ".config_bundle.json"
+# bumped whenever the layout of the bundle changes, so that an older bundle is not used
+bundle_version = 1
+
+# the config files bundled
+config_files = ("preprocessing_rules.txt", "normalizing_rules.txt", "common_verbs.txt",
+                "irregular_v_past_inflections.json")
+
+# bundle path --> (mtime, bundle), so that the loaders read a bundle once per process
+_bundles = {}
+
+
+def _sha1(filepath):
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _load_bundle(bundle_path):
+    try:
+        mtime = stat(bundle_path).st_mtime
+    except OSError:
+        return
+    cached = _bundles.get(bundle_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(bundle_path, "r") as f:
+            bundle = json.load(f)
+    except (OSError, ValueError):
+        bundle = None
+    if bundle is not None and bundle.get("version") != bundle_version:
+        bundle = None
+    _bundles[bundle_path] = (mtime, bundle)
+    return bundle
+
+
+def bundled_config(filepath, delimiter="\t"):
+    '''Return the parsed content of a config file from the bundle next to it, or None if there is no bundle
+    or the bundle is not up to date for the file.'''
+    bundle = _load_bundle(join(dirname(filepath), bundle_name))
+    if bundle is None:
+        return
+    entry = bundle["files"].get(basename(filepath))
+    if entry is None or (entry["delimiter"] is not None and entry["delimiter"] != delimiter):
+        return
+    try:
+        st = stat(filepath)
+    except OSError:
+        return
+    if st.st_size != entry["size"]:
+        return
+    if st.st_mtime != entry["mtime"] and _sha1(filepath) != entry["sha1"]:
+        return
+    return entry["data"]
+
+
+def compile_config(config_path="config", delimiter="\t", print_msg=True):
+    '''Check and compile the config folder into its bundle (see above). Return the path of the bundle.
+    Raise ValueError if a config file is not well formatted or a regex does not compile.'''
+    # imported here, as the modules they import load their rules through bundled_config
+    from debugger import config_file_formats_debugger
+    from utils import _read_trans_rules, _read_common_verbs, _trans_rule_pattern
+    from textNormalizer import verb_patterns
+
+    if config_file_formats_debugger(config_path, delimiter, print_msg=False):
+        raise ValueError(f"The config files in {config_path} are not well formatted. " \
+                         "Run config_file_formats_debugger() from debugger.py for the details.")
+    path = lambda name: join(config_path, name)
+    prep_rules = _read_trans_rules(path("preprocessing_rules.txt"), delimiter)
+    norm_rules = _read_trans_rules(path("normalizing_rules.txt"), delimiter)
+    verbs = _read_common_verbs(path("common_verbs.txt"), delimiter)
+    with open(path("irregular_v_past_inflections.json"), "r") as f:
+        irreg_v_dict = json.load(f)
+
+    patterns = [_trans_rule_pattern(target) for target, _ in prep_rules + norm_rules]
+    patterns += [source for verb in verbs[0] for source in verb_patterns(verb)]
+    for source in patterns:
+        try:
+            re.compile(source, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"The regex {source!r} does not compile: {e}")
+
+    files = {}
+    for name, data in zip(config_files, (prep_rules, norm_rules, verbs, irreg_v_dict)):
+        st = stat(path(name))
+        files[name] = {"mtime": st.st_mtime, "size": st.st_size, "sha1": _sha1(path(name)), "data": data,
+                       "delimiter": None if name.endswith(".json") else delimiter}
+    bundle = {"version": bundle_version, "created": time.time(), "files": files, "patterns": patterns}
+
+    bundle_path = path(bundle_name)
+    tmp = "%s.%i.tmp" % (bundle_path, getpid())
+    with open(tmp, "w") as f:
+        json.dump(bundle, f, ensure_ascii=False)
+    replace(tmp, bundle_path)
+    if print_msg:
+        print(f"\033[32mThe config bundle is saved in {bundle_path}\033[0m ({len(patterns)} regexes checked).")
+    return bundle_path
+
+
+def warm_patterns(config_path="config"):
+    '''Compile the regexes of the bundle (if up to date) ahead of their first use, e.g., in a new worker process.
+    Return the number of regexes compiled.'''
+    from utils import compiled_pattern
+    bundle = _load_bundle(join(config_path, bundle_name))
+    if bundle is None or any(bundled_config(join(config_path, name)) is None for name in config_files[:3]):
+        return 0
+    for source in bundle["patterns"]:
+        compiled_pattern(source)
+    return len(bundle["patterns"])
+
+
+if __name__ == "__main__":
+    import sys
+    compile_config(sys.argv[1] if len(sys.argv) > 1 else "config")
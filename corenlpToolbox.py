@@ -6,19 +6,190 @@
 that enable Python to tokenize and annotate without text length restrictions. 
 '''
 from stanfordcorenlp import StanfordCoreNLP
+from remakeLogger import log_event
+from threading import Thread, Lock, Event, local
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+from contextlib import contextmanager
+from os.path import join
+import subprocess
+import requests
+import random
+import time
 import json
+import re
+
+
+# where a slice is best cut: after a sentence-final punctuation (and the closing quotes/brackets following it)
+# and its whitespace, or right before a <tag> placeholder, which stands for an original xml tag
+_slice_boundary = re.compile(r"[.!?][\"'”’)\]]*\s+|\s+(?=<tag>)")
+
+
+# the latencies of the requests made by the current thread, see start_request_log() 
+_request_log = local()
+
+
+def start_request_log():
+    '''Start logging the (seconds, timed_out) of the CoreNLP requests made by the current thread, e.g., for one file.'''
+    _request_log.entries = []
+
+
+def request_log():
+    '''Return the (seconds, timed_out) of the CoreNLP requests made by the current thread since start_request_log().'''
+    return getattr(_request_log, "entries", [])
+
+
+# the gate every CoreNLP request passes, see set_request_gate(), and the job of the current thread's requests
+_request_gate = None
+_request_job = local()
+
+
+def set_request_gate(gate):
+    '''Have every CoreNLP request of the process (hedged duplicates included) wait for gate.acquire(job) before
+    it is sent and call gate.release(job, seconds) once it is answered (or failed), or gate.release(job, None) if
+    it ends up not being sent, e.g., a jobScheduler.fairShareScheduler capping
+    the requests in flight to a shared backend. None to remove the gate.'''
+    global _request_gate
+    _request_gate = gate
+
+
+def set_request_job(job):
+    '''Tag the CoreNLP requests made by the current thread from now on with a job name (None for no job).'''
+    _request_job.name = job
+
+
+def request_job():
+    '''Return the job name of the current thread's CoreNLP requests, see set_request_job().'''
+    return getattr(_request_job, "name", None)
+
+
+# the keep-alive sessions of the current thread by server url, see keep_alive_connections()
+_sessions = local()
+_keep_alive = Event()
+
+
+def keep_alive_connections(on=True):
+    '''Reuse a keep-alive connection per thread and server for the CoreNLP requests (on=True), instead of opening
+    a new one for every request, e.g., in a long-running process such as remakeDaemon.py.'''
+    if on:
+        _keep_alive.set()
+    else:
+        _keep_alive.clear()
+
+
+def _post(url, properties, text, timeout=None):
+    '''Send an annotation request to a CoreNLP server. Return the response text.'''
+    params, data = {'properties': str(properties)}, text.encode('utf-8')
+    if not _keep_alive.is_set():
+        return requests.post(url, params=params, data=data, headers={'Connection': 'close'}, timeout=timeout).text
+    if not hasattr(_sessions, "by_url"):
+        _sessions.by_url = {}
+    session = _sessions.by_url.get(url)
+    if session is None:
+        session = _sessions.by_url[url] = requests.Session()
+    try:
+        return session.post(url, params=params, data=data, timeout=timeout).text
+    except requests.ConnectionError:
+        # e.g., a connection the server has closed since: the next request opens a new one
+        _sessions.by_url.pop(url).close()
+        raise
+
+
+class coreNLPRequestError(Exception):
+    '''A CoreNLP request failed in a way that annotating a smaller slice of the text would not fix, e.g., the
+    server could not be reached or timed out after all the retries.'''
+
+
+class coreNLPUnavailable(requests.ConnectionError):
+    '''No server of a coreNLPServerPool is in rotation to take the request. A ConnectionError, so that the request
+    is retried after a backoff, by which time the health check may have brought a server back.'''
+
+
+def percentile(values, q):
+    '''Return the q-th percentile (0-100) of the values by the nearest rank, or None if there is none.'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+class latencyTracker:
+    '''A thread-safe record of the recent request latencies (a window of the last ones) and the counts of the
+    timeouts, retries and hedged requests, plus the requests in flight to tell the stalled ones.'''
+    
+    def __init__(self, window=1000):
+        self._latencies = deque(maxlen=window)
+        self._lock = Lock()
+        self._in_flight = {}
+        self._next_id = 0
+        self.counts = {"requests": 0, "timeouts": 0, "retries": 0, "hedged": 0, "hedge_wins": 0}
+    
+    def begin(self):
+        with self._lock:
+            self._next_id += 1
+            self._in_flight[self._next_id] = time.perf_counter()
+            return self._next_id
+    
+    def end(self, request_id, seconds=None):
+        with self._lock:
+            self._in_flight.pop(request_id, None)
+            if seconds is not None:
+                self._latencies.append(seconds)
+                self.counts["requests"] += 1
+    
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+    
+    def percentile(self, q, min_samples=20):
+        '''Return the q-th percentile of the recent latencies, or None until there are min_samples of them.'''
+        with self._lock:
+            values = list(self._latencies)
+        return percentile(values, q) if len(values) >= min_samples else None
+    
+    def stalled(self, threshold):
+        '''Return the number of requests in flight for longer than threshold seconds.'''
+        now = time.perf_counter()
+        with self._lock:
+            return sum(1 for start in self._in_flight.values() if now - start > threshold)
+    
+    def stats(self, stall_threshold=60):
+        with self._lock:
+            values, counts, in_flight = list(self._latencies), dict(self.counts), len(self._in_flight)
+        stats = {q: percentile(values, n) for q, n in (("p50", 50), ("p95", 95), ("p99", 99))}
+        stats.update(counts, in_flight=in_flight, stalled=self.stalled(stall_threshold))
+        return stats
 
 
 class CoreNLP:
     ''''A parent class that re-adopts the stanfordcorenlp to make Python a more effective 
     text processing and annotating tool that in principle has no text length restrictions 
     (which is 100,000 chars because of the use of server). More concretely, this class
-    allow oversized text to be processed by Stanford CoreNLP sever by automatic text slicing'''
+    allow oversized text to be processed by Stanford CoreNLP sever by automatic text slicing.
+    
+    An oversized text is cut into slices of at most char_budget characters (100,000 by default, the server's
+    limit), preferably at the end of a sentence or before a <tag> placeholder, otherwise at a whitespace, so
+    that the sentence splitting and pos tagging are not degraded at the seams. When a slice fails, only that
+    slice is retried with a 25% smaller budget, and the budget grows back on the slices that succeed. The 
+    step argument (a number of tokens per slice) is kept for backward compatibility, but no longer used.
+    
+    Instead of the single server at local_host:port, a coreNLPServerPool (see below) can be given as the pool,
+    or set later by use_pool(pool), to spread the requests over several servers.
+    
+    A request can be given a deadline (request_timeout, in seconds), after which it is retried up to max_retries
+    times with a jittered exponential backoff. With hedge=True, once a request runs past the p95 latency of the
+    recent requests, a duplicate is sent (to another server of the pool, or on another connection) and whichever
+    answer comes first is taken. See set_deadlines() and latency_stats().
+    
+    use_pool() and set_deadlines() apply to every request of the client, from any thread. To apply them to some
+    runs only (e.g., those of one xmlCorpusRemaker among others sharing the client in the same process), 
+    scoped() applies them to the requests made by the current thread within a with block.'''
     
     def __init__(self, props, local_host='http://localhost', port=9999,
-                 whitespace_based=False, split_hyphen=False, step=5000):
+                 whitespace_based=False, split_hyphen=False, step=5000, char_budget=100000, min_char_budget=1000,
+                 pool=None, request_timeout=None, max_retries=0, backoff=0.5, hedge=False):
         
-        self._nlp = StanfordCoreNLP(local_host, port)
+        self._nlp = pool if pool is not None else StanfordCoreNLP(local_host, port)
         self.props = props
         if whitespace_based: 
             self.props['tokenize.whitespace'] = 'true'
@@ -29,56 +200,261 @@ class CoreNLP:
         else:
             self.props['tokenize.options'] = "splitHyphenated=false"
         self._step = step
+        self._char_budget = char_budget
+        self._min_char_budget = min_char_budget
+        # the last budget the server handled, which the next text starts from
+        self._budget = char_budget
         self._text = ''
         self._has_percent = False
+        self._latency = latencyTracker()
+        self._hedger = None
+        # the props added to the requests of the current thread, see extra_props()
+        self._extra_props = local()
+        # the pool and deadlines of the requests of the current thread, see scoped()
+        self._scope = local()
+        self.set_deadlines(request_timeout, max_retries, backoff, hedge)
     
-    def _annotating(self, text):
-        '''Annotating given text based on preset properties (annotating setups).'''
+    def use_pool(self, pool):
+        '''Send the requests to a coreNLPServerPool (or anything with the same annotate method) from now on.'''
+        self._nlp = pool
+    
+    def set_deadlines(self, request_timeout=None, max_retries=0, backoff=0.5, hedge=False):
+        '''Set the deadline of a request (seconds, None for no deadline), the number of retries after a timeout
+        or a connection error, the base of the jittered exponential backoff (seconds), and the hedging mode.'''
+        self._request_timeout = request_timeout
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._hedge = hedge
+        if hedge and self._hedger is None:
+            self._hedger = ThreadPoolExecutor(max_workers=32, thread_name_prefix="corenlp-hedge")
+    
+    @contextmanager
+    def scoped(self, pool=None, request_timeout=None, max_retries=None, backoff=None, hedge=None):
+        '''Send the requests made by the current thread within the with block to the pool, and with the deadlines
+        given (see set_deadlines), instead of those of the client. The args left None are those of the client.'''
+        settings = {name: value for name, value in (("_nlp", pool), ("_request_timeout", request_timeout),
+                                                    ("_max_retries", max_retries), ("_backoff", backoff),
+                                                    ("_hedge", hedge)) if value is not None}
+        if settings.get("_hedge") and self._hedger is None:
+            self._hedger = ThreadPoolExecutor(max_workers=32, thread_name_prefix="corenlp-hedge")
+        previous = getattr(self._scope, "settings", None)
+        self._scope.settings = dict(previous or {}, **settings)
         try:
-            annotated_text = self._nlp.annotate(text, properties=self.props)
-            return json.loads(annotated_text)
-        
-        except Exception as e:
-            print("\033[32mTokenizingError: \033[0m", e)
-            if "Expecting value: line 1 column 1 (char 0)" in str(e):
-                
-                print("Trying to re-do the process by narrowing the slicing steps by 500. Was: %i. Now: %i" 
-                 % (self._step, int(self._step * 0.75)))
-                self._step = int(self._step * 0.75)
+            yield self
+        finally:
+            self._scope.settings = previous
+    
+    def _setting(self, name):
+        '''Return the setting (e.g., "_request_timeout") of the current thread's scope, or else of the client.'''
+        settings = getattr(self._scope, "settings", None)
+        return settings[name] if settings and name in settings else getattr(self, name)
+    
+    @contextmanager
+    def extra_props(self, props):
+        '''Add the props (a dict) to the requests made by the current thread within the with block, e.g.,
+        {"ssplit.newlineIsSentenceBreak": "two"} for several texts annotated in one request.'''
+        previous = getattr(self._extra_props, "props", None)
+        self._extra_props.props = dict(previous or {}, **props)
+        try:
+            yield self
+        finally:
+            self._extra_props.props = previous
+    
+    def latency_stats(self):
+        '''Return the p50/p95/p99 latencies (seconds) of the recent requests, the counts of the requests, timeouts,
+        retries and hedged requests, and the number of requests in flight and stalled (past the deadline, or 60s).'''
+        return self._latency.stats(self._request_timeout or 60)
+    
+    def _request(self, text, props=None, route=None):
+        '''Make a request to the server or pool with the timeout of the route (see _route), by default the one of
+        the current thread.'''
+        props = props or self.props
+        nlp, timeout = route or self._route()
+        if isinstance(nlp, StanfordCoreNLP):
+            # the same request as StanfordCoreNLP.annotate, but with a deadline
+            return _post(nlp.url, props, text, timeout)
+        if timeout is None:
+            return nlp.annotate(text, properties=props)
+        return nlp.annotate(text, properties=props, timeout=timeout)
+    
+    def _route(self):
+        '''Return the server or pool and the timeout of the current thread's requests, which a hedged duplicate
+        made on another thread is sent with too.'''
+        return self._setting("_nlp"), self._setting("_request_timeout")
+    
+    def _hedged_request(self, text, props, route, gate, job, answered):
+        '''Make the hedged duplicate of a request, once the gate (if any) lets it through too, unless the first 
+        request has been answered by then. A duplicate never sent gives its slot back with release(job, None).'''
+        if gate is None:
+            return self._request(text, props, route)
+        gate.acquire(job)
+        if answered.is_set():
+            gate.release(job, None)
+            return
+        start = time.perf_counter()
+        try:
+            return self._request(text, props, route)
+        finally:
+            gate.release(job, time.perf_counter() - start)
+    
+    def _timed_request(self, text, gate=None, job=None):
+        '''Make a request, hedged if on, and log its latency for the current thread. The hedged duplicate waits
+        for a slot of the gate of the request (see _gated_request) like any other request.'''
+        request_id, start = self._latency.begin(), time.perf_counter()
+        timed_out, succeeded = False, False
+        answered = Event()
+        extra = getattr(self._extra_props, "props", None)
+        props = dict(self.props, **extra) if extra else None
+        try:
+            threshold = self._latency.percentile(95) if self._setting("_hedge") else None
+            if threshold is None:
+                out = self._request(text, props)
+                succeeded = True
+                return out
+            route = self._route()
+            futures = [self._hedger.submit(self._request, text, props, route)]
+            done, _ = wait(futures, timeout=threshold)
+            if not done:
+                self._latency.count("hedged")
+                futures.append(self._hedger.submit(self._hedged_request, text, props, route, gate, job, answered))
+            error = None
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        if f is not futures[0]:
+                            self._latency.count("hedge_wins")
+                        succeeded = True
+                        return f.result()
+                    error = f.exception()
+            raise error
+        except requests.Timeout:
+            timed_out = True
+            raise
+        finally:
+            answered.set()
+            seconds = time.perf_counter() - start
+            # only the requests that succeeded set the hedge threshold: a failure or timeout says nothing of it
+            self._latency.end(request_id, seconds if succeeded else None)
+            request_log().append((seconds, timed_out))
+    
+    def _gated_request(self, text):
+        '''Make a request once the gate (if any) lets it through, see set_request_gate(). The backoff between
+        the retries is spent outside of the gate.'''
+        gate, job = _request_gate, request_job()
+        if gate is None:
+            return self._timed_request(text)
+        gate.acquire(job)
+        start = time.perf_counter()
+        try:
+            return self._timed_request(text, gate, job)
+        finally:
+            gate.release(job, time.perf_counter() - start)
+    
+    def _annotating(self, text):
+        '''Annotating given text based on preset properties (annotating setups). A request that times out or cannot
+        connect is retried up to max_retries times, after a jittered exponential backoff. Return None if the server
+        does not answer with json, as it does to a text too long for it, and raise coreNLPRequestError if the
+        request fails otherwise (e.g., no server can be reached), which a smaller slice would not fix.'''
+        max_retries, backoff = self._setting("_max_retries"), self._setting("_backoff")
+        for attempt in range(max_retries + 1):
+            start = time.perf_counter()
+            try:
+                annotated_text = self._gated_request(text)
+                return json.loads(annotated_text)
+            
+            except (requests.Timeout, requests.ConnectionError) as e:
+                if isinstance(e, requests.Timeout):
+                    self._latency.count("timeouts")
+                if attempt == max_retries:
+                    log_event("corenlp_error", f"\033[32mTokenizingError: \033[0m {e}", stage=self.props["annotators"],
+                              level="error", duration=time.perf_counter() - start, error=type(e).__name__, attempt=attempt)
+                    raise coreNLPRequestError(e) from e
+                self._latency.count("retries")
+                log_event("corenlp_retry", None, stage=self.props["annotators"], level="warning",
+                          duration=time.perf_counter() - start, error=type(e).__name__, attempt=attempt)
+                time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            
+            except ValueError as e:
+                # not json: most likely the server's message about a text too long (or too slow) for it
+                log_event("corenlp_error", f"\033[32mTokenizingError: \033[0m {e}", stage=self.props["annotators"],
+                          level="error", duration=time.perf_counter() - start, error=repr(e), attempt=attempt)
                 return
             
+            except Exception as e:
+                log_event("corenlp_error", f"\033[32mTokenizingError: \033[0m {e}", stage=self.props["annotators"],
+                          level="error", duration=time.perf_counter() - start, error=repr(e), attempt=attempt)
+                raise coreNLPRequestError(e) from e
+    
+    def _slice_end(self, text, start, budget):
+        '''Return the end offset of the slice of text starting at start within the character budget: the last
+        sentence end or <tag> placeholder in the second half of the budget, or else the last whitespace.'''
+        end = start + budget
+        if end >= len(text):
+            return len(text)
+        cut = -1
+        for m in _slice_boundary.finditer(text, start + budget // 2, end):
+            cut = m.end()
+        if cut > start:
+            return cut
+        cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+        # a single token longer than the budget can only be cut through
+        return cut + 1 if cut > start else end
+    
     def _text_annotating(self, text):
-        '''Annotating given text in a way that allows annotating oversized text in Python. 
-        When the text is oversized (>100000 chars), perform text slicing by adjustable number of tokens.'''
+        '''Annotating given text in a way that allows annotating oversized text in Python. When the text is oversized
+        (>char_budget chars) or fails as a whole, it is annotated slice by slice. The slice offsets are found by scanning
+        the text once and the slices are sent as substrings, so the text is never re-split or re-joined.'''
         
         self._text = text
+        budget = self._budget
+        if len(text) <= budget:
+            rturn = self._annotating(text)
+            if rturn:
+                return [rturn]
+            budget = int(min(budget, len(text)) * 0.75)
+        
         annotated_text = []
-        if len(text) <= 100000:
-            annotated_text.append(self._annotating(text))
-        else:
-            tokens = text.split()
-            for i in range(0, len(tokens), self._step):
-                sub_text = ' '.join(tokens[i: i + self._step])
-                rturn = self._annotating(sub_text)
-                if rturn:
-                    annotated_text.append(rturn)
-                else:
-                    return 
-                
+        # the largest budget the server has not failed at during this text
+        start, ceiling = 0, self._char_budget
+        while start < len(text):
+            end = self._slice_end(text, start, budget)
+            sub_text = text[start:end]
+            if not sub_text.strip():
+                start = end
+                continue
+            rturn = self._annotating(sub_text)
+            if rturn:
+                annotated_text.append(rturn)
+                start = end
+                # the server handled this budget, so grow it back towards the ceiling
+                budget = min(int(budget * 1.25), ceiling)
+            else:
+                ceiling = min(ceiling, len(sub_text) - 1)
+                if int(budget * 0.75) < self._min_char_budget:
+                    self._budget = self._char_budget
+                    return
+                log_event("slice_retry", "Trying to re-do the slice by narrowing the slicing budget by 25%%. Was: %i chars. " \
+                          "Now: %i chars." % (budget, int(budget * 0.75)), stage=self.props["annotators"], level="warning",
+                          budget=budget)
+                budget = int(budget * 0.75)
+        
+        self._budget = budget
         return annotated_text
     
     def get_annotated_text(self, text):
-        '''Auto-adjust the slicing steps when needed to get the final annotated text.'''
+        '''Get the final annotated text, with the slicing budget auto-adjusted slice by slice when needed.
+        The budget is only narrowed when the server fails a slice as too long, not when it cannot be reached.'''
         
-        annotated_text = []
-        while not annotated_text:
+        try:
             annotated_text = self._text_annotating(text)
-            if self._step == 0:
-                print("Text cannot be annotated. Please check whether if it has spaces or if" \
-                      "it contains special symbols that cannot be annotated via server.")
-                break
-            
-        self._step = 5000
+        except coreNLPRequestError:
+            annotated_text = None
+        if not annotated_text:
+            log_event("not_annotated", "Text cannot be annotated. Please check whether if it has spaces or if" \
+                      "it contains special symbols that cannot be annotated via server.", stage=self.props["annotators"],
+                      level="error", length=len(text))
         return annotated_text
         
 
@@ -89,9 +465,9 @@ class stanfordTokenizer(CoreNLP):
     inherits the CoreNLP class method so it can tokenize a text without text length restrictions.'''
         
     def __init__(self, local_host='http://localhost', port=9999,
-                 whitespace_based=False, split_hyphen=False, step=5000):
+                 whitespace_based=False, split_hyphen=False, step=5000, char_budget=100000, pool=None):
         props = {'annotators': 'tokenize', 'outputFormat': 'json'} 
-        super().__init__(props, local_host, port, whitespace_based, split_hyphen, step)
+        super().__init__(props, local_host, port, whitespace_based, split_hyphen, step, char_budget, pool=pool)
         
     def tokenize(self, text, list_out=True):
         annotated_text = self.get_annotated_text(text)
@@ -104,7 +480,7 @@ class stanfordTokenizer(CoreNLP):
             if list_out: return out
             else: return ' '.join(out)
         except Exception as e:
-            print("\033[32mTokenizingError: \033[0m", e)
+            log_event("corenlp_error", f"\033[32mTokenizingError: \033[0m {e}", stage="tokenize", level="error", error=repr(e))
 
 
 class stanfordAnnotator(CoreNLP):
@@ -117,9 +493,9 @@ class stanfordAnnotator(CoreNLP):
     such tasks. Java is a more native, stable and realiable option as Standfore CoreNLP is written in Java.'''
     
     def __init__(self, local_host='http://localhost', port=9999,
-                 whitespace_based=True, split_hyphen=False, step=5000):
+                 whitespace_based=True, split_hyphen=False, step=5000, char_budget=100000, pool=None):
         props = {'annotators': 'tokenize,ssplit,pos,lemma', 'outputFormat': 'json'}
-        super().__init__(props, local_host, port, whitespace_based, split_hyphen, step)
+        super().__init__(props, local_host, port, whitespace_based, split_hyphen, step, char_budget, pool=pool)
     
     def _get_attr_values(self, text, attr, include_tokens):  
         annotated_text = self.get_annotated_text(text)
@@ -132,7 +508,7 @@ class stanfordAnnotator(CoreNLP):
             if not include_tokens: return out
             else: return text.split(), out
         except Exception as e:
-            print(e)
+            log_event("corenlp_error", str(e), stage="annotate", level="error", error=repr(e))
    
     def get_pos_tags(self, text, include_tokens=False):
         return self._get_attr_values(text, 'pos', include_tokens)
@@ -153,4 +529,214 @@ class stanfordAnnotator(CoreNLP):
             if not include_tokens: return pos, lemma 
             else: return text.split(), pos, lemma 
         except Exception as e:
-            print(e)
+            log_event("corenlp_error", str(e), stage="annotate", level="error", error=repr(e))
+
+
+class stanfordTokenAnnotator(CoreNLP):
+    '''A Stanford Tokenizer and Pos Tag and Lemma Annotator in one, i.e., the text is tokenized (with the same
+    props as stanfordTokenizer) and annotated in the same request, instead of being tokenized first and sent
+    back whitespace tokenized to the stanfordAnnotator. Like its parent class, it has no text length restrictions.'''
+    
+    def __init__(self, local_host='http://localhost', port=9999,
+                 whitespace_based=False, split_hyphen=False, step=5000, char_budget=100000, pool=None):
+        props = {'annotators': 'tokenize,ssplit,pos,lemma', 'outputFormat': 'json'}
+        super().__init__(props, local_host, port, whitespace_based, split_hyphen, step, char_budget, pool=pool)
+    
+    def tokenize_and_annotate(self, text):
+        '''Return the tokens of the text, their pos tags and lemmas, and the number of tokens of every sentence,
+        as a dict of lists ("tokens", "pos", "lemma", "sentences"), or None if the text cannot be annotated.'''
+        annotated_text = self.get_annotated_text(text)
+        if not annotated_text:
+            return
+        out = {"tokens": [], "pos": [], "lemma": [], "sentences": []}
+        try:
+            for t in annotated_text:
+                for s in t['sentences']:
+                    for token in s['tokens']:
+                        out["tokens"].append(token['originalText'])
+                        out["pos"].append(token['pos'])
+                        out["lemma"].append(token['lemma'])
+                    out["sentences"].append(len(s['tokens']))
+            return out
+        except Exception as e:
+            log_event("corenlp_error", f"\033[32mTokenizingError: \033[0m {e}", stage="tokenize,annotate", level="error",
+                      error=repr(e))
+
+
+class coreNLPServer:
+    '''One CoreNLP server of a coreNLPServerPool, at host:port. Also works with any HTTP server that answers
+    the same POST requests (e.g., a stub standing in for CoreNLP in tests).'''
+    
+    def __init__(self, host='http://localhost', port=9000, process=None):
+        self.url = f"{host}:{port}"
+        self.port = port
+        self.process = process
+        self.outstanding = 0
+        self.healthy = True
+        self.served = 0
+        self.failed = 0
+        self.timeouts = 0
+    
+    def annotate(self, text, properties=None, timeout=None):
+        return _post(self.url, properties, text, timeout)
+    
+    def is_live(self, timeout=5):
+        '''Health check by the /live endpoint of the CoreNLP server.'''
+        try:
+            return requests.get(self.url + "/live", timeout=timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+
+class coreNLPServerPool:
+    '''A pool of local CoreNLP servers that spreads the requests least-outstanding-first. A server that cannot be
+    reached (connection error, or max_timeouts timeouts in a row) is taken out of rotation and its request is 
+    retried on another server; a single timeout is raised to the caller, as it is more likely a slow request than a
+    dead server. When no server is left in rotation, coreNLPUnavailable (a ConnectionError) is raised. A background 
+    thread health-checks the servers out of rotation and brings them back once they are live again. 
+    The pool has the same annotate method as stanfordcorenlp.StanfordCoreNLP, so it can stand in for it in CoreNLP.
+    
+    Args (initialization):
+        - ports(list): the ports of the servers. 
+        - host(str): defaults to 'http://localhost'.
+        - corenlp_dir(str or None): the directory of the Stanford CoreNLP jars. When given, a server is launched
+        on each of the ports that no server is listening on yet. Otherwise, the pool only attaches to running servers.
+        - memory(str): the java heap size of a launched server, defaults to '4g'.
+        - request_timeout(float or None): the timeout of a request in seconds, defaults to None (no timeout).
+        - health_interval(float): how often (in seconds) to health-check the servers out of rotation, defaults to 10.
+        - startup_timeout(float): how long to wait for the servers to become live, defaults to 120 seconds.
+        - max_timeouts(int): the number of timeouts in a row after which a server is taken out of rotation, 
+        defaults to 3.
+    
+    ##############
+    Example usage:
+    ##############
+    
+    >>> pool = coreNLPServerPool([9001, 9002, 9003, 9004], corenlp_dir="stanford-corenlp-4.2.2/")
+    >>> sta = stanfordAnnotator(pool=pool)        # or sta.use_pool(pool) for an existing one
+    >>> pool.stats()                             # requests served/failed and health of every server
+    >>> pool.close()                             # also stops the servers the pool launched
+    '''
+    
+    def __init__(self, ports, host='http://localhost', corenlp_dir=None, memory='4g',
+                 request_timeout=None, health_interval=10, startup_timeout=120, max_timeouts=3):
+        self._servers = [coreNLPServer(host, port) for port in ports]
+        self._max_timeouts = max_timeouts
+        self._lock = Lock()
+        self._request_timeout = request_timeout
+        self._health_interval = health_interval
+        self._closed = Event()
+        
+        if corenlp_dir is not None:
+            for server in self._servers:
+                if not server.is_live(timeout=1):
+                    server.process = self._launch(corenlp_dir, server.port, memory)
+        self._wait_until_live(startup_timeout)
+        self._checker = Thread(target=self._health_checking, daemon=True)
+        self._checker.start()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+    
+    def __len__(self):
+        return len(self._servers)
+    
+    def _launch(self, corenlp_dir, port, memory):
+        args = ["java", f"-Xmx{memory}", "-cp", join(corenlp_dir, "*"),
+                "edu.stanford.nlp.pipeline.StanfordCoreNLPServer", "-port", str(port), "-quiet"]
+        return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    
+    def _wait_until_live(self, timeout):
+        deadline = time.time() + timeout
+        pending = list(self._servers)
+        while pending and time.time() < deadline:
+            pending = [server for server in pending if not server.is_live(timeout=1)]
+            if pending:
+                time.sleep(0.5)
+        for server in pending:
+            server.healthy = False
+            log_event("server_down", f"\033[31mCoreNLP server {server.url} is not live.\033[0m It is out of rotation until it is.",
+                      level="error", server=server.url)
+        if len(pending) == len(self._servers):
+            raise RuntimeError("None of the CoreNLP servers of the pool is live.")
+    
+    def _health_checking(self):
+        while not self._closed.wait(self._health_interval):
+            self.health_check()
+    
+    def health_check(self):
+        '''Health-check the servers out of rotation and bring back those that are live again.'''
+        for server in self._servers:
+            if not server.healthy and server.is_live():
+                with self._lock:
+                    server.healthy = True
+                    server.timeouts = 0
+                log_event("server_up", f"\033[32mCoreNLP server {server.url} is back in rotation.\033[0m", server=server.url)
+    
+    def _acquire(self, exclude):
+        with self._lock:
+            candidates = [s for s in self._servers if s.healthy and s not in exclude]
+            if not candidates:
+                return None
+            server = min(candidates, key=lambda s: s.outstanding)
+            server.outstanding += 1
+            return server
+    
+    def annotate(self, text, properties=None, timeout=None):
+        '''Send an annotation request to the healthy server with the fewest requests in flight, retrying on the
+        other servers when a server cannot be reached. Return the response text. The timeout (seconds) defaults 
+        to the request_timeout of the pool. Raise requests.Timeout if the request times out, and 
+        coreNLPUnavailable if no server is left in rotation.'''
+        tried = []
+        while True:
+            server = self._acquire(tried)
+            if server is None and not tried:
+                # every server is out of rotation: check them right away rather than wait for the checker
+                self.health_check()
+                server = self._acquire(tried)
+            if server is None:
+                raise coreNLPUnavailable("No healthy CoreNLP server left in the pool to take the request.")
+            try:
+                out = server.annotate(text, properties, timeout or self._request_timeout)
+                with self._lock:
+                    server.served += 1
+                    server.timeouts = 0
+                return out
+            except requests.Timeout:
+                with self._lock:
+                    server.failed += 1
+                    server.timeouts += 1
+                    evict = server.timeouts >= self._max_timeouts and server.healthy
+                    if evict:
+                        server.healthy = False
+                if evict:
+                    log_event("server_down", f"\033[31mCoreNLP server {server.url} timed out {server.timeouts} times in a row\033[0m, " \
+                              "out of rotation.", level="error", server=server.url, error="Timeout")
+                raise
+            except requests.ConnectionError as e:
+                with self._lock:
+                    server.healthy = False
+                    server.failed += 1
+                log_event("server_down", f"\033[31mCoreNLP server {server.url} failed\033[0m ({type(e).__name__}), out of rotation. " \
+                          "Retrying elsewhere.", level="error", server=server.url, error=type(e).__name__)
+                tried.append(server)
+            finally:
+                with self._lock:
+                    server.outstanding -= 1
+    
+    def stats(self):
+        '''Return the url, health, requests in flight, served, failed and timeouts in a row of every server.'''
+        with self._lock:
+            return [{"url": s.url, "healthy": s.healthy, "outstanding": s.outstanding, 
+                     "served": s.served, "failed": s.failed, "timeouts": s.timeouts} for s in self._servers]
+    
+    def close(self):
+        '''Stop the health checking and the servers launched by the pool.'''
+        self._closed.set()
+        for server in self._servers:
+            if server.process is not None:
+                server.process.terminate()
+                server.process = None
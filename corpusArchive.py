@@ -0,0 +1,227 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: Reading a corpus from a tar/zip archive and writing remade files into size-capped
+tar shards, without extracting millions of small files onto a metadata-heavy filesystem.
+
+The archive members are read sequentially in a streaming fashion. The remade files are appended
+to uncompressed tar shards (remade-00000.tar, remade-00001.tar, ...) that roll over at a byte cap,
+with a json lines index of every member's shard, data offset and size for random access. The shard
+processes of a corpus (see xmlRemaker.xmlCorpusRemaker) write shards and indexes of their own prefix,
+remade.shard-<i>-of-<n>, which load_archive_index merges when given the dst_dir.
+'''
+from os.path import join, exists, isfile, isdir, getsize
+from os import makedirs, listdir
+from threading import Lock
+import tarfile
+import zipfile
+import json
+import re
+import io
+
+
+archive_suffixes = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".zip")
+
+
+def is_archive(path):
+    '''Whether the path is a tar/zip archive file rather than a directory.'''
+    return isfile(path) and path.endswith(archive_suffixes)
+
+
+def strip_archive_suffix(path):
+    '''Strip the archive suffix from a path, e.g., corpus.tar.gz --> corpus.'''
+    for suffix in archive_suffixes:
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def _format_checker(file_format):
+    if not file_format:
+        return lambda name: True
+    file_format = tuple(file_format) if isinstance(file_format, list) else file_format
+    return lambda name: name.endswith(file_format)
+
+
+def scan_archive(archive_path, file_format=None):
+    '''Yield (member name, size, mtime) for the files in a tar/zip archive. For a compressed tar, this
+    reads through the whole archive once, as a compressed stream has no index to seek through.'''
+    checker = _format_checker(file_format)
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as z:
+            for info in z.infolist():
+                if not info.is_dir() and checker(info.filename):
+                    yield info.filename, info.file_size, 0
+    else:
+        with tarfile.open(archive_path, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and checker(member.name):
+                    yield member.name, member.size, member.mtime
+
+
+def iter_archive_members(archive_path, file_format=None, names=None):
+    '''Yield (member name, bytes) for the files in a tar/zip archive, reading the members sequentially in
+    the order they are stored. A tar archive (compressed or not) is read as a stream, never seeking back.
+
+    Args:
+        - archive_path(str): path to the .tar(.gz/.bz2/.xz)/.zip archive.
+        - file_format(str or tuple or None): When set, only yield members in the chosen format(s).
+        - names(set or None): When set, only yield the members with these names.
+    '''
+    checker = _format_checker(file_format)
+    wanted = lambda name: checker(name) and (names is None or name in names)
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as z:
+            # reading by the local header offsets keeps the reads sequential on disk
+            for info in sorted(z.infolist(), key=lambda i: i.header_offset):
+                if not info.is_dir() and wanted(info.filename):
+                    yield info.filename, z.read(info)
+    else:
+        with tarfile.open(archive_path, "r|*") as tar:
+            for member in tar:
+                if member.isfile() and wanted(member.name):
+                    yield member.name, tar.extractfile(member).read()
+
+
+class archiveShardWriter:
+    '''A thread-safe writer of remade files into size-capped, uncompressed tar shards.
+
+    Args (initialization):
+        - dst_dir(str): the directory to hold the tar shards and their index.
+        - prefix(str): the prefix of the shards, defaults to "remade", i.e., remade-00000.tar etc.
+        - max_bytes(int): the size cap of a shard, defaults to 1GB. A member larger than the cap gets a shard of its own.
+
+    The index (<prefix>.index.jsonl in the dst_dir) has one json line per member: [name, shard, offset, size],
+    where offset is the byte offset of the member's data within the shard, so that a member can be read
+    back by a single seek (see read_archive_member). The index is appended and flushed member by member,
+    so a run that dies halfway can be resumed: the members already indexed are known, and new members
+    always go into a new shard.
+    '''
+    def __init__(self, dst_dir, prefix="remade", max_bytes=1 << 30):
+        self._dst_dir = dst_dir
+        self._prefix = prefix
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+        self._index = {}
+        self._shard_num = 0
+        self._tar = None
+        makedirs(dst_dir, exist_ok=True)
+
+        self._index_path = join(dst_dir, prefix + ".index.jsonl")
+        if exists(self._index_path):
+            self._index = load_archive_index(self._index_path)
+            _drop_torn_line(self._index_path)
+            while exists(join(dst_dir, self._shard_name(self._shard_num))):
+                self._shard_num += 1
+        self._index_f = open(self._index_path, "a")
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _shard_name(self, num):
+        return "%s-%05d.tar" % (self._prefix, num)
+
+    def _open_shard(self):
+        self._tar = tarfile.open(join(self._dst_dir, self._shard_name(self._shard_num)), "w",
+                                 format=tarfile.PAX_FORMAT)
+        self._shard_num += 1
+
+    def members(self):
+        '''Return the names of the members written so far, including by previous runs.'''
+        return set(self._index)
+
+    def add(self, name, data):
+        '''Add a member with the given name and bytes to the current shard.'''
+        self._add(name, len(data), io.BytesIO(data))
+
+    def add_file(self, name, path):
+        '''Add a member with the given name and the content of the file at path to the current shard. The file is
+        copied in blocks, so that a large member is never held in memory as a whole.'''
+        with open(path, "rb") as f:
+            self._add(name, getsize(path), f)
+
+    def _add(self, name, size, fileobj):
+        with self._lock:
+            if self._tar is None or (self._tar.offset and self._tar.offset + size > self._max_bytes):
+                if self._tar is not None:
+                    self._tar.close()
+                self._open_shard()
+            info = tarfile.TarInfo(name)
+            info.size = size
+            self._tar.addfile(info, fileobj)
+            # the data reaches the shard before the index says it is there
+            self._tar.fileobj.flush()
+            blocks = -(-size // tarfile.BLOCKSIZE)
+            record = [name, self._shard_name(self._shard_num - 1), self._tar.offset - blocks * tarfile.BLOCKSIZE, size]
+            self._index[name] = tuple(record[1:])
+            self._index_f.write(json.dumps(record) + "\n")
+            self._index_f.flush()
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._tar.close()
+                self._tar = None
+            self._index_f.close()
+
+
+def _drop_torn_line(path):
+    '''Truncate a jsonl file after its last complete line, so that the lines appended next are not glued onto
+    one half written by a writer that died.'''
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def archive_index_paths(dst_dir, prefix="remade"):
+    '''Return the indexes of the tar shards in the dst_dir: <prefix>.index.jsonl and those of the shard
+    processes, <prefix>.shard-<i>-of-<n>.index.jsonl.'''
+    if not isdir(dst_dir):
+        return []
+    pattern = re.compile(re.escape(prefix) + r"(\.shard-\d+-of-\d+)?\.index\.jsonl")
+    return sorted(join(dst_dir, f) for f in listdir(dst_dir) if pattern.fullmatch(f))
+
+
+def load_archive_index(index_path, prefix="remade"):
+    '''Load the index written by archiveShardWriter as a dict: name --> (shard, offset, size). Given a
+    directory instead, merge the indexes of all the writers of that prefix in it (see archive_index_paths).'''
+    if isdir(index_path):
+        index = {}
+        for path in archive_index_paths(index_path, prefix):
+            index.update(load_archive_index(path))
+        return index
+    index = {}
+    with open(index_path, "r") as f:
+        lines = f.readlines()
+    for i, line in enumerate(lines):
+        try:
+            name, shard, offset, size = json.loads(line)
+        except ValueError:
+            if i == len(lines) - 1:
+                # the last line half written by a writer that died: its member is written again on resume
+                break
+            raise
+        index[name] = (shard, offset, size)
+    return index
+
+
+def read_archive_member(dst_dir, name, index=None, prefix="remade"):
+    '''Read a member written by archiveShardWriter back by a single seek, using the index (by default, the
+    merged indexes of the dst_dir, see load_archive_index).'''
+    if index is None:
+        index = load_archive_index(dst_dir, prefix)
+    shard, offset, size = index[name]
+    with open(join(dst_dir, shard), "rb") as f:
+        f.seek(offset)
+        return f.read(size)
@@ -0,0 +1,223 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: An on-disk inverted index over remade corpora and a KWIC (keyword in context) concordance
+query API, so that lookups such as "all Normalized=loveth" or "lemma=love with pos VBZ" take
+milliseconds instead of a full corpus scan.
+
+The index is a sqlite3 database mapping (attribute, value) --> (file id, token position) for the
+attributes of the word nodes written by xmlRemaker._build_new_body. It can be built from columnar
+token stores (see tokenStore.py), which is the fastest, or from the remade xml files themselves,
+loose (plain or compressed) or in tar shards (see corpusArchive.py). For the loose xml files, the
+byte offset of every word node is also kept, so that a KWIC window is read by seeking into the file.
+'''
+from utils import get_filenames_from_dir, scan_dir, compressed_suffixes
+from xmlHandler import open_xml
+from corpusArchive import load_archive_index, read_archive_member, archive_index_paths
+from tokenStore import tokenStore
+from os.path import join
+from array import array
+from html import unescape
+import sqlite3
+import re
+
+
+_word_node = re.compile(rb"<w(?=[\s>])([^>]*)>(.*?)</w>", re.S)
+_attr_pair = re.compile(rb'([\w.:-]+)="([^"]*)"')
+
+
+def _parse_word_nodes(data, start=0):
+    '''Yield (byte offset, {attr: value}) for the word nodes in the bytes of a remade xml file.
+    A word node without attributes gets its text as the Original.'''
+    for m in _word_node.finditer(data, start):
+        attrs = {k.decode(): unescape(v.decode("utf-8")) for k, v in _attr_pair.findall(m.group(1))}
+        if "Original" not in attrs:
+            attrs["Original"] = unescape(m.group(2).decode("utf-8").strip())
+        yield m.start(), attrs
+
+
+class corpusIndex:
+    '''An inverted index and concordance over a remade corpus, stored in a sqlite3 database.
+
+    Args (initialization):
+        - index_path(str): path to the index database, created if it does not exist.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> index = corpusIndex("concordance.sqlite")
+    # add the sources once (any of them):
+    >>> index.add_token_store(store_dir)                  # a tokenStore directory
+    >>> index.add_xml_dir(remade_dir)                    # loose remade xml files (plain or compressed)
+    >>> index.add_archive(remade_dir)                    # tar shards written with archive_out=True
+    # then query:
+    >>> index.lookup("lemma", "love")                    # [(filename, position), ...]
+    >>> index.query(lemma="love", pos="VBZ", window=5)   # [(filename, position, left, keyword, right), ...]
+    >>> index.print_query(Normalized="loveth")
+    '''
+    def __init__(self, index_path):
+        self._index_path = index_path
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, name TEXT, kind TEXT,
+                                              location TEXT, offsets BLOB);
+            CREATE TABLE IF NOT EXISTS postings (attr TEXT, value TEXT, file INTEGER, pos INTEGER,
+                                                 PRIMARY KEY (attr, value, file, pos)) WITHOUT ROWID;
+        ''')
+        self._stores = {}
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _add_file(self, name, kind, location, postings, offsets=None):
+        '''Add one file: postings is an iterable of (attr, value, pos).'''
+        cur = self._db.execute("INSERT INTO files (name, kind, location, offsets) VALUES (?, ?, ?, ?)",
+                               (name, kind, location, offsets))
+        file_id = cur.lastrowid
+        self._db.executemany("INSERT OR IGNORE INTO postings VALUES (?, ?, ?, ?)",
+                             ((attr, value, file_id, pos) for attr, value, pos in postings))
+        return file_id
+
+    def _indexed(self, kind, location):
+        return {name for (name,) in self._db.execute("SELECT name FROM files WHERE kind=? AND location=?",
+                                                     (kind, location))}
+
+    def add_token_store(self, store_dir):
+        '''Index all the documents of a token store (see tokenStore.py). Documents already indexed are skipped.'''
+        store = tokenStore(store_dir)
+        done = self._indexed("store", store_dir)
+        for name in store.doc_names():
+            if name in done:
+                continue
+            doc = store.doc(name)
+            postings = []
+            for attr in ("Original", "Normalized", "pos", "lemma"):
+                ids = doc[attr]
+                if len(ids) and ids.any():
+                    postings += [(attr, store.vocab[i], pos) for pos, i in enumerate(ids.tolist()) if i]
+            self._add_file(name, "store", store_dir, postings)
+        self._db.commit()
+
+    def add_xml_file(self, filepath, name=None):
+        '''Index a remade xml file (plain or compressed), keeping the byte offset of every word node.
+        The file is named by its filepath in the query results unless a name is given.'''
+        with open_xml(filepath) as f:
+            data = f.read()
+        postings, offsets = [], array("Q")
+        for pos, (offset, attrs) in enumerate(_parse_word_nodes(data)):
+            offsets.append(offset)
+            postings += [(attr, value, pos) for attr, value in attrs.items()]
+        # a compressed file cannot be seeked into, so no offsets are kept for it
+        plain = not filepath.endswith(compressed_suffixes)
+        self._add_file(name or filepath, "xml", filepath, postings, offsets.tobytes() if plain else None)
+
+    def add_xml_dir(self, remade_dir):
+        '''Index the remade xml files (plain or compressed) in a directory. Files already indexed are skipped.'''
+        done = {loc for (loc,) in self._db.execute("SELECT location FROM files WHERE kind='xml'")}
+        for f in get_filenames_from_dir(remade_dir, False, ".xml", include_compressed=True):
+            filepath = join(remade_dir, f)
+            if filepath not in done:
+                self.add_xml_file(filepath, f)
+        self._db.commit()
+
+    def add_archive(self, dst_dir, prefix="remade"):
+        '''Index the remade xml files in the tar shards written by corpusArchive.archiveShardWriter, those of
+        every shard process included.'''
+        index = load_archive_index(dst_dir, prefix)
+        done = self._indexed("archive", dst_dir)
+        for name in index:
+            if name in done:
+                continue
+            data = open_xml(read_archive_member(dst_dir, name, index)).read()
+            postings = [(attr, value, pos) for pos, (_, attrs) in enumerate(_parse_word_nodes(data))
+                        for attr, value in attrs.items()]
+            self._add_file(name, "archive", dst_dir, postings)
+        self._db.commit()
+
+    def add_remade_dir(self, remade_dir):
+        '''Index whatever a remade corpus directory has: its token stores if any (fastest), otherwise
+        its tar shards if any, otherwise its remade xml files.'''
+        stores = sorted(join(remade_dir, d[:-len("/docs.jsonl")]) for d in scan_dir(remade_dir, True)
+                        if d.endswith("/docs.jsonl") and d.count("/") == 1)
+        if stores:
+            for store_dir in stores:
+                self.add_token_store(store_dir)
+        elif archive_index_paths(remade_dir):
+            self.add_archive(remade_dir)
+        else:
+            self.add_xml_dir(remade_dir)
+
+    def lookup(self, attr, value):
+        '''Return the (filename, position) pairs of the word tokens whose attr equals value.'''
+        return self.lookup_all(**{attr: value})
+
+    def lookup_all(self, **conditions):
+        '''Return the (filename, position) pairs of the word tokens meeting all the attr=value conditions.'''
+        return [(name, pos) for _, name, pos in self._hits(conditions)]
+
+    def _hits(self, conditions):
+        '''Return the (file id, filename, position) of the word tokens meeting all the attr=value conditions. The id
+        tells apart the files of the same name from different sources (e.g., f0.xml of two corpora).'''
+        assert conditions, "At least one attr=value condition is needed, e.g., lemma='love'."
+        sql = " INTERSECT ".join(["SELECT file, pos FROM postings WHERE attr=? AND value=?"] * len(conditions))
+        params = [x for pair in conditions.items() for x in pair]
+        return self._db.execute(f"SELECT files.id, files.name, hits.pos FROM ({sql}) AS hits JOIN files ON "
+                                "files.id = hits.file ORDER BY hits.file, hits.pos", params).fetchall()
+
+    def _file(self, file_id):
+        return self._db.execute("SELECT name, kind, location, offsets FROM files WHERE id=?", (file_id,)).fetchone()
+
+    def _window(self, file_id, start, end, attr):
+        '''Return the attr values of the word tokens in [start, end) of a file.'''
+        name, kind, location, offsets = self._file(file_id)
+        start = max(start, 0)
+        if kind == "store":
+            if location not in self._stores:
+                self._stores[location] = tokenStore(location)
+            store = self._stores[location]
+            return store.decode(store.doc(name)[attr][start:end])
+        if kind == "xml" and offsets:
+            offsets = array("Q", offsets)
+            end = min(end, len(offsets))
+            with open(location, "rb") as f:
+                f.seek(offsets[start])
+                # read up to the start of the word node after the window, or to the end of the file
+                data = f.read(offsets[end] - offsets[start]) if end < len(offsets) else f.read()
+            values = [attrs.get(attr, "") for _, attrs in _parse_word_nodes(data)]
+            return values[:end - start]
+        data = read_archive_member(location, name) if kind == "archive" else None
+        data = open_xml(data if data is not None else location).read()
+        values = [attrs.get(attr, "") for _, attrs in _parse_word_nodes(data)]
+        return values[start:end]
+
+    def query(self, window=5, limit=None, context_attr="Original", **conditions):
+        '''Return KWIC windows for the word tokens meeting all the attr=value conditions.
+
+        Args:
+            - window(int): number of tokens to show on each side of the keyword, defaults to 5.
+            - limit(int or None): the maximum number of hits to return. Defaults to None (all).
+            - context_attr(str): the attribute to show for the keyword and its context, defaults to "Original".
+            - conditions: attr=value conditions, e.g., lemma="love", pos="VBZ".
+
+        Return(list):
+            A list of (filename, position, left context, keyword, right context) tuples.
+        '''
+        out = []
+        for file_id, name, pos in self._hits(conditions)[:limit]:
+            values = self._window(file_id, pos - window, pos + window + 1, context_attr)
+            k = min(pos, window)
+            out.append((name, pos, ' '.join(values[:k]), values[k] if k < len(values) else "",
+                        ' '.join(values[k+1:])))
+        return out
+
+    def print_query(self, window=5, limit=20, context_attr="Original", **conditions):
+        '''Print KWIC windows for the word tokens meeting all the attr=value conditions.'''
+        hits = self.query(window, limit, context_attr, **conditions)
+        print(f"Showing {len(hits)} hits for {conditions}:\n")
+        for name, pos, left, keyword, right in hits:
+            print(f"{name[-30:]:>30}{pos:>8}  {left[-50:]:>50} \033[1m{keyword}\033[0m {right[:50]}")
@@ -0,0 +1,221 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A lazy corpus manifest for very large corpus directories (e.g., a million xml files on NFS).
+
+The manifest captures every file's name, size and mtime in a single os.scandir pass, can be saved
+to and loaded from disk, refreshed incrementally by mtime, and computes the remaining files to
+process by a set difference against one scan of the destination directory, instead of one
+exists() call per file. It also provides the deterministic split of a corpus into shards, so that 
+several processes or hosts sharing a filesystem can remake disjoint parts of it with no coordination.
+'''
+from utils import scan_dir
+from corpusArchive import is_archive, scan_archive
+from remakeLogger import log_event
+from os.path import exists, basename, abspath
+from os import replace, getpid
+import hashlib
+import json
+import random
+
+
+class corpusManifest:
+    '''A name -> (size, mtime) manifest of the files in a corpus directory.
+
+    Args (initialization):
+        - corpus_dir(str): corpus directory, or a .tar/.zip archive of the corpus (see corpusArchive.py).
+        - include_sub_dir(bool): whether to include the files within the sub_dir, defaults to False.
+        - file_format(str or tuple or None): When set, only keep files in the chosen format(s).
+        - manifest_path(str or None): where to persist the manifest. If the file exists, the manifest is
+        loaded from it and refreshed by mtime. Otherwise, the corpus_dir is scanned and the manifest saved there.
+        A manifest saved for another corpus_dir, include_sub_dir or file_format is not used: the corpus_dir is 
+        scanned anew and the manifest replaced.
+        - refresh(bool): defaults to True. When False, an existing manifest is loaded as it is, neither refreshed nor
+        rewritten, e.g., by the shard processes sharing one manifest, so that they all see the same files and sizes.
+        A manifest saved with other settings then raises ValueError, as it cannot be replaced.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> manifest = corpusManifest(corpus_dir, file_format=".xml", manifest_path="corpus.manifest")
+    >>> manifest.filenames()               # sorted filenames
+    >>> manifest.total_bytes()             # corpus size
+    >>> added, modified, removed = manifest.refresh()  # pick up the changes since the last scan
+    >>> manifest.remaining(dst_dir)        # filenames that have no remade file in dst_dir yet
+    '''
+    def __init__(self, corpus_dir, include_sub_dir=False, file_format=None, manifest_path=None, refresh=True):
+        self._corpus_dir = corpus_dir
+        self._include_sub_dir = include_sub_dir
+        self._file_format = tuple(file_format) if isinstance(file_format, list) else file_format
+        self._manifest_path = manifest_path
+        self._entries = {}
+
+        loaded = False
+        if manifest_path and exists(manifest_path):
+            try:
+                self.load(manifest_path)
+                loaded = True
+            except ValueError as e:
+                if not refresh:
+                    raise
+                log_event("manifest_mismatch", f"\033[31m{e}\033[0m It is replaced by a full scan.", manifest_path,
+                          "manifest", "warning")
+        if loaded:
+            if refresh:
+                self.refresh()
+                self.save(manifest_path)
+        else:
+            self.scan()
+            if manifest_path:
+                self.save(manifest_path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        '''Iterate over (filename, size, mtime) tuples.'''
+        for name, (size, mtime) in self._entries.items():
+            yield name, size, mtime
+
+    def __contains__(self, filename):
+        return filename in self._entries
+
+    def _scan(self):
+        if is_archive(self._corpus_dir):
+            return scan_archive(self._corpus_dir, self._file_format)
+        return scan_dir(self._corpus_dir, self._include_sub_dir, self._file_format, with_stat=True)
+
+    def scan(self):
+        '''(Re-)build the manifest from a single scandir pass over the corpus_dir.'''
+        self._entries = {name: (size, mtime) for name, size, mtime in self._scan()}
+
+    def refresh(self):
+        '''Re-scan the corpus_dir and update the manifest by mtime and size.
+
+        Return(tuple): lists of (added, modified, removed) filenames.'''
+        added, modified, old = [], [], self._entries
+        self._entries = {}
+        for name, size, mtime in self._scan():
+            self._entries[name] = (size, mtime)
+            if name not in old:
+                added.append(name)
+            elif old[name] != (size, mtime):
+                modified.append(name)
+        removed = [name for name in old if name not in self._entries]
+        return added, modified, removed
+
+    def save(self, manifest_path=None):
+        '''Save the manifest as json lines. The first line holds the scanning settings. The file is replaced
+        at once, so that a process loading it meanwhile never reads it half written.'''
+        manifest_path = manifest_path or self._manifest_path
+        tmp = f"{manifest_path}.{getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps({"corpus_dir": self._corpus_dir, "include_sub_dir": self._include_sub_dir,
+                                "file_format": self._file_format}) + "\n")
+            for name, (size, mtime) in self._entries.items():
+                f.write(json.dumps([name, size, mtime]) + "\n")
+        replace(tmp, manifest_path)
+
+    def _settings(self, corpus_dir, include_sub_dir, file_format):
+        file_format = tuple(file_format) if isinstance(file_format, list) else file_format
+        return abspath(corpus_dir), bool(include_sub_dir), file_format
+
+    def load(self, manifest_path=None):
+        '''Load a manifest saved by save(). Files are not re-scanned, call refresh() for that. Raise ValueError
+        if the manifest was saved for another corpus_dir, include_sub_dir or file_format than those of this one.'''
+        manifest_path = manifest_path or self._manifest_path
+        with open(manifest_path, "r") as f:
+            settings = json.loads(next(f))
+            saved = self._settings(settings["corpus_dir"], settings["include_sub_dir"], settings["file_format"])
+            if saved != self._settings(self._corpus_dir, self._include_sub_dir, self._file_format):
+                raise ValueError(f"The manifest {manifest_path} was saved for corpus_dir={settings['corpus_dir']!r}, " \
+                                 f"include_sub_dir={settings['include_sub_dir']!r}, file_format={settings['file_format']!r}.")
+            self._entries = {}
+            for line in f:
+                name, size, mtime = json.loads(line)
+                self._entries[name] = (size, mtime)
+
+    def filenames(self, shuffle=False):
+        '''Return a list of the filenames, sorted unless shuffle=True.'''
+        filenames = list(self._entries)
+        if shuffle:
+            random.shuffle(filenames)
+        else:
+            filenames.sort()
+        return filenames
+
+    def size(self, filename):
+        return self._entries[filename][0]
+
+    def mtime(self, filename):
+        return self._entries[filename][1]
+
+    def total_bytes(self, filenames=None):
+        if filenames is None:
+            return sum(size for size, _ in self._entries.values())
+        return sum(self._entries[f][0] for f in filenames)
+
+    def remaining(self, dst_dir, filenames=None, include_stale=False, out_name=basename):
+        '''Return the filenames that have no remade file in the dst_dir, by a set difference against
+        a single scan of the dst_dir. Remade files are matched by basename, as the remade corpus
+        does not keep the sub_dirs.
+
+        Args:
+            - dst_dir(str): the directory holding the remade files.
+            - filenames(list or None): the filenames to check, in order. Defaults to all filenames, sorted.
+            - include_stale(bool): also return the files modified after their remade file was made.
+            - out_name(func): maps a filename to the name of its remade file, defaults to basename.
+        '''
+        filenames = self.filenames() if filenames is None else filenames
+        if not exists(dst_dir):
+            return list(filenames)
+        done = {name: mtime for name, _, mtime in scan_dir(dst_dir, with_stat=include_stale)} \
+               if include_stale else dict.fromkeys(scan_dir(dst_dir))
+        out = []
+        for f in filenames:
+            fn_out = out_name(f)
+            if fn_out not in done:
+                out.append(f)
+            elif include_stale and f in self._entries and self._entries[f][1] > done[fn_out]:
+                out.append(f)
+        return out
+
+
+def _stable_hash(filename):
+    '''A hash of the filename that is the same in every process and on every machine, 
+    unlike the builtin hash(), which is salted per process.'''
+    return int(hashlib.md5(filename.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def shard_filenames(filenames, shard_index, shard_count, sizes=None):
+    '''Return the filenames that belong to the given shard. Every process that calls this with the same
+    filenames (and sizes) gets the same disjoint split without any coordination.
+    
+    Args:
+        - filenames(list): the filenames to split, in order. The order of the returned filenames is kept.
+        - shard_index(int): the shard to return, in [0, shard_count).
+        - shard_count(int): total number of shards.
+        - sizes(dict or None): filename -> byte size. When given, the files are balanced by byte size
+        (largest first, each to the currently lightest shard) instead of split by a stable hash. All the
+        processes must then see the same sizes, e.g., by sharing a persisted corpusManifest.
+    
+    Return(list): the filenames of the shard.'''
+    
+    if not isinstance(shard_count, int) or shard_count < 1:
+        raise ValueError("shard_count must be a positive integer.")
+    if not isinstance(shard_index, int) or not 0 <= shard_index < shard_count:
+        raise ValueError(f"shard_index must be an integer in [0, {shard_count}).")
+    
+    if sizes is None:
+        return [f for f in filenames if _stable_hash(f) % shard_count == shard_index]
+    
+    loads = [0] * shard_count
+    mine = set()
+    for f in sorted(filenames, key=lambda f: (-sizes[f], f)):
+        lightest = min(range(shard_count), key=lambda i: (loads[i], i))
+        loads[lightest] += sizes[f]
+        if lightest == shard_index:
+            mine.add(f)
+    return [f for f in filenames if f in mine]
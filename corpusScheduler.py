@@ -0,0 +1,203 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: Memory-aware admission control for the multitasking corpus runs of xmlRemaker, so that a batch of
+large bodies no longer gets the workers OOM-killed, while the small ones run as many at a time as fit.
+
+The memory a file needs while being remade (its bs4 tree, several full-size strings, the joined new body)
+is estimated as its size times a ratio, which starts at a conservative guess and is then learned from what
+the runs actually use. A monitor thread samples the memory in use (the process RSS, or the Python heap with
+tracemalloc) and, as the memory over the baseline is shared by the files in flight, attributes it to them in
+proportion to their sizes. The peak ratio observed for each file feeds the estimates of the files of its size
+class (sizes within a factor of 4), which use a high percentile of the recent ratios of the class, as the
+memory per byte of a small file says little about that of a large one. A file is admitted when the estimates
+of the files in flight plus its own fit in the budget and the memory measured is below it, or when nothing
+else is in flight. The first file of a size class not seen yet waits until nothing else is in flight, since
+its estimate is only a guess.
+'''
+from threading import Thread, Condition, Event
+from collections import deque
+import tracemalloc
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+_units = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+
+
+def parse_bytes(size):
+    '''Return a size given as an int or as a str such as "512m" or "4g" in bytes.'''
+    if isinstance(size, str) and size and size[-1].lower() in _units:
+        return int(float(size[:-1]) * _units[size[-1].lower()])
+    return int(size)
+
+
+def process_rss():
+    '''Return the resident set size of the current process in bytes, or None if it cannot be read.'''
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class memoryScheduler:
+    '''Admit the files of a corpus run under a memory budget, learning the memory per byte of input. Thread-safe.
+
+    Args (initialization):
+        - budget(int or str): the memory budget of the run, e.g., "4g", counted over the memory in use at the start.
+        - max_workers(int): the maximum number of files in flight, whatever the budget. Defaults to 10.
+        - ratio(float): the initial guess of the peak memory of a file per byte of it. Defaults to 20.
+        - use_tracemalloc(bool): measure the Python heap with tracemalloc instead of the process RSS, which is more
+        precise but slows the run down. Defaults to False. The RSS is used anyway when it cannot be read.
+        - interval(float): the seconds between two memory samples. Defaults to 0.05.
+        - window(int): the number of recent files per size class whose peak ratios the estimates are made from.
+        Defaults to 50.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> scheduler = memoryScheduler("4g", max_workers=10)
+    >>> if scheduler.try_admit(filename, size):   # or scheduler.admit(filename, size), which blocks until it fits
+    ...     remake(filename)
+    ...     scheduler.release(filename)            # {"est_bytes": ..., "peak_bytes": ...}
+    >>> scheduler.stats()
+    >>> scheduler.close()
+    '''
+    def __init__(self, budget, max_workers=10, ratio=20.0, use_tracemalloc=False, interval=0.05, window=50):
+        self._budget = parse_bytes(budget)
+        self._max_workers = max_workers
+        self._initial_ratio = ratio
+        self._window = window
+        # size class --> the peak ratios of the recent files
+        self._ratios = {}
+        self._tracemalloc = use_tracemalloc or process_rss() is None
+        self._started_tracing = self._tracemalloc and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+        self._baseline = self._memory()
+        self._cond = Condition()
+        # key --> [size, estimate, peak ratio]
+        self._in_flight = {}
+        self._reserved = 0
+        self._used = 0
+        self._peak_used = 0
+        self._admitted = 0
+        self._waits = 0
+        self._done = Event()
+        self._monitor = Thread(target=self._monitoring, args=(interval,), daemon=True)
+        self._monitor.start()
+
+    def _memory(self):
+        if self._tracemalloc:
+            return tracemalloc.get_traced_memory()[0]
+        return process_rss()
+
+    def _monitoring(self, interval):
+        while not self._done.wait(interval):
+            memory = self._memory()
+            with self._cond:
+                if not self._in_flight:
+                    # what is still in use with no file in flight (e.g., memory the allocator keeps) is the new baseline
+                    self._baseline = max(self._baseline, memory)
+                used = max(0, memory - self._baseline)
+                self._peak_used = max(self._peak_used, used)
+                total = sum(rec[0] for rec in self._in_flight.values())
+                if total:
+                    # the memory over the baseline is shared by the files in flight in proportion to their sizes
+                    for rec in self._in_flight.values():
+                        rec[2] = max(rec[2], used / total)
+                self._used = used
+                self._cond.notify_all()
+
+    @staticmethod
+    def _size_class(size):
+        return size.bit_length() // 2
+
+    def ratio(self, size):
+        '''Return the current peak memory per byte of input for a file of the given size: the 90th percentile of
+        the recent files of its size class, or else of the nearest class, but not less than the initial guess.'''
+        with self._cond:
+            return self._ratio(size)
+
+    def _ratio(self, size):
+        size_class = self._size_class(size)
+        if size_class in self._ratios:
+            ratios = sorted(self._ratios[size_class])
+            return ratios[int(0.9 * (len(ratios) - 1))]
+        if not self._ratios:
+            return self._initial_ratio
+        nearest = min(self._ratios, key=lambda c: abs(c - size_class))
+        ratios = sorted(self._ratios[nearest])
+        return max(self._initial_ratio, ratios[int(0.9 * (len(ratios) - 1))])
+
+    def estimate(self, size):
+        '''Return the estimated peak memory (bytes) of remaking a file of the given size (bytes).'''
+        return int(size * self.ratio(size))
+
+    def _fits(self, size, estimate):
+        if not self._in_flight:
+            return True
+        if self._size_class(size) not in self._ratios or len(self._in_flight) >= self._max_workers:
+            return False
+        # the estimates decide, unless the memory measured says the budget is already used up
+        return self._reserved + estimate <= self._budget and self._used < self._budget
+
+    def try_admit(self, key, size):
+        '''Admit a file if it fits in the budget now. Return whether it was admitted.'''
+        with self._cond:
+            estimate = int(size * self._ratio(size))
+            if not self._fits(size, estimate):
+                return False
+            if not self._in_flight:
+                # what the files done with left in use is not the new file's
+                self._baseline = max(self._baseline, self._memory())
+                self._used = 0
+            self._in_flight[key] = [size, estimate, 0.0]
+            self._reserved += estimate
+            self._admitted += 1
+            return True
+
+    def admit(self, key, size):
+        '''Admit a file, waiting until it fits in the budget.'''
+        while not self.try_admit(key, size):
+            self.wait()
+
+    def wait(self, timeout=1.0):
+        '''Wait until a file is released or the memory in use is sampled again.'''
+        with self._cond:
+            self._waits += 1
+            self._cond.wait(timeout)
+
+    def release(self, key):
+        '''Release a file done with. Return its estimated and observed peak memory in bytes.'''
+        with self._cond:
+            size, estimate, peak_ratio = self._in_flight.pop(key)
+            self._reserved -= estimate
+            if size:
+                # a file fitting in memory the allocator already holds shows no growth, but needs its size at least
+                self._ratios.setdefault(self._size_class(size), deque(maxlen=self._window)).append(max(peak_ratio, 1.0))
+            self._cond.notify_all()
+        return {"est_bytes": estimate, "peak_bytes": int(size * peak_ratio) if peak_ratio else None}
+
+    def stats(self):
+        '''Return the budget, the peak memory used over the baseline, the current ratio per size class (by the
+        smallest size of the class), the number of files admitted and the number of times admission had to wait.'''
+        with self._cond:
+            ratios = {1 << (2 * c): round(self._ratio(1 << (2 * c)), 2) for c in sorted(self._ratios)}
+            return {"budget": self._budget, "peak_used": self._peak_used, "ratios": ratios,
+                    "admitted": self._admitted, "waits": self._waits, "measure": "tracemalloc" if self._tracemalloc else "rss"}
+
+    def close(self):
+        self._done.set()
+        self._monitor.join()
+        if self._started_tracing:
+            tracemalloc.stop()
@@ -8,18 +8,28 @@ including:
     - debugging the config folder files' formats;
     - debugging the transformation rules as stored in the config folder;
     - debugging whether the normalized xml files has flawless words alignments;
-    - debugging the words misalignments that prevents the re-making of the xml files.
+    - debugging the words misalignments that prevents the re-making of the xml files;
+    - linting the transformation rules for catastrophic backtracking (ReDoS) patterns and
+    profiling every rule against a corpus sample.
 
 Moreover, print_attr_diff_in_xml_word_nodes method can be used for post hoc analysis:
     - (1), check whether every word node has the attributes we plug in;
     - (2) the differences between two interested attributes (e.g., historical vs. normalized spellings).
 '''
 from utils import *
+from utils import _trans_rule_pattern, _compile_trans_rule
 from xmlHandler import *
 from textPreprocessor import *
 from textNormalizer import *
+from remakeLogger import log_event
 from os.path import exists
 from os import mkdir
+from time import perf_counter
+import string
+try:
+    from re import _parser as sre_parse
+except ImportError: 
+    import sre_parse
 
 
 config_path = "./config/"
@@ -254,20 +264,18 @@ def words_misalignments_logger(filepath, tokenized_lst, compared_lst, name="Norm
     '''
     
     filename = filepath.split("/")[-1] + ".txt"
+    log_path = f"./word misalignment logger/{filename}"
     t_len, n_len = len(tokenized_lst), len(compared_lst)
-    
-    if not exists("./word misalignment logger/"):
-        mkdir("./word misalignment logger/")
-        print("./word misalignment logger/ directory has been created!")
         
-    if exists(f"./word misalignment logger/{filename}"):
-        print(f"The word misalignment in ./word misalignment logger/{filename} has been logged already. Do remember check!")
+    if exists(log_path):
+        log_event("misalignment_logged", f"The word misalignment in {log_path} has been logged already. Do remember check!",
+                  filepath, name, "warning", log=log_path)
         return
     
-    fw = open(f"./word misalignment logger/{filename}", "w")
-    fw.write(f"Original filepath: {filepath}, tokenized token numbers: {t_len}, normalized token numbers: {n_len}\n")
+    # the log is written by the logger's thread (see remakeLogger.py), which creates the folder if need be
+    lines = [f"Original filepath: {filepath}, tokenized token numbers: {t_len}, normalized token numbers: {n_len}\n"]
     temp = "{0}\t{1}\t{2}\n"
-    fw.write(temp.format("Word Index", "Preprocessed", name))
+    lines.append(temp.format("Word Index", "Preprocessed", name))
 
     # make two copies of the tokenized_lst and the compared_lst
     tk_lst = tokenized_lst.copy()
@@ -303,10 +311,302 @@ def words_misalignments_logger(filepath, tokenized_lst, compared_lst, name="Norm
         right = idx + context_window + 1
         i = left
         for pair in combine[left: right]:
-            fw.write(temp.format(i, pair[0], pair[1]))
+            lines.append(temp.format(i, pair[0], pair[1]))
             i += 1
 
-        fw.write("\n")
+        lines.append("\n")
+        
+    log_event("misalignment_logged", f"\033[1mThe word misalignment in {log_path} has been logged! Please check it out!\033[0m",
+              filepath, name, "warning", attachment=(log_path, "".join(lines)), tokens=t_len, values=n_len,
+              misaligned_at=misalign_idx)
+
+
+_PROBE_CHARS = set(string.printable) | set("ſ嗨’éæ")
+_REPEATS = tuple(op for op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, 
+                               getattr(sre_parse, "POSSESSIVE_REPEAT", None)) if op is not None)
+_CATEGORY_TESTS = {
+    sre_parse.CATEGORY_DIGIT: str.isdigit,
+    sre_parse.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_parse.CATEGORY_SPACE: str.isspace,
+    sre_parse.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_parse.CATEGORY_WORD: lambda c: c.isalnum() or c == "_",
+    sre_parse.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == "_"),
+}
+
+
+def _in_alphabet(items):
+    '''Probe chars matched by a character class, i.e., an IN node of a parsed regex.'''
+    chars, negate = set(), False
+    for op, av in items:
+        if op is sre_parse.NEGATE:
+            negate = True
+        elif op is sre_parse.LITERAL:
+            chars |= {chr(av).lower(), chr(av).upper()}
+        elif op is sre_parse.RANGE:
+            chars |= {c for c in _PROBE_CHARS if av[0] <= ord(c.lower()) <= av[1] 
+                      or av[0] <= ord(c.upper()) <= av[1]}
+        elif op is sre_parse.CATEGORY:
+            chars |= set(filter(_CATEGORY_TESTS.get(av, lambda c: True), _PROBE_CHARS))
+    return _PROBE_CHARS - chars if negate else chars
+
+
+def _alphabet(subpattern):
+    '''Probe chars that a parsed (sub)pattern can consume anywhere in a match.'''
+    chars = set()
+    for op, av in subpattern:
+        if op is sre_parse.LITERAL:
+            chars |= {chr(av).lower(), chr(av).upper()}
+        elif op is sre_parse.NOT_LITERAL:
+            chars |= _PROBE_CHARS - {chr(av).lower(), chr(av).upper()}
+        elif op is sre_parse.ANY:
+            chars |= _PROBE_CHARS - {"\n"}
+        elif op is sre_parse.IN:
+            chars |= _in_alphabet(av)
+        elif op in _REPEATS:
+            chars |= _alphabet(av[2])
+        elif op is sre_parse.SUBPATTERN:
+            chars |= _alphabet(av[-1])
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                chars |= _alphabet(branch)
+        elif op is sre_parse.GROUPREF:
+            chars |= _PROBE_CHARS
+        elif op is getattr(sre_parse, "ATOMIC_GROUP", None):
+            chars |= _alphabet(av)
+    return chars
+
+
+def _can_be_empty(subpattern):
+    '''Whether a parsed (sub)pattern can match the empty string.'''
+    for op, av in subpattern:
+        if op in _REPEATS:
+            if av[0] > 0 and not _can_be_empty(av[2]):
+                return False
+        elif op is sre_parse.SUBPATTERN:
+            if not _can_be_empty(av[-1]):
+                return False
+        elif op is sre_parse.BRANCH:
+            if not any(_can_be_empty(b) for b in av[1]):
+                return False
+        elif op not in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            return False
+    return True
+
+
+def _first_chars(subpattern):
+    '''Probe chars that a parsed (sub)pattern can start a match with.'''
+    chars = set()
+    for item in subpattern:
+        op, av = item
+        if op in _REPEATS:
+            chars |= _first_chars(av[2])
+        elif op is sre_parse.SUBPATTERN:
+            chars |= _first_chars(av[-1])
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                chars |= _first_chars(branch)
+        else:
+            chars |= _alphabet([item])
+        if not _can_be_empty([item]):
+            break
+    return chars
+
+
+def _unbounded_repeats(subpattern):
+    '''Yield the bodies of all the unbounded repeats (*, +, {n,}) inside a parsed (sub)pattern.'''
+    for op, av in subpattern:
+        if op in _REPEATS:
+            if av[1] == sre_parse.MAXREPEAT:
+                yield av[2]
+            else:
+                yield from _unbounded_repeats(av[2])
+        elif op is sre_parse.SUBPATTERN:
+            yield from _unbounded_repeats(av[-1])
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                yield from _unbounded_repeats(branch)
+
+
+def _redos_issues(subpattern):
+    '''Find the catastrophic backtracking constructs in a parsed (sub)pattern. Returns a list
+    of (severity, reason) pairs, where severity is either "exponential" or "polynomial".'''
+    issues = []
+    items = list(subpattern)
+    pending = None # alphabet of the last unbounded repeat that nothing non-empty has followed yet
+    for idx, (op, av) in enumerate(items):
+        if op in _REPEATS:
+            low, high, body = av
+            body_items = list(_flatten_groups(body))
+            if high == sre_parse.MAXREPEAT:
+                body_chars = _alphabet(body)
+                # (1) nested quantifiers, such as (a+)+ or (\w+\s?)*
+                for j, item in enumerate(body_items):
+                    for inner in _unbounded_repeats([item]):
+                        rest = body_items[:j] + body_items[j+1:]
+                        if _can_be_empty(rest) or _alphabet(inner) & _alphabet(rest):
+                            issues.append(("exponential", "nested quantifiers can match the same input in many ways"))
+                            break
+                # (2) quantified alternation with overlapping branches, such as (a|ab)*
+                for item_op, item_av in body_items:
+                    if item_op is sre_parse.BRANCH:
+                        # an empty branch hands over to the next round of the repeat
+                        firsts = [_first_chars(b) | (_first_chars(body) if _can_be_empty(b) else set())
+                                  for b in item_av[1]]
+                        if any(firsts[i] & firsts[j] for i in range(len(firsts)) for j in range(i)):
+                            issues.append(("exponential", "quantified alternation with overlapping branches"))
+                # (3) adjacent unbounded quantifiers over overlapping chars, such as \s*\s* or \w+\w*
+                if pending is not None and pending & body_chars:
+                    issues.append(("polynomial", "adjacent quantifiers can trade the same chars"))
+                pending = body_chars
+            elif not _can_be_empty([items[idx]]):
+                pending = None
+            issues += _redos_issues(body)
+        elif op is sre_parse.SUBPATTERN:
+            issues += _redos_issues(av[-1])
+            if not _can_be_empty(av[-1]):
+                pending = None
+        elif op is sre_parse.BRANCH:
+            for branch in av[1]:
+                issues += _redos_issues(branch)
+            pending = None
+        elif op not in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            pending = None
+    return issues
+
+
+def _flatten_groups(items):
+    '''Yield the nodes in a list of parsed nodes, looking through (non-repeated) groups.'''
+    for op, av in items:
+        if op is sre_parse.SUBPATTERN:
+            yield from _flatten_groups(av[-1])
+        else:
+            yield op, av
+
+
+def trans_rules_redos_linter(rules, print_msg=True):
+    '''Statically check the transformation rules for catastrophic backtracking (ReDoS) patterns.
+    Every target pattern is checked in the form apply_trans_rules compiles it. 
+    
+    Args:
+        - rules(list/tuple): a list/tuple of target-replacement pairs, e.g., normalizing_rules().
+        - print_msg(bool): whether to print the flagged rules. Defaults to True.
         
-    fw.close()
-    print(f"\033[1mThe word misalignment in ./word misalignment logger/{filename} has been logged! Please check it out!\033[0m")
+    Return(list):
+        A list of (rule index, target pattern, severity, reason) tuples. The severity is "exponential"
+        for nested quantifiers or overlapping alternation under a quantifier, "polynomial" for adjacent
+        quantifiers that can trade the same chars, and "invalid" if the pattern does not compile.
+    '''
+    issues = []
+    for i, (target, _) in enumerate(rules):
+        pattern = _trans_rule_pattern(target)
+        try:
+            parsed = sre_parse.parse(pattern, re.IGNORECASE)
+        except re.error as e:
+            issues.append((i, target, "invalid", str(e)))
+            continue
+        found = []
+        for severity, reason in _redos_issues(parsed):
+            if (severity, reason) not in found:
+                found.append((severity, reason))
+        issues += [(i, target, severity, reason) for severity, reason in found]
+    
+    if print_msg:
+        for i, target, severity, reason in issues:
+            print(f"\033[31mReDoS ({severity})\033[0m rule {i}: [{target}], {reason}.")
+        if not issues:
+            print(f"\nNone of the {len(rules)} rules has a catastrophic backtracking pattern.\n")
+    return issues
+
+
+def trans_rules_profiler(rules, texts, final_trim=True):
+    '''Apply the transformation rules to a sample of texts exactly as apply_trans_rules does,
+    while timing every rule. 
+    
+    Args:
+        - rules(list/tuple): a list/tuple of target-replacement pairs.
+        - texts(list): a list of sample texts, e.g., preprocessed body texts.
+        - final_trim(bool): the final_trim for apply_trans_rules, defaults to True. 
+    
+    Returns:
+        - report(list): one dict per rule, with keys "idx", "target", "replace", "hits" (number of
+        replacements made), "seconds", "share" (share of the total time), "worst_seconds" (the slowest
+        single text) and "worst_len" (length of the input text that took the slowest time).
+        - out(list): the transformed texts, same as [apply_trans_rules(rules, t) for t in texts].
+    '''
+    report = [{"idx": i, "target": t, "replace": r, "hits": 0, "seconds": 0., 
+               "share": 0., "worst_seconds": 0., "worst_len": 0} for i, (t, r) in enumerate(rules)]
+    compiled = [_compile_trans_rule(target) for target, _ in rules]
+    out = []
+    for text in texts:
+        for i, (_, replace) in enumerate(rules):
+            start = perf_counter()
+            new_text, hits = compiled[i].subn(fr"{replace}", text)
+            secs = perf_counter() - start
+            rec = report[i]
+            rec["hits"] += hits
+            rec["seconds"] += secs
+            if secs > rec["worst_seconds"]:
+                rec["worst_seconds"], rec["worst_len"] = secs, len(text)
+            text = new_text
+        out.append(re.sub(r"\s+", " ", text).strip() if final_trim else text)
+    
+    total = sum(rec["seconds"] for rec in report)
+    for rec in report:
+        rec["share"] = rec["seconds"] / total if total else 0.
+    return report, out
+
+
+def _print_rules_profile(name, report, num_to_show):
+    '''Print a rules profile made by trans_rules_profiler, slowest rules first.'''
+    dead = [rec for rec in report if rec["hits"] == 0]
+    print(f"\n\033[1m{name}: {len(report)} rules, {len(dead)} never matched the sample.\033[0m\n")
+    tmp = "{0:<6}{1:<30}{2:>8}{3:>12}{4:>9}{5:>12}"
+    print(tmp.format("Rule", "Target", "Hits", "Seconds", "Share", "Worst len"))
+    for rec in sorted(report, key=lambda r: -r["seconds"])[:num_to_show]:
+        print(tmp.format(rec["idx"], rec["target"][:28], rec["hits"], "%.5f" % rec["seconds"],
+                         "%.1f%%" % (rec["share"] * 100), rec["worst_len"]))
+
+
+def rules_profiling_debugger(corpus_dir, body_node, sample_size=50, config_path=config_path,
+                             delimiter="\t", num_to_show=20, print_msg=True):
+    '''Lint the preprocessing and normalizing rules for ReDoS patterns, and then profile every rule 
+    against a random sample of body texts from a corpus so that dead or expensive rules can be pruned.
+    The body texts are prepared as _tokenize_xml does (tags replaced by <tag>), but whitespace tokenized
+    so that no Stanford CoreNLP server is needed. The normalizing rules are profiled on the preprocessed texts.
+    
+    Args:
+        - corpus_dir(str): corpus directory. 
+        - body_node(str): body_node name.
+        - sample_size(int): number of xml files to sample, defaults to 50.
+        - config_path(str): path to the config folder. Defaults to "./config/".
+        - delimiter(str): delimiter used in the config files. Defaults to "\t".
+        - num_to_show(int or None): number of the slowest rules to show per rule file, defaults to 20.
+        - print_msg(bool): whether to print the lint and profile results. Defaults to True.
+    
+    Return(dict):
+        {"redos": lint issues for preprocessing and normalizing rules, "preprocessing": report, 
+        "normalizing": report}. See trans_rules_redos_linter and trans_rules_profiler.
+    '''
+    assert config_path != None, "No config_path given."
+    p = config_path + "/" if config_path[-1] != "/" else config_path
+    prep = preprocessing_rules(p + "preprocessing_rules.txt", delimiter)
+    norm = normalizing_rules(p + "normalizing_rules.txt", delimiter)
+    
+    redos = {"preprocessing": trans_rules_redos_linter(prep, print_msg), 
+             "normalizing": trans_rules_redos_linter(norm, print_msg)}
+    
+    filenames = get_filenames_from_dir(corpus_dir, True, ".xml", shuffle=True, include_compressed=True)[:sample_size]
+    texts = []
+    for f in filenames:
+        body = get_body(join(corpus_dir, f), body_node, as_str=True)
+        body = re.sub(r"<[^>]+>", " <tag> ", body)
+        texts.append(' '.join(whiteSpaceTokenizer(re.sub("%", " was_percent_sign", body))))
+    
+    prep_report, texts = trans_rules_profiler(prep, texts)
+    norm_report, _ = trans_rules_profiler(norm, texts)
+    if print_msg:
+        print(f"Profiled on {len(texts)} sampled files, {sum(map(len, texts))} chars in total.")
+        _print_rules_profile("preprocessing_rules.txt", prep_report, num_to_show)
+        _print_rules_profile("normalizing_rules.txt", norm_report, num_to_show)
+    
+    return {"redos": redos, "preprocessing": prep_report, "normalizing": norm_report}
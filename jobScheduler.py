@@ -0,0 +1,232 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A fair-share scheduler for several corpus jobs (xmlCorpusRemaker runs) sharing one CoreNLP backend, so
+that a big job with many threads no longer starves the others and the server is not flooded with requests.
+
+Every CoreNLP request of the process passes the scheduler's gate (see corenlpToolbox.set_request_gate) and is
+tagged with the job of the remaker that makes it (xmlCorpusRemaker.set_job). At most max_in_flight requests are
+in flight at once across all the jobs, however many threads each job runs. A free slot goes to the waiting job of
+the highest priority and, among those, to the one with the least service (seconds of requests) per unit of weight,
+i.e., weighted fair queuing: a job of weight 2 gets about twice the share of the backend of a job of weight 1 while
+both have requests waiting. A job idle for a while is not given the service it missed as credit.
+
+The requests of untagged threads (e.g., a remake() call in the same process) count as the job None, of weight 1.
+'''
+from corenlpToolbox import set_request_gate
+from remakeLogger import log_event
+from threading import Thread, Condition
+from collections import deque
+import time
+
+
+# the run method of xmlCorpusRemaker for each mode of a job
+run_methods = {"tokenize": "tokenize_the_corpus", "pos_tag": "pos_tag_the_corpus",
+               "lemmatize": "lemmatize_the_corpus", "pos_lemma": "corpus_with_pos_lemma"}
+
+
+class _jobState:
+    def __init__(self, name, weight=1.0, priority=0):
+        if weight <= 0:
+            raise ValueError("The weight of a job must be positive.")
+        self.name = name
+        self.weight = float(weight)
+        self.priority = priority
+        self.vtime = 0.0
+        self.waiting = 0
+        self.grants = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.seconds = 0.0
+        self.wait_seconds = 0.0
+        self.max_queued = 0
+        # the end times of the recent requests, for the throughput
+        self.recent = deque()
+        self.remaker = None
+        self.thread = None
+        self.started = self.finished = None
+        self.error = None
+
+
+class fairShareScheduler:
+    '''Run several corpus jobs at once with a global cap on the CoreNLP requests in flight, shared by weighted fair
+    queuing between the jobs (see above). The scheduler is the request gate of the process until close().
+
+    Args (initialization):
+        - max_in_flight(int): the most CoreNLP requests in flight at once across all the jobs, defaults to 8.
+        - window(float): the seconds over which the throughput of a job is measured, defaults to 60.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> scheduler = fairShareScheduler(max_in_flight=8)
+    >>> scheduler.submit("emma", xmlCorpusRemaker(emma_dir, "teiHeader", "text"), mode="pos_tag", weight=2,
+                         apply_prep_rules=True, multitasking=True, threads_num=10)
+    >>> scheduler.submit("eebo", xmlCorpusRemaker(eebo_dir, "teiHeader", "text"), mode="tokenize", priority=1)
+    >>> scheduler.stats()   # per job: requests in flight and queued, throughput, files done, ...
+    >>> scheduler.wait()
+    >>> scheduler.close()
+    '''
+    def __init__(self, max_in_flight=8, window=60):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1.")
+        self._max_in_flight = max_in_flight
+        self._window = window
+        self._cond = Condition()
+        self._jobs = {None: _jobState(None)}
+        self._in_flight = 0
+        set_request_gate(self)
+
+    def add_job(self, name, weight=1.0, priority=0):
+        '''Register a job (or change the weight and priority of one) whose requests are made by the caller,
+        e.g., threads tagged with corenlpToolbox.set_request_job(name).'''
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                job = self._jobs[name] = _jobState(name, weight, priority)
+            else:
+                if weight <= 0:
+                    raise ValueError("The weight of a job must be positive.")
+                job.weight, job.priority = float(weight), priority
+            return job
+
+    def submit(self, name, remaker, mode="tokenize", weight=1.0, priority=0, **run_kwargs):
+        '''Start a corpus job: run the remaker (a xmlCorpusRemaker) in the given mode ("tokenize", "pos_tag",
+        "lemmatize" or "pos_lemma") with the run_kwargs of its run method (e.g., multitasking=True, threads_num=10),
+        in a thread of its own. Its requests are tagged with the job name.'''
+        if mode not in run_methods:
+            raise ValueError(f"mode must be one of {list(run_methods)}.")
+        if name is None or (name in self._jobs and self._jobs[name].thread is not None):
+            raise ValueError(f"A job needs a name of its own: {name!r}.")
+        job = self.add_job(name, weight, priority)
+        job.remaker = remaker
+        remaker.set_job(name)
+
+        def run():
+            job.started = time.time()
+            try:
+                getattr(remaker, run_methods[mode])(**run_kwargs)
+            except Exception as e:
+                job.error = repr(e)
+                log_event("job_failed", f"\033[1m\033[31mThe job {name} failed as follows: \033[0m{e}\n",
+                          stage=run_methods[mode], level="error", job=name, error=repr(e))
+            finally:
+                job.finished = time.time()
+        job.thread = Thread(target=run, name=f"job-{name}", daemon=True)
+        job.thread.start()
+        return name
+
+    def _job(self, name):
+        job = self._jobs.get(name)
+        if job is None:
+            job = self._jobs[name] = _jobState(name)
+        return job
+
+    def _dispatch(self):
+        '''Grant the free slots to the waiting jobs: the highest priority first, then the least service per weight.'''
+        while self._in_flight < self._max_in_flight:
+            waiting = [job for job in self._jobs.values() if job.waiting > job.grants]
+            if not waiting:
+                return
+            job = min(waiting, key=lambda j: (-j.priority, j.vtime))
+            job.grants += 1
+            self._in_flight += 1
+            job.in_flight += 1
+            # the request is charged the job's mean request seconds, and corrected once it is answered
+            job.vtime += (job.seconds / job.requests if job.requests else 0.0) / job.weight
+            self._cond.notify_all()
+
+    def acquire(self, name):
+        '''Wait for a slot for a request of the job. Called by the CoreNLP clients, see corenlpToolbox._gated_request.'''
+        start = time.perf_counter()
+        with self._cond:
+            job = self._job(name)
+            if job.started is None:
+                job.started = time.time()
+            if job.waiting == job.in_flight == 0:
+                # a job back from idle starts from the least service of the busy jobs, not with the service it missed
+                busy = [j.vtime for j in self._jobs.values() if j is not job and (j.waiting or j.in_flight)]
+                if busy:
+                    job.vtime = max(job.vtime, min(busy))
+            job.waiting += 1
+            job.max_queued = max(job.max_queued, job.waiting - job.grants)
+            self._dispatch()
+            while job.grants == 0:
+                self._cond.wait()
+            job.grants -= 1
+            job.waiting -= 1
+            job.wait_seconds += time.perf_counter() - start
+
+    def release(self, name, seconds):
+        '''Free the slot of a request of the job, which took the given seconds (None if it was not sent after all,
+        e.g., a hedged duplicate whose first request was answered while it waited for the slot).'''
+        with self._cond:
+            job = self._job(name)
+            self._in_flight -= 1
+            job.in_flight -= 1
+            mean = job.seconds / job.requests if job.requests else 0.0
+            if seconds is None:
+                # take back the mean request seconds the job was charged for the slot
+                job.vtime -= mean / job.weight
+                self._dispatch()
+                return
+            job.vtime += (seconds - mean) / job.weight
+            job.requests += 1
+            job.seconds += seconds
+            now = time.time()
+            job.recent.append(now)
+            while job.recent and job.recent[0] < now - self._window:
+                job.recent.popleft()
+            self._dispatch()
+
+    def wait(self, name=None, timeout=None):
+        '''Wait for a job (or all of them) to finish. Return True if it did (they did) within the timeout.'''
+        deadline = None if timeout is None else time.time() + timeout
+        jobs = [self._jobs[name]] if name is not None else list(self._jobs.values())
+        for job in jobs:
+            if job.thread is not None:
+                job.thread.join(None if deadline is None else max(0, deadline - time.time()))
+                if job.thread.is_alive():
+                    return False
+        return True
+
+    def stats(self):
+        '''Return the global in-flight requests and queue depth, and per job: the weight and priority, the requests
+        in flight, queued (and the most queued at once), done, their seconds and mean wait for a slot, the throughput
+        (requests per second over the window), the files done and to do, and whether the job is running.'''
+        now = time.time()
+        with self._cond:
+            jobs = {}
+            for job in self._jobs.values():
+                if job.name is None and not job.requests and not job.waiting:
+                    continue
+                recent = sum(1 for t in job.recent if t >= now - self._window)
+                span = min(self._window, now - job.started) if job.started else self._window
+                jobs[str(job.name)] = {
+                    "weight": job.weight, "priority": job.priority, "in_flight": job.in_flight,
+                    "queued": job.waiting - job.grants, "max_queued": job.max_queued, "requests": job.requests,
+                    "request_seconds": round(job.seconds, 4),
+                    "mean_wait_seconds": round(job.wait_seconds / job.requests, 4) if job.requests else None,
+                    "throughput": round(recent / span, 4) if span > 0 else 0.0,
+                    "running": job.thread is not None and job.thread.is_alive(), "error": job.error}
+                if job.remaker is not None:
+                    jobs[str(job.name)]["files_done"] = len(job.remaker.get_run_stats())
+                    jobs[str(job.name)]["files"] = len(job.remaker.show_filenames())
+            return {"max_in_flight": self._max_in_flight, "in_flight": self._in_flight,
+                    "queued": sum(job.waiting - job.grants for job in self._jobs.values()), "jobs": jobs}
+
+    def close(self):
+        '''Stop being the request gate of the process. The jobs still running are let through unscheduled.'''
+        set_request_gate(None)
+        with self._cond:
+            # the requests still waiting are let go, as no one will release a slot for them through the gate
+            self._max_in_flight = float("inf")
+            self._dispatch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,260 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: The per-file state kept by a spelling normalized remake, so that the corpus can be re-normalized
+incrementally after config/normalizing_rules.txt or config/common_verbs.txt is edited, instead of being
+remade from scratch (CoreNLP tokenization included).
+
+For every remade file, the state records the fingerprint of the normalization rule set used, the set of
+(lowercased) token types of its preprocessed body, and the preprocessed body itself with its header and tags.
+When the rules change, the added/removed rules and verbs are diffed against the stored rule set, each of them
+is matched against the corpus vocabulary (not the files), and only the files holding a matched type are
+re-normalized from their stored body. As the rules are applied in sequence, a rule can also match what an
+earlier rule (or verb) wrote, which no file holds before the normalization: the matched types are thus closed
+over the replacements of the rules and verbs of both rule sets (see _producers). All of it lives in one sqlite3 database, .renorm.sqlite in the dst_dir.
+'''
+from utils import normalizing_rules, get_common_verbs, get_irreg_v_past_inflect_dict
+from threading import Lock
+from os.path import join
+import hashlib
+import sqlite3
+import json
+import gzip
+import re
+
+
+def load_norm_rule_set(norm_rules_path='config/normalizing_rules.txt', verbs_path='config/common_verbs.txt',
+                       irreg_v_path="config/irregular_v_past_inflections.json"):
+    '''Load the current normalization rule set: (norm_rules, verbs, irreg_v_dict), as textNormalizing uses them.'''
+    return normalizing_rules(norm_rules_path), get_common_verbs(verbs_path), get_irreg_v_past_inflect_dict(irreg_v_path)
+
+
+def _rule_set_as_json(rule_set):
+    norm_rules, (vb, vbz, vbd), irreg_v_dict = rule_set
+    return json.dumps({"rules": [list(r) for r in norm_rules], "verbs": [list(v) for v in zip(vb, vbz, vbd)],
+                       "irreg_v_dict": irreg_v_dict}, sort_keys=True, ensure_ascii=False)
+
+
+def norm_rule_set_fingerprint(rule_set):
+    '''Return a short hash of a normalization rule set (norm_rules, verbs, irreg_v_dict).'''
+    return hashlib.md5(_rule_set_as_json(rule_set).encode("utf-8")).hexdigest()[:16]
+
+
+def diff_norm_rule_sets(old, new):
+    '''Diff two normalization rule sets, each as (norm_rules, verbs, irreg_v_dict) or as saved in the state.
+
+    Return(dict): "rules" (the targets of the rules added, removed or changed), "verbs" (the base verbs whose
+    line was added, removed or changed), "irreg_changed" (bool) and "reordered" (bool: the rules kept have a
+    different relative order, so that their interactions may differ).'''
+    old, new = json.loads(_rule_set_as_json(old)), json.loads(_rule_set_as_json(new))
+    old_rules, new_rules = [tuple(r) for r in old["rules"]], [tuple(r) for r in new["rules"]]
+    changed = set(old_rules) ^ set(new_rules)
+    kept_old = [r for r in old_rules if r not in changed]
+    kept_new = [r for r in new_rules if r not in changed]
+    verbs = set(map(tuple, old["verbs"])) ^ set(map(tuple, new["verbs"]))
+    return {"rules": sorted({target for target, _ in changed}), "verbs": sorted({v[0] for v in verbs}),
+            "irreg_changed": old["irreg_v_dict"] != new["irreg_v_dict"], "reordered": kept_old != kept_new}
+
+
+# a rule target that may match across whitespace, which token types alone cannot rule out
+_spans_tokens = re.compile(r"\\[sWD]|(?<!\\)\.|\[\^")
+
+
+# a replacement token that only copies what the target matched, i.e., writes no new text
+_backref = re.compile(r"\\(\d+|g<\w+>)")
+
+
+def _target_group(target):
+    '''Return the type patterns of a rule target (every one must match a token type of a file for the rule to
+    fire on it), or None if the target may match across whitespace or does not compile.'''
+    if _spans_tokens.search(target):
+        return None
+    try:
+        # the normalizing rules are whitespace tokenized, every token of the target must be in the file
+        return [re.compile(piece, re.IGNORECASE) for piece in target.split(" ") if piece] or None
+    except re.error:
+        return None
+
+
+def _verb_group(v):
+    # covers {v}e?th, {v}'?e?d?st and the past tense marked as {v}嗨'd, also for verbs ending with -e
+    stem = v[:-1] if v.endswith("e") and len(v) > 1 else v
+    return [re.compile(r"\b" + re.escape(stem), re.IGNORECASE)]
+
+
+def _type_patterns(diff):
+    '''Turn a rule set diff into a list of type pattern groups: a file is affected if, for one group, each
+    pattern of the group matches one of its token types. None means every file may be affected.'''
+    if diff["reordered"]:
+        return None
+    groups = []
+    for target in diff["rules"]:
+        group = _target_group(target)
+        if group is None:
+            return None
+        groups.append(group)
+    for v in diff["verbs"]:
+        groups.append(_verb_group(v))
+    if diff["irreg_changed"]:
+        groups.append([re.compile("嗨")])
+    return groups
+
+
+def _producers(*rule_sets):
+    '''Return the (token, group) pairs of the rules and verbs of the rule sets: a token a rule or verb writes
+    into the text (None if it cannot be told, e.g., \\1ould), and the type patterns of the rule target or verb
+    that writes it (None if they cannot be told).'''
+    out = []
+    for rule_set in rule_sets:
+        norm_rules, (vb, vbz, _), _ = rule_set
+        for target, replace in norm_rules:
+            group = _target_group(target)
+            for token in replace.split():
+                if not _backref.fullmatch(token):
+                    out.append((None if "\\" in token else token, group))
+        for v, third in zip(vb, vbz):
+            out += [(third, _verb_group(v)), (v, _verb_group(v))]
+    return out
+
+
+class normalizationState:
+    '''The re-normalization state of a remade corpus, stored in <dst_dir>/.renorm.sqlite. Thread-safe.
+
+    Args (initialization):
+        - dst_dir(str): the directory holding the remade corpus.
+        - rule_set(tuple or None): the (norm_rules, verbs, irreg_v_dict) the files are (re-)normalized with. When
+        given, it is stored and its fingerprint kept as self.fingerprint for the files recorded.
+    '''
+    def __init__(self, dst_dir, rule_set=None):
+        self._db = sqlite3.connect(join(dst_dir, ".renorm.sqlite"), check_same_thread=False)
+        self._lock = Lock()
+        self.fingerprint = None
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS rule_sets (fingerprint TEXT PRIMARY KEY, rule_set TEXT);
+            CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, fingerprint TEXT, state BLOB);
+            CREATE TABLE IF NOT EXISTS types (type TEXT, name TEXT, PRIMARY KEY (type, name)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS types_by_name ON types (name);
+        ''')
+        if rule_set is not None:
+            self.fingerprint = self.add_rule_set(rule_set)
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def __contains__(self, name):
+        return self._db.execute("SELECT 1 FROM files WHERE name=?", (name,)).fetchone() is not None
+
+    def add_rule_set(self, rule_set):
+        '''Store a rule set under its fingerprint, which is returned.'''
+        fingerprint = norm_rule_set_fingerprint(rule_set)
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO rule_sets VALUES (?, ?)", (fingerprint, _rule_set_as_json(rule_set)))
+            self._db.commit()
+        return fingerprint
+
+    def rule_set(self, fingerprint):
+        '''Return a stored rule set as (norm_rules, verbs, irreg_v_dict).'''
+        saved = json.loads(self._db.execute("SELECT rule_set FROM rule_sets WHERE fingerprint=?",
+                                            (fingerprint,)).fetchone()[0])
+        vb, vbz, vbd = map(list, zip(*saved["verbs"])) if saved["verbs"] else ([], [], [])
+        return tuple(map(tuple, saved["rules"])), (vb, vbz, vbd), saved["irreg_v_dict"]
+
+    def fingerprints(self):
+        '''Return a dict of fingerprint --> number of files normalized with it.'''
+        return dict(self._db.execute("SELECT fingerprint, COUNT(*) FROM files GROUP BY fingerprint"))
+
+    def record(self, name, fingerprint, body, **state):
+        '''Record a file normalized with the rule set of the fingerprint. The body is the preprocessed body
+        textNormalizing was given (still with its 嗨 markers). The rest of the state (header, tags, ...) is
+        kept as is and returned by load().'''
+        state["body"] = body
+        blob = gzip.compress(json.dumps(state, ensure_ascii=False).encode("utf-8"), 6)
+        types = {t.lower() for t in body.split() if t != "<tag>"}
+        with self._lock:
+            self._db.execute("DELETE FROM types WHERE name=?", (name,))
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (name, fingerprint, blob))
+            self._db.executemany("INSERT OR IGNORE INTO types VALUES (?, ?)", ((t, name) for t in types))
+            self._db.commit()
+
+    def load(self, name):
+        '''Return the recorded state of a file as a dict (body, header, tags, ...).'''
+        with self._lock:
+            blob = self._db.execute("SELECT state FROM files WHERE name=?", (name,)).fetchone()[0]
+        return json.loads(gzip.decompress(blob).decode("utf-8"))
+
+    def set_fingerprint(self, names, fingerprint):
+        '''Mark files as normalized with the rule set of the fingerprint, e.g., when a rule change does not affect them.'''
+        with self._lock:
+            self._db.executemany("UPDATE files SET fingerprint=? WHERE name=?", ((fingerprint, n) for n in names))
+            self._db.commit()
+
+    def _files_with_types(self, pattern, vocab, names):
+        '''Return the files of the names holding a type matched by the pattern (ſ being read as s).'''
+        matched = [t for t in vocab if pattern.search(t) or ("ſ" in t and pattern.search(t.replace("ſ", "s")))]
+        files = set()
+        for i in range(0, len(matched), 500):
+            chunk = matched[i:i+500]
+            files.update(n for (n,) in self._db.execute(
+                "SELECT name FROM types WHERE type IN (%s)" % ",".join("?" * len(chunk)), chunk))
+        return files & names
+
+    def _closed_hits(self, groups, producers, vocab, names):
+        '''Return the files of the names that may hit one of the groups of type patterns, either by their own
+        types or by what the rules and verbs (the producers) write, or None if that cannot be told.'''
+        patterns, sources, todo = {}, {}, [p for group in groups for p in group]
+        while todo:
+            p = todo.pop()
+            if p.pattern in patterns:
+                continue
+            patterns[p.pattern] = p
+            sources[p.pattern] = []
+            for token, group in producers:
+                if token is None or p.search(token):
+                    if group is None:
+                        return None
+                    sources[p.pattern].append(group)
+                    todo += group
+        
+        # the files that may hold a token matched by each pattern at some point of the normalization
+        files = {key: self._files_with_types(p, vocab, names) for key, p in patterns.items()}
+        changed = True
+        while changed:
+            changed = False
+            for key in patterns:
+                for group in sources[key]:
+                    produced = set.intersection(*(files[q.pattern] for q in group)) - files[key]
+                    if produced:
+                        files[key] |= produced
+                        changed = True
+        hits = set()
+        for group in groups:
+            hits |= set.intersection(*(files[p.pattern] for p in group))
+        return hits
+
+    def affected_files(self, rule_set):
+        '''Return (affected, unaffected): the names of the files whose normalization may change under the given
+        rule set, and the names of those that are not normalized with it but would come out the same.'''
+        new_fingerprint = norm_rule_set_fingerprint(rule_set)
+        vocab = None
+        affected, unaffected = [], []
+        for fingerprint in self.fingerprints():
+            if fingerprint == new_fingerprint:
+                continue
+            names = {n for (n,) in self._db.execute("SELECT name FROM files WHERE fingerprint=?", (fingerprint,))}
+            old = self.rule_set(fingerprint)
+            groups = _type_patterns(diff_norm_rule_sets(old, rule_set))
+            hits = None
+            if groups is not None:
+                if vocab is None:
+                    vocab = [t for (t,) in self._db.execute("SELECT DISTINCT type FROM types")]
+                hits = self._closed_hits(groups, _producers(old, rule_set), vocab, names)
+            if hits is None:
+                affected += sorted(names)
+                continue
+            affected += sorted(hits)
+            unaffected += sorted(names - hits)
+        return affected, unaffected
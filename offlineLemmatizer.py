@@ -0,0 +1,245 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: An in-process lemmatizer, so that a lemma-only run does not send every token to the CoreNLP annotator.
+
+The lemmas are looked up in hashed tables built from:
+    - config/english_lexicon.txt: the known base forms, the irregular nouns, the forms of be/have/do, the pronouns,
+    and the ambiguous forms, whose lemma depends on their part of speech (e.g., saw: see or saw);
+    - config/common_verbs.txt: the third person singular and simple past tense of the common verbs;
+    - config/irregular_v_past_inflections.json: the past tense and past participle of the irregular verbs.
+A form that maps to a verb but is a verb itself (e.g., lay: lie or lay) is ambiguous too. The tokens not found are
+lemmatized by suffix-stripping rules (-ies, -es, -s, -ied, -ed, -ing, and the early modern -eth and -est), which
+count as resolved only when they give a known base form. The others (a guess, or a capitalized token taken as a
+proper noun) and the ambiguous tokens are unresolved.
+
+With a fallback (e.g., stanfordAnnotator().get_lemma), the sentences with an unresolved token (cut to max_context
+tokens around it) are sent to it in one request and their unresolved tokens take its lemmas. Without one, or if it
+fails, the best guesses are kept. get_lemma takes and returns the same as stanfordAnnotator.get_lemma, i.e., the
+lemmas of the whitespace-separated tokens of a text, so it can be the annotation_func of xmlRemaker.
+'''
+from utils import get_common_verbs, get_irreg_v_past_inflect_dict
+from threading import Lock
+
+
+_sentence_end = {".", "!", "?"}
+_vowels = set("aeiou")
+
+# the suffix-stripping rules in order: (suffix, the replacements to try, the shortest stem)
+_suffix_rules = (("ies", ("y",), 1), ("ied", ("y",), 1), ("ves", ("f", "fe"), 2), ("ses", ("s", "se"), 2),
+                 ("xes", ("x",), 1), ("zes", ("z", "ze"), 1), ("ches", ("ch", "che"), 1), ("shes", ("sh", "she"), 1),
+                 ("es", ("e", ""), 2), ("s", ("",), 2), ("ed", ("", "e", "undouble"), 2), ("ing", ("", "e", "undouble"), 2),
+                 ("eth", ("", "e", "undouble"), 2), ("est", ("", "e", "undouble"), 2))
+
+# the lemmatizers of a worker process, by their config paths
+_lemmatizers = {}
+
+
+def _read_lexicon(filepath, delimiter="\t"):
+    '''Return the forms (form --> lemmas) and the base forms of the lexicon.'''
+    forms, bases = {}, set()
+    with open(filepath, "r") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            cols = line.split(delimiter)
+            if len(cols) == 1:
+                bases.add(cols[0].lower())
+            else:
+                forms[cols[0].lower()] = cols[1].split("|")
+    return forms, bases
+
+
+def _undouble(stem):
+    # running --> run, but not falling --> fal
+    if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in _vowels and stem[-1] not in "lsz":
+        return stem[:-1]
+
+
+class offlineLemmatizer:
+    '''A dictionary-backed lemmatizer with suffix-stripping rules and an optional fallback for the unresolved tokens.
+
+    Args (initialization):
+        - lexicon_path(str): the English lexicon, defaults to "config/english_lexicon.txt".
+        - verbs_path(str): the common verbs, defaults to "config/common_verbs.txt".
+        - irreg_v_path(str): the irregular verbs, defaults to "config/irregular_v_past_inflections.json".
+        - fallback(callable): takes a text and returns the lemmas of its tokens, e.g., stanfordAnnotator().get_lemma.
+        Defaults to None, i.e., the best guesses are kept.
+        - max_context(int): the tokens kept on each side of an unresolved token in the text sent to the fallback,
+        within its sentence. Defaults to 50.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> lemmatizer = offlineLemmatizer()
+    >>> lemmatizer.get_lemma("The children were running and he loveth the hills .")
+    ['the', 'child', 'be', 'run', 'and', 'he', 'love', 'the', 'hill', '.']
+    >>> lemmatizer.stats()   # {"tokens": ..., "known": ..., "ruled": ..., "ambiguous": ..., "unknown": ..., ...}
+    '''
+    def __init__(self, lexicon_path="config/english_lexicon.txt", verbs_path="config/common_verbs.txt",
+                 irreg_v_path="config/irregular_v_past_inflections.json", fallback=None, max_context=50):
+        self.paths = (lexicon_path, verbs_path, irreg_v_path)
+        self._fallback = fallback
+        self._max_context = max_context
+        forms, bases = _read_lexicon(lexicon_path)
+        vb, vbz, vbd = get_common_verbs(verbs_path)
+        irreg_v_dict = get_irreg_v_past_inflect_dict(irreg_v_path)
+        verb_bases = set(v.lower() for v in vb) | set(v.lower() for v in irreg_v_dict)
+        self._bases = bases | verb_bases | set(lemma.lower() for lemmas in forms.values() for lemma in lemmas)
+
+        verb_forms = {}
+        for base, third, past in zip(vb, vbz, vbd):
+            for form in (third, past):
+                verb_forms.setdefault(form.lower(), set()).add(base.lower())
+        for base, inflections in irreg_v_dict.items():
+            for form in inflections.get("VBD", []) + inflections.get("VBN", []):
+                verb_forms.setdefault(form.lower(), set()).add(base.lower())
+        # the lexicon has the last word on a form, a base form of a verb is its own lemma too (e.g., lay)
+        self._lemmas = {}
+        for form, lemmas in verb_forms.items():
+            if lemmas != {form}:
+                self._lemmas[form] = sorted(lemmas - {form}) + ([form] if form in verb_bases or form in lemmas else [])
+        self._lemmas.update(forms)
+        self._lock = Lock()
+        self._counts = {"tokens": 0, "known": 0, "ruled": 0, "ambiguous": 0, "unknown": 0,
+                        "fallback_requests": 0, "fallback_tokens": 0, "fallback_failed": 0}
+
+    def _strip(self, word):
+        '''Return the (lemma, resolved) of a lowercased word by the suffix-stripping rules.'''
+        guess = None
+        for suffix, replacements, min_stem in _suffix_rules:
+            if not word.endswith(suffix) or len(word) - len(suffix) < min_stem:
+                continue
+            stem = word[:-len(suffix)]
+            for rep in replacements:
+                candidate = _undouble(stem) if rep == "undouble" else stem + rep
+                if candidate and candidate in self._bases:
+                    return candidate, True
+            if guess is None and suffix in ("ies", "ied", "es", "s", "ed", "ing") and not word.endswith(("ss", "us", "is")):
+                if suffix in ("ies", "ied"):
+                    guess = stem + "y"
+                else:
+                    guess = (_undouble(stem) if suffix in ("ed", "ing") else None) or stem
+        return guess or word, False
+
+    def lemma(self, token):
+        '''Return the lemma of a token and how it was found: "known", "ruled", "ambiguous" or "unknown".'''
+        if not token[0].isalpha() or (token[0] == "<" and token[-1] == ">"):
+            return token, "known"
+        word = token.lower()
+        lemmas = self._lemmas.get(word)
+        if lemmas is not None:
+            return lemmas[0], "known" if len(lemmas) == 1 else "ambiguous"
+        if word in self._bases:
+            return word, "known"
+        if token[0].isupper() and not token.isupper():
+            # most likely a proper noun, kept as it is
+            return token, "unknown"
+        lemma, resolved = self._strip(word)
+        return lemma, "ruled" if resolved else "unknown"
+
+    def _resolve(self, tokens):
+        lemmas, unresolved = [], []
+        counts = dict.fromkeys(("known", "ruled", "ambiguous", "unknown"), 0)
+        for i, token in enumerate(tokens):
+            lemma, how = self.lemma(token)
+            lemmas.append(lemma)
+            counts[how] += 1
+            if how in ("ambiguous", "unknown"):
+                unresolved.append(i)
+        return lemmas, unresolved, counts
+
+    def _count(self, tokens, counts):
+        with self._lock:
+            self._counts["tokens"] += tokens
+            for how, n in counts.items():
+                self._counts[how] += n
+
+    def resolve(self, tokens):
+        '''Return the lemmas of the tokens and the indices of the unresolved ones (ambiguous or unknown).'''
+        lemmas, unresolved, counts = self._resolve(tokens)
+        self._count(len(tokens), counts)
+        return lemmas, unresolved
+
+    def _context_spans(self, tokens, unresolved):
+        '''Return the merged (start, end) spans of the sentences of the unresolved tokens, cut to max_context.'''
+        spans = []
+        for i in unresolved:
+            start = i
+            while start > 0 and i - start < self._max_context and tokens[start - 1] not in _sentence_end:
+                start -= 1
+            end = i + 1
+            while end < len(tokens) and end - i <= self._max_context and tokens[end - 1] not in _sentence_end:
+                end += 1
+            if spans and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(end, spans[-1][1]))
+            else:
+                spans.append((start, end))
+        return spans
+
+    def _fall_back(self, tokens, lemmas, unresolved):
+        '''Replace the lemmas of the unresolved tokens by those of the fallback, annotating their contexts at once.'''
+        spans = self._context_spans(tokens, unresolved)
+        text = " ".join(" ".join(tokens[start:end]) for start, end in spans)
+        values = self._fallback(text)
+        with self._lock:
+            self._counts["fallback_requests"] += 1
+            self._counts["fallback_tokens"] += sum(end - start for start, end in spans)
+            if not values or len(values) != sum(end - start for start, end in spans):
+                self._counts["fallback_failed"] += 1
+                return
+        positions, offset = {}, 0
+        for start, end in spans:
+            for i in range(start, end):
+                positions[i] = offset + i - start
+            offset += end - start
+        for i in unresolved:
+            lemmas[i] = values[positions[i]]
+
+    def get_lemma(self, text, include_tokens=False, workers=None):
+        '''Return the lemmas of the tokens of a text (and the tokens, if include_tokens), like
+        stanfordAnnotator.get_lemma. With workers, a text of 1,000,000 chars or more is resolved in chunks
+        on a process pool of that size (see parallelRules.py).'''
+        # one lemma per whitespace-separated token, as xmlRemaker._build_new_body pairs them
+        tokens = text.split()
+        if workers and len(text) >= 1000000:
+            lemmas, unresolved = parallel_resolve(self, tokens, workers)
+        else:
+            lemmas, unresolved = self.resolve(tokens)
+        if unresolved and self._fallback is not None:
+            self._fall_back(tokens, lemmas, unresolved)
+        if not include_tokens:
+            return lemmas
+        return tokens, lemmas
+
+    def stats(self):
+        '''Return the number of tokens lemmatized, of those known from the tables, resolved by a rule, ambiguous
+        and unknown, and the requests and tokens sent to the fallback.'''
+        with self._lock:
+            return dict(self._counts)
+
+
+def _resolve_chunk(paths, tokens):
+    # run in a worker process, whose lemmatizer is built once
+    if paths not in _lemmatizers:
+        _lemmatizers[paths] = offlineLemmatizer(*paths)
+    return _lemmatizers[paths]._resolve(tokens)
+
+
+def parallel_resolve(lemmatizer, tokens, workers, chunk_size=100000):
+    '''Resolve the tokens in chunks of chunk_size tokens on the process pool of parallelRules.py. Return the same
+    as lemmatizer.resolve, with the counts of the chunks added to the lemmatizer's stats.'''
+    from parallelRules import _rule_pool
+    pool = _rule_pool(workers)
+    chunks = [tokens[i:i + chunk_size] for i in range(0, len(tokens), chunk_size)]
+    futures = [pool.submit(_resolve_chunk, lemmatizer.paths, chunk) for chunk in chunks]
+    lemmas, unresolved = [], []
+    for start, future in zip(range(0, len(tokens), chunk_size), futures):
+        chunk_lemmas, chunk_unresolved, counts = future.result()
+        lemmas.extend(chunk_lemmas)
+        unresolved.extend(start + i for i in chunk_unresolved)
+        lemmatizer._count(len(chunk_lemmas), counts)
+    return lemmas, unresolved
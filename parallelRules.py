@@ -0,0 +1,149 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: Intra-document parallelism for the regex stages of the remake pipeline, i.e., the preprocessing
+rules (apply_trans_rules with prep_rules) and the spelling normalization (textNormalizing), so that a single
+multi-megabyte body no longer sets the critical path of a corpus run on one core.
+
+A large body is cut into chunks, preferably right before a <tag> placeholder, which stands for an original
+xml tag, otherwise after a sentence end. The chunks go through a process pool and are stitched back together.
+As a rule may span several tokens (e.g., "o 'th" or "(\\S) 't was"), a cut is only kept if the stage gives the
+same output for the text around it (some hundreds of characters on each side) processed whole as processed
+in two pieces, so that no match across the cut is lost. This check is a heuristic: a match, or a chain of
+rules, reaching further than the margin from a cut could still differ, so without verify the chunked output is
+not guaranteed to be the sequential one. With verify=True, the stitched output is also checked against the 
+sequential path, which is then returned if they differ, at the cost of running both.
+
+The pools are started with the "spawn" method, as forking a process that runs many threads (the remake workers,
+the logger) may copy a lock held by one of them into the workers. So, a script using them must guard its entry
+point with if __name__ == "__main__":. The pools are shut down when the process exits.
+'''
+from utils import apply_trans_rules
+from textNormalizer import textNormalizing, norm_rules, verbs, irreg_v_dict
+from remakeProfiler import current_profile_dir, add_child_profile, profiled_call
+from remakeLogger import log_event
+from configBundle import warm_patterns
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import Lock
+from os.path import join
+from uuid import uuid4
+import atexit
+import re
+
+
+# where a chunk is best cut: right before a <tag> placeholder, or else after a sentence end
+_tag_cut = re.compile(r"\s(?=<tag>)")
+_sentence_cut = re.compile(r"(?<=[.!?])\s")
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def _rule_pool(workers):
+    '''Return the process pool of the given size, started once and shared by all the threads. Every worker
+    compiles the regexes of the config bundle (if any) as it starts.'''
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                                                  initializer=warm_patterns)
+        return _pools[workers]
+
+
+def shutdown_rule_pools():
+    '''Shut down the process pools started so far. They are started again by the next call that needs them.'''
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_rule_pools)
+
+
+def _apply_trans_rules(text, rules):
+    return apply_trans_rules(rules, text)
+
+
+def _join(pieces):
+    # both stages return trimmed text, so the pieces are joined the way the whole text would have been trimmed
+    return " ".join(p for p in pieces if p)
+
+
+def _cut_is_safe(func, args, text, cut, margin):
+    '''Whether cutting the text at cut (a whitespace) changes nothing around it.'''
+    left, right = text[max(0, cut - margin):cut], text[cut:cut + margin]
+    return func(left + right, *args) == _join([func(left, *args), func(right, *args)])
+
+
+def split_for_stage(func, text, args=(), chunk_len=500000, margin=500, max_tries=20):
+    '''Return the offsets at which the text can be cut into chunks of about chunk_len characters that func
+    (a stage taking the text and args) processes the same one by one as whole. For every chunk end, up to
+    max_tries <tag> placeholders and then as many sentence ends after it are tried. A chunk with no safe cut
+    is left to grow into the next one.'''
+    cuts, start = [], 0
+    while start + chunk_len < len(text):
+        cut = None
+        for boundary in (_tag_cut, _sentence_cut):
+            for i, m in enumerate(boundary.finditer(text, start + chunk_len)):
+                if i == max_tries:
+                    break
+                if _cut_is_safe(func, args, text, m.start(), margin):
+                    cut = m.start()
+                    break
+            if cut is not None:
+                break
+        if cut is None:
+            break
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def parallel_stage(func, text, args=(), workers=4, min_len=1000000, verify=False):
+    '''Run a stage (func(text, *args) --> trimmed text, a top-level function) on chunks of the text in a process
+    pool of the given number of workers, and stitch the outputs. A text shorter than min_len characters is run as is.
+    The cuts are checked on the text around them only (see above): verify=True to check the whole output too.'''
+    if not workers or workers < 2 or len(text) < min_len:
+        return func(text, *args)
+    cuts = split_for_stage(func, text, args, chunk_len=max(len(text) // (workers * 2), min_len // 4))
+    if not cuts:
+        return func(text, *args)
+    bounds = [0] + cuts + [len(text)]
+    pool = _rule_pool(workers)
+    profile_dir = current_profile_dir()
+    if profile_dir is None:
+        futures = [pool.submit(func, text[a:b], *args) for a, b in zip(bounds, bounds[1:])]
+        out = _join([f.result() for f in futures])
+    else:
+        # the file is being profiled (see remakeProfiler.py), so are its chunks in the worker processes
+        paths = [join(profile_dir, "chunk-%s.prof" % uuid4().hex) for _ in cuts + [None]]
+        futures = [pool.submit(profiled_call, path, func, text[a:b], *args) 
+                   for path, a, b in zip(paths, bounds, bounds[1:])]
+        results = [f.result() for f in futures]
+        for path, (_, rule_times) in zip(paths, results):
+            add_child_profile(path, rule_times)
+        out = _join([result for result, _ in results])
+    if verify:
+        sequential = func(text, *args)
+        if sequential != out:
+            log_event("chunks_differ", f"\033[31mThe {len(cuts) + 1} chunks of {getattr(func, '__name__', func)} differ " \
+                      "from the sequential output.\033[0m The sequential output is used instead.", stage="rules",
+                      level="warning", chunks=len(cuts) + 1)
+            return sequential
+    return out
+
+
+def parallel_apply_trans_rules(rules, text, workers=4, min_len=1000000, verify=False):
+    '''The same as apply_trans_rules(rules, text), but a text of min_len characters or more is processed in chunks
+    by a pool of the given number of worker processes. See parallel_stage.'''
+    return parallel_stage(_apply_trans_rules, text, (rules,), workers, min_len, verify)
+
+
+def parallel_text_normalizing(text, norm_rules=norm_rules, verbs=verbs, irreg_v_dict=irreg_v_dict,
+                              workers=4, min_len=1000000, verify=False):
+    '''The same as textNormalizing(text, norm_rules, verbs, irreg_v_dict), but a text of min_len characters or more
+    is processed in chunks by a pool of the given number of worker processes. See parallel_stage.'''
+    return parallel_stage(textNormalizing, text, (norm_rules, verbs, irreg_v_dict), workers, min_len, verify)
@@ -0,0 +1,360 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A long-running remake daemon for the many small jobs that would otherwise each pay for starting Python,
+loading the config rules, compiling the regexes and connecting to CoreNLP, which takes seconds for a job that
+needs milliseconds.
+
+The daemon loads and compiles everything once, warms the tokenizer and annotator up, keeps one keep-alive
+connection per worker and CoreNLP server, and then takes remake jobs over a local Unix socket and/or a spool
+directory. The files of the jobs run on a shared pool of worker threads, in the order the jobs came in.
+
+A job is a json object:
+
+    {"mode": "pos_lemma",                     # "tokenize" (default), "pos_tag", "lemmatize" or "pos_lemma"
+     "files": ["/data/a.xml", "/data/b.xml"], # or "corpus_dir": "/data" (and "include_sub_dir": true)
+     "head_node": "teiHeader", "body_node": "text", "root_name": "TEI.2", "dst_dir": "/data_remade",
+     "options": {"apply_prep_rules": true, "spell_norm": true}}   # the args of _execute, see below
+
+Over the socket, every request is a json object on one line, answered by one on one line:
+
+    {"op": "submit", "job": {...}}           --> {"ok": true, "job_id": "..."}
+    {"op": "status", "job_id": "..."}        --> {"ok": true, "job": {"state": "running", "counts": {...}, ...}}
+    {"op": "wait", "job_id": "...", "timeout": 60}   the same, once the job is done (or the timeout is up)
+    {"op": "stats"}, {"op": "ping"}, {"op": "shutdown"}
+
+In the spool directory, a job is dropped in incoming/ as <name>.json (written aside and renamed, so that it is
+never read half written) and its status is kept in status/<name>.json, the name being the job_id.
+'''
+from xmlRemaker import tokenize_xml_body, pos_tag_xml_body, lemmatize_xml_body, xml_body_with_pos_lemma, sta
+from corenlpToolbox import keep_alive_connections
+from remakeLogger import log_event
+from textPreprocessor import textPreprocessing
+from textNormalizer import textNormalizing
+from utils import get_filenames_from_dir
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Condition, Event
+from collections import OrderedDict
+from os.path import join, exists, dirname, basename, getmtime, normpath
+from os import makedirs, replace, remove, listdir, getpid
+from uuid import uuid4
+import socketserver
+import socket
+import time
+import json
+
+
+modes = {"tokenize": tokenize_xml_body, "pos_tag": pos_tag_xml_body, "lemmatize": lemmatize_xml_body,
+         "pos_lemma": xml_body_with_pos_lemma}
+
+# the args of _execute a job can set in its options
+job_options = ("apply_prep_rules", "spell_norm", "word_alignment_debug", "skip_exists", "text_lower_len",
+               "text_upper_len", "compression", "compresslevel", "segment_len", "rule_workers", "verify_rules",
+               "lemmatizer", "fused")
+
+_positional = job_options[:6]
+
+
+def _job_files(job):
+    '''Return the distinct (file_dir, filename) pairs of a job, or raise ValueError if the job is not valid.'''
+    for key in ("head_node", "body_node", "dst_dir"):
+        if not job.get(key):
+            raise ValueError(f"The job has no {key}.")
+    if job.get("mode", "tokenize") not in modes:
+        raise ValueError(f"Unknown mode {job.get('mode')!r}: must be one of {', '.join(modes)}.")
+    unknown = set(job.get("options", {})) - set(job_options)
+    if unknown:
+        raise ValueError(f"Unknown options: {', '.join(sorted(unknown))}.")
+    if job.get("files"):
+        # a file listed twice is remade once: the job is done once every distinct file is
+        return [(dirname(f), basename(f)) for f in dict.fromkeys(normpath(f) for f in job["files"])]
+    if job.get("corpus_dir"):
+        filenames = get_filenames_from_dir(job["corpus_dir"], job.get("include_sub_dir", False), ".xml",
+                                           include_compressed=True)
+        return [(job["corpus_dir"], f) for f in filenames]
+    raise ValueError("The job has neither files nor a corpus_dir.")
+
+
+def _write_json(path, obj):
+    tmp = "%s.%i.tmp" % (path, getpid())
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    replace(tmp, path)
+
+
+class _socketHandler(socketserver.StreamRequestHandler):
+    '''Answer the json requests sent over a connection to the socket, one per line.'''
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                out = self.server.remake_daemon.handle_request(json.loads(line))
+            except Exception as e:
+                out = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(out) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class remakeDaemon:
+    '''A long-running process that remakes the files of the jobs it is sent, with everything kept warm.
+
+    Args (initialization):
+        - socket_path(str or None): the Unix socket to take the jobs on.
+        - spool_dir(str or None): the spool directory to take the jobs from (incoming/) and report them in (status/).
+        - workers(int): the number of worker threads the files of the jobs run on. Defaults to 4.
+        - poll_interval(float): how often (in seconds) the spool directory is checked. Defaults to 0.2.
+        - history(int): the number of finished jobs whose status is kept. Defaults to 1000.
+        - keep_alive(bool): reuse a keep-alive connection per worker and CoreNLP server. Defaults to True.
+        - warm_up(bool): run a short text through the tokenizer, the rules and the annotator before taking any
+        job, so that the first one does not pay for it. Defaults to True.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> daemon = remakeDaemon(socket_path="/tmp/remake.sock", spool_dir="/data/spool", workers=4)
+    >>> daemon.serve_forever()          # or daemon.start() to serve in the background, and daemon.stop()
+    # from any other process:
+    >>> submit_job("/tmp/remake.sock", {"files": [...], "head_node": "teiHeader", "body_node": "text",
+    ...                                 "dst_dir": "...", "mode": "pos_tag"}, wait=True)
+    # or from the command line: python remakeDaemon.py --socket /tmp/remake.sock --spool /data/spool --workers 4
+    '''
+    def __init__(self, socket_path=None, spool_dir=None, workers=4, poll_interval=0.2, history=1000,
+                 keep_alive=True, warm_up=True):
+        if socket_path is None and spool_dir is None:
+            raise ValueError("A socket_path or a spool_dir (or both) must be given for the jobs to come in.")
+        self._socket_path = socket_path
+        self._spool_dir = spool_dir
+        self._poll_interval = poll_interval
+        self._history = history
+        self._keep_alive = keep_alive
+        self._warm_up = warm_up
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="remake-worker")
+        self._cond = Condition()
+        # job_id --> the status of the job
+        self._jobs = OrderedDict()
+        self._server = None
+        self._threads = []
+        self._stopped = Event()
+        self._started = None
+
+    def start(self):
+        '''Warm up and start taking jobs in the background. Return the daemon.'''
+        if self._keep_alive:
+            keep_alive_connections()
+        if self._warm_up:
+            self.warm_up()
+        self._started = time.time()
+        if self._socket_path is not None:
+            if exists(self._socket_path):
+                remove(self._socket_path)
+            self._server = socketserver.ThreadingUnixStreamServer(self._socket_path, _socketHandler)
+            self._server.daemon_threads = True
+            self._server.remake_daemon = self
+            self._threads.append(Thread(target=self._server.serve_forever, daemon=True))
+        if self._spool_dir is not None:
+            makedirs(join(self._spool_dir, "incoming"), exist_ok=True)
+            makedirs(join(self._spool_dir, "status"), exist_ok=True)
+            self._threads.append(Thread(target=self._polling, daemon=True))
+        for t in self._threads:
+            t.start()
+        where = [p for p in (self._socket_path, self._spool_dir) if p is not None]
+        print(f"\033[32mThe remake daemon takes jobs on {' and '.join(where)}.\033[0m")
+        return self
+
+    def serve_forever(self):
+        '''Start and take jobs until stop() is called, a shutdown request comes in, or the process is interrupted.'''
+        self.start()
+        try:
+            while not self._stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self):
+        '''Stop taking jobs, finish the files already queued and close the socket.'''
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if exists(self._socket_path):
+                remove(self._socket_path)
+        self._pool.shutdown(wait=True)
+
+    def warm_up(self):
+        '''Run a short text through the tokenizer, the preprocessing and normalization rules and the annotator.'''
+        start = time.time()
+        try:
+            text = textPreprocessing("Th' art warm, and 't was lov'd <tag> here .", apply_prep_rules=True)
+            textNormalizing(text)
+            sta.get_pos_and_lemma(text.replace("嗨", ""))
+        except Exception as e:
+            log_event("warm_up_failed", f"\033[31mWarming up failed: \033[0m{e}", stage="warm_up", level="error",
+                      error=repr(e))
+            return
+        print(f"Warmed up in {time.time() - start:.2f} seconds.")
+
+    def submit(self, job, job_id=None, spooled=False):
+        '''Queue a job (a dict, see the module doc). Return its job_id, or raise ValueError if it is not valid.
+        The status of a spooled job is also kept in the spool directory.'''
+        if self._stopped.is_set():
+            raise RuntimeError("The daemon is stopping and takes no more jobs.")
+        files = _job_files(job)
+        makedirs(job["dst_dir"], exist_ok=True)
+        job_id = job_id or uuid4().hex[:16]
+        func = modes[job.get("mode", "tokenize")]
+        options = dict(job.get("options", {}))
+        args = [options.pop(key) if key in options else default for key, default in
+                zip(_positional, (False, False, False, True, 0, 1000000))]
+        rec = {"job_id": job_id, "state": "queued", "mode": job.get("mode", "tokenize"), "submitted": time.time(),
+               "started": None, "finished": None, "total": len(files), "counts": {}, "files": {}, "spooled": spooled}
+        with self._cond:
+            self._jobs[job_id] = rec
+        self._report(rec)
+        if not files:
+            self._finish(rec)
+        for file_dir, filename in files:
+            self._pool.submit(self._run_file, rec, func, file_dir, filename, job, args, options)
+        return job_id
+
+    def _run_file(self, rec, func, file_dir, filename, job, args, options):
+        with self._cond:
+            if rec["state"] == "queued":
+                rec["state"], rec["started"] = "running", time.time()
+        try:
+            status = func(file_dir, filename, job["head_node"], job["body_node"], job.get("root_name", "TEI.2"),
+                          job["dst_dir"], *args, **options)
+        except Exception as e:
+            log_event("failed", f"\033[1m\033[31mA problem remaking {join(file_dir, filename)} as follows: \033[0m{e}\n",
+                      join(file_dir, filename), func.__name__, "error", job=rec["job_id"], error=repr(e))
+            status = "failed"
+        with self._cond:
+            rec["files"][join(file_dir, filename)] = status
+            rec["counts"][status] = rec["counts"].get(status, 0) + 1
+            done = len(rec["files"]) == rec["total"]
+        if done:
+            self._finish(rec)
+
+    def _finish(self, rec):
+        with self._cond:
+            rec["state"], rec["finished"] = "done", time.time()
+            rec["started"] = rec["started"] or rec["finished"]
+            rec["seconds"] = round(rec["finished"] - rec["submitted"], 4)
+            # only the last history jobs that are done are kept
+            done = [job_id for job_id, r in self._jobs.items() if r["state"] == "done"]
+            for job_id in done[:max(0, len(done) - self._history)]:
+                del self._jobs[job_id]
+            self._cond.notify_all()
+        self._report(rec)
+
+    def _report(self, rec):
+        if self._spool_dir is not None and rec["spooled"]:
+            with self._cond:
+                out = json.loads(json.dumps(rec))
+            _write_json(join(self._spool_dir, "status", rec["job_id"] + ".json"), out)
+
+    def status(self, job_id):
+        '''Return a copy of the status of a job: its state (queued, running or done), the counts of the file statuses,
+        the status of every file done with and its times. Raise KeyError if the job is unknown.'''
+        with self._cond:
+            return json.loads(json.dumps(self._jobs[job_id]))
+
+    def wait(self, job_id, timeout=None):
+        '''Wait until a job is done or the timeout (seconds) is up. Return its status.'''
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._jobs[job_id]["state"] != "done":
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return self.status(job_id)
+
+    def stats(self):
+        '''Return the uptime, the number of jobs per state and the CoreNLP latencies of the annotator.'''
+        with self._cond:
+            states = {}
+            for rec in self._jobs.values():
+                states[rec["state"]] = states.get(rec["state"], 0) + 1
+        return {"uptime": round(time.time() - self._started, 2) if self._started else 0, "jobs": states,
+                "corenlp": sta.latency_stats()}
+
+    def handle_request(self, request):
+        '''Answer a request (a dict, see the module doc) sent over the socket.'''
+        op = request.get("op")
+        if op == "submit":
+            return {"ok": True, "job_id": self.submit(request["job"])}
+        if op == "status":
+            return {"ok": True, "job": self.status(request["job_id"])}
+        if op == "wait":
+            return {"ok": True, "job": self.wait(request["job_id"], request.get("timeout"))}
+        if op == "stats":
+            return {"ok": True, "stats": self.stats()}
+        if op == "ping":
+            return {"ok": True}
+        if op == "shutdown":
+            self._stopped.set()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown op {op!r}."}
+
+    def _polling(self):
+        incoming = join(self._spool_dir, "incoming")
+        while not self._stopped.wait(self._poll_interval):
+            names = sorted((f for f in listdir(incoming) if f.endswith(".json")),
+                           key=lambda f: (_mtime(join(incoming, f)), f))
+            for name in names:
+                self._take_spooled(join(incoming, name), name[:-len(".json")])
+
+    def _take_spooled(self, path, job_id):
+        try:
+            with open(path) as f:
+                job = json.load(f)
+            remove(path)
+            self.submit(job, job_id, spooled=True)
+        except Exception as e:
+            if exists(path):
+                remove(path)
+            _write_json(join(self._spool_dir, "status", job_id + ".json"),
+                        {"job_id": job_id, "state": "rejected", "error": f"{type(e).__name__}: {e}"})
+
+
+def _mtime(path):
+    try:
+        return getmtime(path)
+    except OSError:
+        return 0
+
+
+def send_request(socket_path, request, timeout=None):
+    '''Send a request (a dict) to a remake daemon over its Unix socket. Return the answer (a dict).'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def submit_job(socket_path, job, wait=False, timeout=None):
+    '''Submit a job (a dict, see the module doc) to a remake daemon. Return its job_id, or its status once it is
+    done if wait=True. Raise RuntimeError if the daemon rejects it.'''
+    out = send_request(socket_path, {"op": "submit", "job": job})
+    if not out["ok"]:
+        raise RuntimeError(out["error"])
+    if not wait:
+        return out["job_id"]
+    return send_request(socket_path, {"op": "wait", "job_id": out["job_id"], "timeout": timeout})["job"]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a remake daemon taking jobs on a Unix socket and/or a spool directory.")
+    parser.add_argument("--socket", default=None, help="the Unix socket to take the jobs on")
+    parser.add_argument("--spool", default=None, help="the spool directory to take the jobs from")
+    parser.add_argument("--workers", type=int, default=4, help="the number of worker threads")
+    args = parser.parse_args()
+    remakeDaemon(args.socket, args.spool, args.workers).serve_forever()
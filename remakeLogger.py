@@ -0,0 +1,181 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A non-blocking, structured logging layer for the messages of the remake pipeline (files created,
+skipped or misaligned, CoreNLP errors and retries, ...), which used to be printed by the worker threads
+themselves, so that many threads contended for stdout and their interleaved output could not be parsed.
+
+A message is logged as a record with the file, the stage, the event, the duration (if any) and the other
+fields given, and put on a queue. A background thread writes the records:
+    - to the console (mode "console", the default), as the same coloured messages as before. A message repeated
+    more than sample_after times within sample_window seconds (the same event and level) is sampled out, and a
+    line tells how many were left out once the window is over;
+    - to a jsonl file (path), one record per line with its message uncoloured, every record being kept;
+    - nowhere on the console in mode "silent" (only to the jsonl file, if any).
+Attachments, e.g., the word misalignment logs of debugger.words_misalignments_logger, are written by the same
+thread. The queue is flushed when the process exits, or by flush_logs().
+'''
+from threading import Thread, Event, current_thread
+from queue import SimpleQueue
+from os.path import dirname
+from os import makedirs
+import atexit
+import json
+import time
+import re
+import sys
+
+
+_ansi = re.compile(r"\033\[[0-9;]*m")
+log_modes = ("console", "silent")
+
+
+class remakeLogger:
+    '''A queue-backed logger of structured records, written by a background thread (see above).
+
+    Args (initialization):
+        - mode(str): "console" (default) or "silent".
+        - path(str): a jsonl file to append every record to. Defaults to None.
+        - sample_after(int): the messages of an event shown per window on the console, defaults to 20.
+        None to show them all.
+        - sample_window(float): the seconds of a sampling window, defaults to 10.
+    '''
+    def __init__(self, mode="console", path=None, sample_after=20, sample_window=10.0):
+        if mode not in log_modes:
+            raise ValueError(f"mode must be one of {list(log_modes)}.")
+        self._mode = mode
+        self._path = path
+        self._sample_after = sample_after
+        self._sample_window = sample_window
+        self._queue = SimpleQueue()
+        # (event, level) --> [window start, shown, left out] on the console
+        self._windows = {}
+        self._counts = {}
+        self._suppressed = 0
+        self._file = None
+        if path:
+            if dirname(path):
+                makedirs(dirname(path), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+        self._writer = Thread(target=self._write_loop, name="remake-logger", daemon=True)
+        self._writer.start()
+
+    def log(self, event, message=None, file=None, stage=None, level="info", duration=None, attachment=None, **fields):
+        '''Queue a record: the event (e.g., "created", "skipped"), the message as shown on the console (None for
+        no console line), the file and stage it is about, its level ("info", "notice", "warning" or "error"),
+        a duration in seconds, an attachment (path, text) to write, and any other json serializable fields.'''
+        rec = {"time": time.time(), "level": level, "event": event, "file": file, "stage": stage,
+               "duration": None if duration is None else round(duration, 4), "thread": current_thread().name}
+        rec.update(fields)
+        self._queue.put((rec, message, attachment))
+
+    def _console(self, rec, message):
+        if self._mode == "silent" or message is None:
+            return
+        key = (rec["event"], rec["level"])
+        window = self._windows.get(key)
+        if window is None or rec["time"] - window[0] > self._sample_window:
+            if window is not None and window[2]:
+                print(f"\033[2m... {window[2]} more \"{rec['event']}\" messages left out.\033[0m")
+            window = self._windows[key] = [rec["time"], 0, 0]
+        if self._sample_after is not None and window[1] >= self._sample_after:
+            window[2] += 1
+            self._suppressed += 1
+            return
+        window[1] += 1
+        print(message)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                # the sentinel of close(): every record queued before it has been written
+                return
+            if isinstance(item, Event):
+                self._flush_windows()
+                if self._file is not None:
+                    self._file.flush()
+                sys.stdout.flush()
+                item.set()
+                continue
+            rec, message, attachment = item
+            try:
+                self._counts[rec["event"]] = self._counts.get(rec["event"], 0) + 1
+                if attachment is not None:
+                    self._attach(rec, *attachment)
+                self._console(rec, message)
+                if self._file is not None:
+                    if message is not None:
+                        rec["message"] = _ansi.sub("", message).strip()
+                    self._file.write(json.dumps(rec, ensure_ascii=False, default=str) + "\n")
+            except Exception as e:
+                # a record that cannot be written must not stop the ones after it
+                print(f"\033[31mA log record could not be written: \033[0m{e}", file=sys.stderr)
+
+    def _attach(self, rec, path, text):
+        if dirname(path):
+            makedirs(dirname(path), exist_ok=True)
+        try:
+            with open(path, "x", encoding="utf-8") as f:
+                f.write(text)
+            rec["attachment"] = path
+        except FileExistsError:
+            rec["attachment_exists"] = path
+
+    def _flush_windows(self):
+        for (event, _), window in self._windows.items():
+            if window[2]:
+                print(f"\033[2m... {window[2]} more \"{event}\" messages left out.\033[0m")
+        self._windows = {}
+
+    def flush(self, timeout=None):
+        '''Wait until the records queued so far are written. Return True if they were within the timeout.'''
+        done = Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stats(self):
+        '''Return the number of records per event and of the console messages sampled out.'''
+        self.flush()
+        return {"events": dict(self._counts), "sampled_out": self._suppressed}
+
+    def close(self, timeout=5):
+        '''Write the records queued so far, stop the writer thread and close the jsonl file. The records
+        logged after that are not written.'''
+        self.flush(timeout)
+        self._queue.put(None)
+        self._writer.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+_logger = remakeLogger()
+
+
+def configure_logging(mode="console", path=None, sample_after=20, sample_window=10.0):
+    '''Replace the logger of the pipeline: mode "console" or "silent", a jsonl file to write every record to,
+    and the sampling of the console messages (see remakeLogger). Return the new logger.'''
+    global _logger
+    previous, _logger = _logger, remakeLogger(mode, path, sample_after, sample_window)
+    previous.close()
+    return _logger
+
+
+def log_event(event, message=None, file=None, stage=None, level="info", duration=None, attachment=None, **fields):
+    '''Log a record with the current logger, see remakeLogger.log. Returns at once.'''
+    _logger.log(event, message, file, stage, level, duration, attachment, **fields)
+
+
+def flush_logs(timeout=None):
+    '''Wait until the records logged so far are written.'''
+    return _logger.flush(timeout)
+
+
+def log_stats():
+    '''Return the number of records per event and of the console messages sampled out by the current logger.'''
+    return _logger.stats()
+
+
+atexit.register(lambda: _logger.flush(5))
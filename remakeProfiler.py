@@ -0,0 +1,223 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: An opt-in profiler for the corpus runs of xmlRemaker (profile=True), so that a corpus running much
+slower than another can be explained without hacking cProfile around _execute.
+
+A configurable fraction of the files (picked by a stable hash of the filenames, so a re-run profiles the same
+ones) is run under cProfile in the thread remaking it, while a sampler thread records the call stacks of that
+thread every few milliseconds. The regex stages run in worker processes (see parallelRules.py) are profiled there
+and merged back. Every rule applied by apply_trans_rules is also timed. The report, written in the profile_dir:
+
+    - remake.prof: the merged pstats of all the profiled files (python -m pstats, snakeviz, etc.);
+    - remake.collapsed: the sampled stacks in the collapsed format of flamegraph.pl and speedscope;
+    - report.txt: the time per pipeline stage (parse, tokenize, ..., serialize), the regex time per rule and
+      the hot functions;
+    - files/<filename>.prof: the pstats of every profiled file.
+'''
+from utils import start_rule_timing, stop_rule_timing
+from threading import Thread, Lock, Event, local, get_ident
+from collections import Counter
+from os.path import join, basename
+from os import makedirs, remove
+import cProfile
+import pstats
+import zlib
+import sys
+import io
+
+
+# the pipeline stages reported, each as the functions whose cumulative time it is made of
+stages = (("parse", ("get_header_body_as_str", "__iter__")),
+          ("tokenize", ("_tokenize_body",)),
+          ("preprocess", ("_preprocess_body",)),
+          ("normalize", ("_normalize_body", "textNormalizing")),
+          ("annotate", ("get_pos_tags", "get_lemma", "get_pos_and_lemma")),
+          ("build body", ("_build_new_body",)),
+          ("serialize", ("createXmlFileFromStr", "write_xml_file_stream")))
+
+# the profile of the file being remade by the current thread, for the worker processes to add theirs to
+_current = local()
+
+
+def current_profile_dir():
+    '''Return the directory for the worker processes to dump their profiles in if the current thread
+    is remaking a profiled file, otherwise None.'''
+    return getattr(_current, "files_dir", None)
+
+
+def add_child_profile(path, rule_times):
+    '''Add the profile dumped by a worker process (and its rule times) to the file profiled by the current thread.'''
+    _current.children.append((path, rule_times))
+
+
+def profiled_call(path, func, *args):
+    '''Run func(*args) under cProfile in a worker process and dump the profile at path.
+    Return the result and the seconds spent per rule.'''
+    prof = cProfile.Profile()
+    start_rule_timing()
+    try:
+        result = prof.runcall(func, *args)
+    finally:
+        times = stop_rule_timing()
+        prof.dump_stats(path)
+    return result, times
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{basename(code.co_filename).rsplit('.', 1)[0]}:{code.co_name}"
+
+
+class _stackSampler(Thread):
+    '''Sample the call stack of a thread every interval seconds into a Counter of collapsed stacks.'''
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(daemon=True)
+        self._thread_id = thread_id
+        self._interval = interval
+        self._done = Event()
+        self.stacks = Counter()
+
+    def run(self):
+        while not self._done.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class remakeProfiler:
+    '''Profile a fraction of the files of a corpus run and merge their stats into one report. Thread-safe.
+
+    Args (initialization):
+        - profile_dir(str): the directory for the report and the per-file profiles, created if it does not exist.
+        - rate(float): the fraction of the files to profile, from 0 to 1. Defaults to 1.0 (all of them).
+        - interval(float): the seconds between two samples of the call stacks. Defaults to 0.005.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> profiler = remakeProfiler(join(dst_dir, ".profile"), rate=0.1)
+    >>> status = profiler.run(filename, _execute, file_dir, filename, head_node, body_node, ...)
+    >>> profiler.write_report()       # remake.prof, remake.collapsed and report.txt in the profile_dir
+
+    Please note that since Python 3.12, cProfile cannot profile two threads at once. A file remade while another
+    thread is being profiled then only gets its stacks sampled, not its function stats.
+    '''
+    def __init__(self, profile_dir, rate=1.0, interval=0.005):
+        self._profile_dir = profile_dir
+        self._files_dir = join(profile_dir, "files")
+        makedirs(self._files_dir, exist_ok=True)
+        self._rate = rate
+        self._interval = interval
+        self._lock = Lock()
+        self._stats = None
+        self._stacks = Counter()
+        self._rule_times = Counter()
+        self.files = []
+
+    def sampled(self, filename):
+        '''Whether the file is among the fraction to profile, by a stable hash of its name.'''
+        return self._rate >= 1 or zlib.crc32(filename.encode("utf-8")) % 10000 < self._rate * 10000
+
+    def run(self, filename, func, *args, **kwargs):
+        '''Run func(*args, **kwargs), which remakes the file, under the profiler if the file is sampled.'''
+        if not self.sampled(filename):
+            return func(*args, **kwargs)
+        prof = cProfile.Profile()
+        sampler = _stackSampler(get_ident(), self._interval)
+        _current.files_dir, _current.children = self._files_dir, []
+        start_rule_timing()
+        sampler.start()
+        try:
+            prof.enable()
+        except ValueError:
+            # another thread is being profiled (Python 3.12+)
+            prof = None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if prof is not None:
+                prof.disable()
+            sampler.stop()
+            rule_times = Counter(stop_rule_timing())
+            children, _current.files_dir = _current.children, None
+            self._add(filename, prof, sampler.stacks, rule_times, children)
+
+    def _add(self, filename, prof, stacks, rule_times, children):
+        path = join(self._files_dir, filename.replace("/", "__") + ".prof")
+        stats = None
+        if prof is not None:
+            prof.dump_stats(path)
+            stats = pstats.Stats(path)
+        for child_path, child_times in children:
+            rule_times.update(child_times)
+            if stats is None:
+                stats = pstats.Stats(child_path)
+            else:
+                stats.add(child_path)
+        if stats is not None and children:
+            stats.dump_stats(path)
+        for child_path, _ in children:
+            remove(child_path)
+        with self._lock:
+            self.files.append(filename)
+            self._stacks.update(stacks)
+            self._rule_times.update(rule_times)
+            if stats is not None:
+                if self._stats is None:
+                    self._stats = pstats.Stats(path)
+                else:
+                    self._stats.add(path)
+
+    def stage_times(self):
+        '''Return the cumulative seconds per pipeline stage over the profiled files.'''
+        out = {}
+        with self._lock:
+            entries = self._stats.stats.items() if self._stats is not None else []
+            for stage, funcs in stages:
+                out[stage] = round(sum(ct for (filename, _, name), (_, _, _, ct, _) in entries
+                                       if name in funcs and not filename.startswith("<")
+                                       and (name != "__iter__" or filename.endswith("xmlHandler.py"))), 4)
+        return out
+
+    def rule_times(self):
+        '''Return the (rule target, seconds) pairs over the profiled files, the slowest first.'''
+        with self._lock:
+            return [(rule, round(seconds, 4)) for rule, seconds in self._rule_times.most_common()]
+
+    def write_report(self, top=30):
+        '''Write remake.prof, remake.collapsed and report.txt in the profile_dir. Return the path of report.txt.'''
+        with self._lock:
+            if self._stats is not None:
+                self._stats.dump_stats(join(self._profile_dir, "remake.prof"))
+            with open(join(self._profile_dir, "remake.collapsed"), "w") as f:
+                for stack, count in sorted(self._stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            files = len(self.files)
+
+        lines = [f"Profiled files: {files}", "", "Time per stage (cumulative seconds):"]
+        lines += [f"{stage:>12}  {seconds:10.4f}" for stage, seconds in self.stage_times().items()]
+        lines += ["", "Regex time per rule (seconds):"]
+        lines += [f"{seconds:10.4f}  {rule}" for rule, seconds in self.rule_times()[:top]]
+        lines += ["", "Hot functions:"]
+        if self._stats is not None:
+            out = io.StringIO()
+            with self._lock:
+                self._stats.stream = out
+                self._stats.sort_stats("tottime").print_stats(top)
+                self._stats.stream = sys.stdout
+            lines.append(out.getvalue())
+        path = join(self._profile_dir, "report.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
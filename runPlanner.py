@@ -0,0 +1,195 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A dry-run planner for the corpus runs of xmlRemaker, which estimates what a run would cost before
+it starts: the files skipped by text_lower_len/text_upper_len, the CoreNLP requests and the wall time at a
+given concurrency, without parsing the files with bs4.
+
+The body length is estimated from byte offsets: the (decompressed) file is scanned for the first start tag
+of the body_node and its last end tag, and the span between them is scaled by the ratio of the length that
+_text_len_check sees (the prettified body) to the span, measured on a small sample of fully parsed files. The
+seconds and the CoreNLP requests of a file are predicted from its size by a linear model fitted on the per-file
+records of the previous runs of the same mode (.remake_stats*.json), or else from rough defaults. The wall time
+is then simulated for the given number of threads, for both the fixed batches and the continuous admission of
+the memory_budget mode.
+'''
+from xmlHandler import open_xml
+from os.path import join, exists
+from os import listdir
+import heapq
+import json
+import re
+
+
+# the files whose estimated body length is this close (relatively) to a limit may end up on its other side
+near_limit = 0.1
+
+# rough defaults of the model when there is no previous run to calibrate it on: the seconds per file, per byte
+# and per byte annotated, and the chars per CoreNLP request
+default_model = {"intercept": 0.05, "per_byte": 2e-6, "per_byte_annotated": 8e-6, "char_budget": 100000}
+
+
+def body_span(filepath, body_node, chunk_size=1 << 20):
+    '''Return the number of bytes from the first start tag of the body_node to the end of its last end tag
+    in a (possibly compressed) xml file, or in the bytes of one, by scanning it without parsing. 0 if not found.'''
+    name = re.escape(body_node.encode("utf-8"))
+    start_tag = re.compile(rb"<(?:[\w.-]+:)?" + name + rb"[\s>/]")
+    end_tag = re.compile(rb"</(?:[\w.-]+:)?" + name + rb"\s*>")
+    start = end = None
+    offset, tail = 0, b""
+    with open_xml(filepath) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            # the tail of the chunk before is kept for a tag cut in two by the chunking
+            buf, base = tail + chunk, offset - len(tail)
+            if start is None:
+                m = start_tag.search(buf)
+                if m:
+                    start = base + m.start()
+            if start is not None:
+                for m in end_tag.finditer(buf):
+                    if base + m.end() > (end or 0) and base + m.start() >= start:
+                        end = base + m.end()
+            offset += len(chunk)
+            tail = buf[-(len(name) + 64):]
+    if start is None or end is None:
+        return 0
+    return end - start
+
+
+def _fit(points):
+    '''Fit y = a + b * x by least squares over the (x, y) points, with a and b kept non-negative.'''
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var = sum((x - mean_x) ** 2 for x, _ in points)
+    b = sum((x - mean_x) * (y - mean_y) for x, y in points) / var if var else 0.0
+    b = max(0.0, b)
+    a = max(0.0, mean_y - b * mean_x)
+    return a, b
+
+
+class throughputModel:
+    '''Predict the seconds and the CoreNLP requests of remaking a file from its size (bytes).
+
+    Args (initialization):
+        - records(list): the per-file records of previous runs (status, seconds, bytes, requests), see
+        xmlCorpusRemaker.get_run_stats(). Only the remade ones are used.
+        - annotated(bool): whether the files are also pos tagged and/or lemmatized, for the defaults.
+        - min_records(int): the number of records needed to fit the model, otherwise the defaults are used.
+        Defaults to 3.
+    '''
+    def __init__(self, records, annotated=False, min_records=3):
+        records = [r for r in records if r.get("status") == "remade" and r.get("bytes") and r.get("seconds")]
+        self.records = len(records)
+        self.calibrated = len(records) >= min_records
+        self._annotated = annotated
+        if self.calibrated:
+            self.seconds = _fit([(r["bytes"], r["seconds"]) for r in records])
+            with_requests = [(r["bytes"], r["requests"]) for r in records if r.get("requests") is not None]
+            self.requests = _fit(with_requests) if len(with_requests) >= min_records else None
+        else:
+            per_byte = default_model["per_byte_annotated" if annotated else "per_byte"]
+            self.seconds = (default_model["intercept"], per_byte)
+            self.requests = None
+
+    @classmethod
+    def from_stats(cls, stats_paths, mode, options=None, annotated=False, min_records=3):
+        '''Fit a model on the records of the stats files (.remake_stats*.json) of the runs of the given mode
+        (e.g., "pos_tag_xml_body"). When options are given (e.g., {"apply_prep_rules": True, "spell_norm": True}),
+        the runs recorded with other options are left out, unless none is left.'''
+        runs = []
+        for path in stats_paths:
+            try:
+                with open(path, "r") as f:
+                    stats = json.load(f)
+            except (OSError, ValueError):
+                continue
+            modes = stats.get("mode") if isinstance(stats.get("mode"), list) else [stats.get("mode")]
+            if mode in modes:
+                runs.append(stats)
+        if options is not None and any(stats.get("options") == options for stats in runs):
+            runs = [stats for stats in runs if stats.get("options") == options]
+        return cls([rec for stats in runs for rec in stats.get("files", [])], annotated, min_records)
+
+    def predict(self, size, body_chars):
+        '''Return the (seconds, requests) of remaking a file of the given size (bytes) and body length (chars).'''
+        seconds = self.seconds[0] + self.seconds[1] * size
+        if self.requests is not None:
+            requests = self.requests[0] + self.requests[1] * size
+        else:
+            # a tokenizing request (and an annotating one) per slice of up to char_budget chars
+            slices = -(-max(body_chars, 1) // default_model["char_budget"])
+            requests = slices * (2 if self._annotated else 1)
+        return seconds, requests
+
+    def describe(self):
+        out = {"calibrated": self.calibrated, "records": self.records,
+               "seconds": {"intercept": round(self.seconds[0], 6), "per_byte": self.seconds[1]}}
+        if self.requests is not None:
+            out["requests"] = {"intercept": round(self.requests[0], 4), "per_byte": self.requests[1]}
+        return out
+
+
+def stats_files(dst_dir):
+    '''Return the paths of the run stats saved in a dst_dir, the shards' included.'''
+    if not exists(dst_dir):
+        return []
+    return sorted(join(dst_dir, f) for f in listdir(dst_dir) if re.fullmatch(r"\.remake_stats(\..+)?\.json", f))
+
+
+def simulate_wall_time(seconds, threads_num, batched=True):
+    '''Return the wall time of running files of the given seconds (in order) on threads_num threads: in batches
+    of threads_num files (the multitasking runs), or each file starting as soon as a thread is free.'''
+    if threads_num <= 1:
+        return sum(seconds)
+    if batched:
+        return sum(max(seconds[i:i + threads_num]) for i in range(0, len(seconds), threads_num))
+    free = [0.0] * threads_num
+    for s in seconds:
+        heapq.heapreplace(free, free[0] + s)
+    return max(free) if seconds else 0.0
+
+
+def plan_files(files, body_node, model, text_lower_len=0, text_upper_len=1000000, ratio=1.0, segmented=None):
+    '''Plan the files given as (filename, filepath or bytes, size) triples. Return the per-file plan: the estimated
+    body length, the status ("remake", "skip_lower", "skip_upper" or "segmented"), whether the estimate is near
+    a limit, and the predicted CoreNLP requests and seconds of the files to remake.
+
+    The ratio scales the byte span of the body to the length _text_len_check sees. segmented(filename, source),
+    if given, tells whether a file above text_upper_len would be remade segmented instead of skipped.'''
+    plan = []
+    for filename, source, size in files:
+        body_chars = int(body_span(source, body_node) * ratio)
+        near = any(limit and abs(body_chars - limit) <= near_limit * limit for limit in (text_lower_len, text_upper_len))
+        if body_chars < text_lower_len:
+            status = "skip_lower"
+        elif text_upper_len is not None and body_chars > text_upper_len:
+            status = "segmented" if segmented is not None and segmented(filename, source) else "skip_upper"
+        else:
+            status = "remake"
+        rec = {"filename": filename, "bytes": size, "body_chars": body_chars, "status": status, "near_limit": near,
+               "requests": 0, "seconds": 0.0}
+        if status in ("remake", "segmented"):
+            seconds, requests = model.predict(size, body_chars)
+            rec["seconds"], rec["requests"] = round(seconds, 4), int(round(requests))
+        plan.append(rec)
+    return plan
+
+
+def summarize_plan(plan, threads_num=10):
+    '''Return the totals of a per-file plan: the counts per status, the files near a limit, the CoreNLP requests,
+    the summed seconds and the wall time on threads_num threads, batched and continuous.'''
+    counts = {}
+    for rec in plan:
+        counts[rec["status"]] = counts.get(rec["status"], 0) + 1
+    seconds = [rec["seconds"] for rec in plan if rec["status"] in ("remake", "segmented")]
+    return {"files": len(plan), "counts": counts, "near_limit": sum(rec["near_limit"] for rec in plan),
+            "requests": sum(rec["requests"] for rec in plan), "cpu_seconds": round(sum(seconds), 2),
+            "threads_num": threads_num,
+            "wall_seconds_batched": round(simulate_wall_time(seconds, threads_num, batched=True), 2),
+            "wall_seconds_continuous": round(simulate_wall_time(seconds, threads_num, batched=False), 2),
+            "wall_seconds_sequential": round(sum(seconds), 2)}
@@ -0,0 +1,100 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: Compact on-disk checkpoints of the stages of the remake pipeline, so that a later run restarts
+from the deepest stage whose inputs and config have not changed, e.g., changing only the root_name or
+retrying a file whose annotation failed does not redo the CoreNLP tokenization.
+
+The stages, in order, are:
+    - header: the header of the xml file and the length of its body;
+    - tokenized: the CoreNLP tokenized body (the original tags replaced by <tag>) and the list of the tags;
+    - preprocessed: the tokenized body after the preprocessing rules (apply_prep_rules=True only);
+    - normalized: the spelling normalized body (spell_norm=True only);
+    - annotated: the annotation columns (pos and/or lemma).
+
+Every checkpoint is keyed by the key of the stage before it plus the config of its own stage (e.g., the
+fingerprint of the rules applied), down to the content hash of the input file for the header stage. A change
+anywhere upstream thus invalidates every checkpoint after it. A checkpoint is a gzipped json file at
+<ckpt_dir>/<stage>/<key[:2]>/<key>.json.gz, written atomically.
+'''
+from os.path import join, exists
+from os import makedirs, replace, getpid
+from threading import Lock, get_ident
+import hashlib
+import json
+import gzip
+
+
+stages = ("header", "tokenized", "preprocessed", "normalized", "annotated")
+
+
+def content_hash(data):
+    '''Return the hash of the bytes of an input file.'''
+    return hashlib.sha1(data).hexdigest()
+
+
+def config_fingerprint(obj):
+    '''Return a short hash of any json serializable config, e.g., a list of rules.'''
+    return hashlib.md5(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+class stageCheckpoints:
+    '''A thread-safe store of the stage checkpoints of the remake pipeline.
+
+    Args (initialization):
+        - ckpt_dir(str): the directory of the checkpoints, created if it does not exist.
+        - compresslevel(int): the gzip compression level of the checkpoints, defaults to 6.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> ckpts = stageCheckpoints(join(dst_dir, ".checkpoints"))
+    >>> key = ckpts.key("header", content_hash(data), {"head_node": "teiHeader", "body_node": "text"})
+    >>> ckpts.get("header", key)            # None, or the dict that was put
+    >>> ckpts.put("header", key, {"header": header, "body_len": len(body)})
+    >>> ckpts.stats()                       # hits and misses per stage
+    '''
+    def __init__(self, ckpt_dir, compresslevel=6):
+        self._ckpt_dir = ckpt_dir
+        self._compresslevel = compresslevel
+        self._lock = Lock()
+        self._counts = {stage: {"hits": 0, "misses": 0} for stage in stages}
+        makedirs(ckpt_dir, exist_ok=True)
+
+    def key(self, stage, parent_key, config=None):
+        '''Return the key of a stage given the key of the stage it starts from and its own config.'''
+        return hashlib.md5(json.dumps([stage, parent_key, config], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _path(self, stage, key):
+        return join(self._ckpt_dir, stage, key[:2], key + ".json.gz")
+
+    def get(self, stage, key):
+        '''Return the checkpoint of a stage as a dict, or None if there is no valid one.'''
+        path = self._path(stage, key)
+        out = None
+        if exists(path):
+            try:
+                with gzip.open(path, "rb") as f:
+                    out = json.loads(f.read().decode("utf-8"))
+            except (OSError, EOFError, ValueError):
+                out = None
+        with self._lock:
+            self._counts[stage]["hits" if out is not None else "misses"] += 1
+        return out
+
+    def put(self, stage, key, value):
+        '''Save the checkpoint of a stage. The file is written aside and then renamed, so that a crashed
+        or concurrent run never leaves a partial checkpoint behind.'''
+        path = self._path(stage, key)
+        makedirs(join(self._ckpt_dir, stage, key[:2]), exist_ok=True)
+        tmp = "%s.%i.%i.tmp" % (path, getpid(), get_ident())
+        with open(tmp, "wb") as f:
+            f.write(gzip.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), self._compresslevel))
+        replace(tmp, path)
+
+    def stats(self):
+        '''Return the checkpoint hits and misses per stage since the store was opened.'''
+        with self._lock:
+            return {stage: dict(c) for stage, c in self._counts.items()}
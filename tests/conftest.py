@@ -0,0 +1,7 @@
+import sys
+import os
+
+# the modules of the repo are imported from its root, whose config paths are relative
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
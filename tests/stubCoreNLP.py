@@ -0,0 +1,82 @@
+'''A stub standing in for a CoreNLP server in the tests: it answers the same POST requests (tokenize, or
+tokenize,ssplit,pos,lemma) with json in the CoreNLP format, and GET /live with 200. Every word is tagged NN
+(punctuation ":") and lemmatized to its lowercase form. It runs in a thread of the test process.'''
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from threading import Thread, Lock
+import ast
+import json
+import time
+import re
+
+
+class stubCoreNLP:
+    '''A stub CoreNLP server on localhost:port (0 for any free port), which takes delay seconds per request.
+    It counts the requests, and the most requests in flight at once.'''
+    def __init__(self, port=0, delay=0.0):
+        self.port = port
+        self.delay = delay
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.port}"
+
+    def start(self):
+        stub = self
+
+        class handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(b"live")
+
+            def do_POST(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    time.sleep(stub.delay)
+                    props = parse_qs(urlparse(self.path).query).get("properties", ["{}"])[0]
+                    text = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                    body = json.dumps(stub.annotate(text, ast.literal_eval(props))).encode("utf-8")
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out and hung up
+
+        self._server = ThreadingHTTPServer(("localhost", self.port), handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def annotate(self, text, props):
+        if props.get("tokenize.whitespace") == "true":
+            words = re.findall(r"\S+", text)
+        else:
+            words = re.findall(r"<tag>|\w+|[^\w\s]", text)
+        tokens = [{"originalText": w, "word": w, "pos": "NN" if w[0].isalpha() else ":", "lemma": w.lower()}
+                  for w in words]
+        if "ssplit" in props.get("annotators", ""):
+            return {"sentences": [{"tokens": tokens}]}
+        return {"tokens": tokens}
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
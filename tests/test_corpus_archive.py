@@ -0,0 +1,41 @@
+'''The tar shards written by a process that dies hold every member their index lists, and a writer resumes
+over an index whose last line was half written.'''
+import subprocess
+import sys
+
+from conftest import ROOT
+from corpusArchive import archiveShardWriter, load_archive_index, read_archive_member
+
+
+WRITER = '''
+import sys, os
+sys.path.insert(0, {root!r})
+from corpusArchive import archiveShardWriter
+writer = archiveShardWriter({dst!r})
+for i in range(3):
+    writer.add("f%i.xml" % i, ("<TEI.2>%i</TEI.2>" % i).encode() * 100)
+os._exit(0)   # killed: nothing is closed or flushed
+'''
+
+
+def test_a_killed_writer_leaves_no_truncated_members(tmp_path):
+    subprocess.run([sys.executable, "-c", WRITER.format(root=ROOT, dst=str(tmp_path))], check=True)
+    index = load_archive_index(str(tmp_path))
+    assert sorted(index) == ["f0.xml", "f1.xml", "f2.xml"]
+    for i in range(3):
+        assert read_archive_member(str(tmp_path), f"f{i}.xml", index) == (f"<TEI.2>{i}</TEI.2>" * 100).encode()
+
+
+def test_resume_over_a_half_written_index_line(tmp_path):
+    with archiveShardWriter(str(tmp_path)) as writer:
+        writer.add("f0.xml", b"<TEI.2>0</TEI.2>")
+    with open(tmp_path / "remade.index.jsonl", "a") as f:
+        f.write('["f1.xml", "remade-00')
+    assert sorted(load_archive_index(str(tmp_path))) == ["f0.xml"]
+    
+    with archiveShardWriter(str(tmp_path)) as writer:
+        assert "f1.xml" not in writer
+        writer.add("f1.xml", b"<TEI.2>1</TEI.2>")
+    index = load_archive_index(str(tmp_path))
+    assert sorted(index) == ["f0.xml", "f1.xml"]
+    assert read_archive_member(str(tmp_path), "f1.xml", index) == b"<TEI.2>1</TEI.2>"
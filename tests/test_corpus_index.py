@@ -0,0 +1,22 @@
+'''The KWIC windows of a hit come from the file it was found in, even when several indexed sources have a file
+of the same name.'''
+from corpusIndex import corpusIndex
+
+
+def _remade(path, words):
+    nodes = "".join(f'<w Original="{w}" lemma="{w.lower()}">{w}</w>' for w in words)
+    path.write_text(f"<TEI.2><teiHeader/><text>{nodes}</text></TEI.2>")
+
+
+def test_windows_of_files_of_the_same_name(tmp_path):
+    for corpus, words in (("a", "He went unto the hill".split()), ("b", "She loveth the vale so".split())):
+        (tmp_path / corpus).mkdir()
+        _remade(tmp_path / corpus / "f0.xml", words)
+    index = corpusIndex(str(tmp_path / "index.sqlite"))
+    index.add_xml_dir(str(tmp_path / "a"))
+    index.add_xml_dir(str(tmp_path / "b"))
+    assert len(index) == 2
+    assert index.query(window=2, lemma="loveth") == [("f0.xml", 1, "She", "loveth", "the vale")]
+    assert index.query(window=2, lemma="went") == [("f0.xml", 1, "He", "went", "unto the")]
+    assert index.lookup("lemma", "the") == [("f0.xml", 3), ("f0.xml", 2)]
+    index.close()
@@ -0,0 +1,39 @@
+'''A manifest saved for another corpus_dir or other scanning settings is not reused.'''
+import pytest
+
+from corpusManifest import corpusManifest
+
+
+@pytest.fixture
+def corpora(tmp_path):
+    for corpus, names in (("a", ["a0.xml", "a1.xml"]), ("b", ["b0.xml", "b1.txt"])):
+        (tmp_path / corpus / "sub").mkdir(parents=True)
+        for name in names:
+            (tmp_path / corpus / name).write_text("<TEI.2/>")
+        (tmp_path / corpus / "sub" / "s0.xml").write_text("<TEI.2/>")
+    return tmp_path
+
+
+def test_a_manifest_of_another_corpus_is_rescanned(corpora):
+    path = str(corpora / "corpus.manifest")
+    corpusManifest(str(corpora / "a") + "/", file_format=".xml", manifest_path=path)
+    manifest = corpusManifest(str(corpora / "b") + "/", file_format=".xml", manifest_path=path)
+    assert manifest.filenames() == ["b0.xml"]
+    # and replaced: the same corpus loads it as it is from now on
+    assert corpusManifest(str(corpora / "b"), file_format=".xml", manifest_path=path, refresh=False).filenames() == ["b0.xml"]
+
+
+def test_a_manifest_of_other_settings_is_rescanned(corpora):
+    path = str(corpora / "corpus.manifest")
+    corpusManifest(str(corpora / "a") + "/", file_format=".xml", manifest_path=path)
+    manifest = corpusManifest(str(corpora / "a") + "/", include_sub_dir=True, file_format=".xml", manifest_path=path)
+    assert manifest.filenames() == ["a0.xml", "a1.xml", "sub/s0.xml"]
+    manifest = corpusManifest(str(corpora / "a") + "/", include_sub_dir=True, file_format=None, manifest_path=path)
+    assert len(manifest) == 3
+
+
+def test_a_shared_manifest_of_another_corpus_raises(corpora):
+    path = str(corpora / "corpus.manifest")
+    corpusManifest(str(corpora / "a") + "/", file_format=".xml", manifest_path=path)
+    with pytest.raises(ValueError):
+        corpusManifest(str(corpora / "b") + "/", file_format=".xml", manifest_path=path, refresh=False)
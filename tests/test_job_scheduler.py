@@ -0,0 +1,91 @@
+'''fairShareScheduler caps the CoreNLP requests in flight across the jobs, hedged duplicates included, and shares
+the slots between busy jobs by their weights.'''
+from threading import Thread, Event
+import json
+import time
+
+from corenlpToolbox import coreNLPServerPool, stanfordTokenizer, set_request_job
+from jobScheduler import fairShareScheduler
+from remakeLogger import configure_logging
+from stubCoreNLP import stubCoreNLP
+import pytest
+
+
+@pytest.fixture
+def stub():
+    server = stubCoreNLP(delay=0.01).start()
+    yield server
+    server.stop()
+
+
+def _busy(tokenizer, job, stop):
+    set_request_job(job)
+    while not stop.is_set():
+        tokenizer.tokenize("Hello there .")
+
+
+def test_in_flight_cap_and_weighted_shares(stub):
+    with coreNLPServerPool([stub.port], health_interval=3600) as pool, \
+            fairShareScheduler(max_in_flight=2) as scheduler:
+        tokenizer = stanfordTokenizer(pool=pool)
+        scheduler.add_job("heavy", weight=2)
+        scheduler.add_job("light", weight=1)
+        stop = Event()
+        threads = [Thread(target=_busy, args=(tokenizer, job, stop)) for job in ["heavy", "light"] * 4]
+        for thread in threads:
+            thread.start()
+        time.sleep(2)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        jobs = scheduler.stats()["jobs"]
+    assert stub.max_in_flight == 2
+    assert 1.6 < jobs["heavy"]["requests"] / jobs["light"]["requests"] < 2.4
+
+
+def test_hedged_requests_pass_the_gate(stub):
+    with coreNLPServerPool([stub.port], health_interval=3600) as pool, \
+            fairShareScheduler(max_in_flight=1) as scheduler:
+        tokenizer = stanfordTokenizer(pool=pool)
+        tokenizer.set_deadlines(hedge=True)
+        for _ in range(20):
+            tokenizer.tokenize("Hello there .")
+        # slower than the p95 of the first requests: every request is hedged, but waits for the one slot
+        stub.delay = 0.1
+        threads = [Thread(target=tokenizer.tokenize, args=("Hello there .",)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert tokenizer.latency_stats()["hedged"] > 0
+        # the duplicates no longer needed give their slots back, in the background
+        deadline = time.time() + 5
+        while scheduler.stats()["in_flight"] and time.time() < deadline:
+            time.sleep(0.05)
+        assert scheduler.stats()["in_flight"] == 0
+    assert stub.max_in_flight == 1
+
+
+class _failingRemaker:
+    def set_job(self, name):
+        pass
+
+    def tokenize_the_corpus(self):
+        raise OSError("the corpus is gone")
+
+
+def test_a_failed_job_is_a_logged_record(tmp_path):
+    path = tmp_path / "log.jsonl"
+    configure_logging("silent", str(path))
+    scheduler = fairShareScheduler()
+    try:
+        scheduler.submit("broken", _failingRemaker())
+        scheduler.wait("broken")
+    finally:
+        scheduler.close()
+        configure_logging()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    failed = [rec for rec in records if rec["event"] == "job_failed"]
+    assert len(failed) == 1
+    assert failed[0]["level"] == "error" and failed[0]["stage"] == "tokenize_the_corpus"
+    assert failed[0]["job"] == "broken" and "the corpus is gone" in failed[0]["error"]
@@ -0,0 +1,51 @@
+'''affected_files finds every file whose normalization changes with the rules, including through chained rules.'''
+import pytest
+
+from normalizationState import normalizationState, load_norm_rule_set
+from textNormalizer import textNormalizing
+
+
+BODIES = {"a.xml": "he went vnto the hill", "b.xml": "the cat sat", "c.xml": "he loueth her"}
+
+
+@pytest.fixture(scope="module")
+def verbs_irreg():
+    _, verbs, irreg_v_dict = load_norm_rule_set()
+    return verbs, irreg_v_dict
+
+
+def _affected(tmp_path, old, new):
+    state = normalizationState(str(tmp_path), old)
+    for name, body in BODIES.items():
+        state.record(name, state.fingerprint, body)
+    try:
+        return state.affected_files(new)
+    finally:
+        state.close()
+
+
+def _changed(old, new):
+    return sorted(n for n, body in BODIES.items() if textNormalizing(body, *old) != textNormalizing(body, *new))
+
+
+@pytest.mark.parametrize("old_rules, new_rules", [
+    ((("vnto", "unto"),), (("vnto", "unto"), ("unto", "to"))),
+    ((("cat", "dog"),), (("cat", "dog"), ("dog", "hound"))),
+    ((), (("sat", "sate"),)),
+])
+def test_chained_rules(tmp_path, verbs_irreg, old_rules, new_rules):
+    verbs, irreg_v_dict = verbs_irreg
+    old, new = (old_rules, verbs, irreg_v_dict), (new_rules, verbs, irreg_v_dict)
+    affected, unaffected = _affected(tmp_path, old, new)
+    assert affected == _changed(old, new)
+    assert sorted(affected + unaffected) == sorted(BODIES)
+
+
+def test_verb_changed_after_a_rule(tmp_path, verbs_irreg):
+    (vb, vbz, vbd), irreg_v_dict = verbs_irreg
+    keep = [i for i, v in enumerate(vb) if v != "love"]
+    fewer = ([vb[i] for i in keep], [vbz[i] for i in keep], [vbd[i] for i in keep])
+    rules = (("loueth", "loveth"),)
+    old, new = (rules, (vb, vbz, vbd), irreg_v_dict), (rules, fewer, irreg_v_dict)
+    affected, _ = _affected(tmp_path, old, new)
+    assert affected == _changed(old, new) == ["c.xml"]
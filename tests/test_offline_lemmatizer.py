@@ -0,0 +1,20 @@
+'''The offline lemmatizer gives one lemma per whitespace-separated token, as the remade bodies pair them.'''
+import pytest
+
+from offlineLemmatizer import offlineLemmatizer
+
+
+@pytest.fixture(scope="module")
+def lemmatizer():
+    return offlineLemmatizer()
+
+
+@pytest.mark.parametrize("text", ["if a < b and c > d then <tag> x", "He loveth the hills <tag> and went", "< >"])
+def test_one_lemma_per_token(lemmatizer, text):
+    tokens, lemmas = lemmatizer.get_lemma(text, include_tokens=True)
+    assert tokens == text.split()
+    assert len(lemmas) == len(tokens)
+
+
+def test_lemmas(lemmatizer):
+    assert lemmatizer.get_lemma("He loveth the hills") == ["he", "love", "the", "hill"]
@@ -0,0 +1,77 @@
+'''remakeDaemon takes the jobs dropped in its spool directory, remakes a file listed twice once, and reports the
+jobs in status/.'''
+import json
+import os
+import time
+
+import pytest
+
+import xmlRemaker as X
+from corenlpToolbox import coreNLPServerPool
+from remakeDaemon import remakeDaemon
+from stubCoreNLP import stubCoreNLP
+
+
+@pytest.fixture
+def stub():
+    # the worker threads of the daemon use the shared clients, pointed at the stub for the test
+    server = stubCoreNLP().start()
+    pool = coreNLPServerPool([server.port], health_interval=3600)
+    clients = (X.stTK, X.sta, X.stfa)
+    before = [client._nlp for client in clients]
+    for client in clients:
+        client.use_pool(pool)
+    yield server
+    for client, nlp in zip(clients, before):
+        client.use_pool(nlp)
+    pool.close()
+    server.stop()
+
+
+def _spool(spool_dir, job_id, job):
+    path = os.path.join(spool_dir, "incoming", job_id + ".json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(job, f)
+    os.replace(path + ".tmp", path)
+
+
+def _status(spool_dir, job_id, timeout=30):
+    path = os.path.join(spool_dir, "status", job_id + ".json")
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                rec = json.load(f)
+            if rec["state"] in ("done", "rejected"):
+                return rec
+        time.sleep(0.05)
+    raise AssertionError(f"The job {job_id} is not done after {timeout} seconds.")
+
+
+def test_spooled_jobs_are_remade_and_reported(tmp_path, stub):
+    corpus_dir, dst_dir, spool_dir = tmp_path / "corpus", tmp_path / "remade", str(tmp_path / "spool")
+    corpus_dir.mkdir()
+    docs = {}
+    for i in range(2):
+        docs[f"f{i}.xml"] = f"<TEI.2><teiHeader><title>F{i}</title></teiHeader><text><body><p>He loveth the " \
+                            f"hill {i}, quoth she.</p></body></text></TEI.2>".encode("utf-8")
+        (corpus_dir / f"f{i}.xml").write_bytes(docs[f"f{i}.xml"])
+    daemon = remakeDaemon(spool_dir=spool_dir, workers=2, poll_interval=0.05, keep_alive=False, warm_up=False).start()
+    try:
+        # f0 is listed twice, once by another path to it: the job is done once both files are
+        files = [str(corpus_dir / "f0.xml"), str(corpus_dir / "f1.xml"), str(corpus_dir) + "/./f0.xml"]
+        _spool(spool_dir, "pos", {"files": files, "head_node": "teiHeader", "body_node": "text",
+                                  "dst_dir": str(dst_dir), "mode": "pos_tag", "options": {"apply_prep_rules": True}})
+        _spool(spool_dir, "bad", {"files": files, "head_node": "teiHeader", "body_node": "text",
+                                  "dst_dir": str(dst_dir), "mode": "parse"})
+        rec = _status(spool_dir, "pos")
+        rejected = _status(spool_dir, "bad")
+    finally:
+        daemon.stop()
+    assert rec["total"] == 2 and len(rec["files"]) == 2 and rec["counts"] == {"remade": 2}
+    assert rejected["state"] == "rejected" and "Unknown mode" in rejected["error"]
+    assert os.listdir(os.path.join(spool_dir, "incoming")) == []
+    assert stub.requests > 0
+    for name, doc in docs.items():
+        assert (dst_dir / name).read_bytes() == X.remake(doc, "teiHeader", "text", "pos_tag",
+                                                           options={"apply_prep_rules": True})
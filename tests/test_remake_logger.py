@@ -0,0 +1,15 @@
+'''Replacing the logger writes out the records of the old one and stops its writer thread.'''
+import json
+
+from remakeLogger import remakeLogger
+
+
+def test_close_writes_the_records_and_stops_the_writer(tmp_path):
+    path = tmp_path / "log.jsonl"
+    logger = remakeLogger("silent", str(path))
+    for i in range(100):
+        logger.log("created", f"file {i} created", file=f"{i}.xml")
+    logger.close()
+    assert not logger._writer.is_alive()
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [rec["file"] for rec in records] == [f"{i}.xml" for i in range(100)]
@@ -0,0 +1,154 @@
+'''xmlCorpusRemaker runs against stub CoreNLP servers: the pool and deadlines of a remaker apply to its own runs.'''
+import json
+import os
+import re
+from contextlib import ExitStack
+
+import pytest
+
+import xmlRemaker as X
+from corenlpToolbox import coreNLPServerPool
+from stubCoreNLP import stubCoreNLP
+
+
+@pytest.fixture
+def stubs():
+    servers = [stubCoreNLP().start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def pools(stubs):
+    pools = [coreNLPServerPool([server.port], health_interval=3600) for server in stubs]
+    yield pools
+    for pool in pools:
+        pool.close()
+
+
+def _body(i):
+    return "".join(f"<p>He loveth the hill and the vale {i}, quoth she.</p><p>Then {j} men came & went.</p>" 
+                   for j in range(i + 2))
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    for i in range(4):
+        (corpus_dir / f"f{i}.xml").write_text(f"<TEI.2><teiHeader><title>F{i}</title></teiHeader>"
+                                              f"<text><body>{_body(i)}</body></text></TEI.2>")
+    return str(corpus_dir) + "/"
+
+
+def test_the_pool_of_a_remaker_applies_to_its_own_runs(tmp_path, corpus, stubs, pools):
+    first = X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=str(tmp_path / "first"), corenlp_pool=pools[0])
+    second = X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=str(tmp_path / "second"), corenlp_pool=pools[1])
+    first.pos_tag_the_corpus()
+    assert stubs[0].requests > 0 and stubs[1].requests == 0
+    requests = stubs[0].requests
+    second.pos_tag_the_corpus()
+    assert stubs[0].requests == requests and stubs[1].requests > 0
+    # the shared clients are left as they were
+    assert all(client._nlp not in pools for client in (X.stTK, X.sta, X.stfa))
+    assert sorted(os.listdir(tmp_path / "first")) == sorted(os.listdir(tmp_path / "second"))
+
+
+def test_renormalizing_keeps_the_lemmatizer_of_the_remake(tmp_path, corpus, stubs, pools):
+    dst_dir = str(tmp_path / "remade")
+    remaker = X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=dst_dir, corenlp_pool=pools[0],
+                                 keep_norm_state=True, lemmatizer="offline")
+    remaker.lemmatize_the_corpus(apply_prep_rules=True, spell_norm=True)
+    rules = tmp_path / "normalizing_rules.txt"
+    rules.write_text(open("config/normalizing_rules.txt", encoding="utf-8").read() + "\nvale\tdale", encoding="utf-8")
+    
+    # a remaker of the default lemmatizer re-normalizes the files with the offline one they were remade with
+    requests = stubs[0].requests
+    remaker = X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=dst_dir, corenlp_pool=pools[0])
+    assert len(remaker.renormalize_the_corpus(norm_rules_path=str(rules))) == 4
+    assert stubs[0].requests == requests
+    remade = open(os.path.join(dst_dir, "f0.xml"), encoding="utf-8").read()
+    assert 'Normalized="dale"' in remade and 'lemma="dale"' in remade
+
+
+def _words(path):
+    xml = open(path, encoding="utf-8").read()
+    return [(dict(re.findall(r'(\w+)="([^"]*)"', attrs)), text)
+            for attrs, text in re.findall(r"<w ([^>]*)>\s*(.*?)\s*</w>", xml, re.S)]
+
+
+def test_segmented_files_are_remade_word_for_word_as_whole_ones(tmp_path, corpus, pools):
+    plain, segmented = str(tmp_path / "plain"), str(tmp_path / "segmented")
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=plain, corenlp_pool=pools[0]).pos_tag_the_corpus(
+        apply_prep_rules=True, spell_norm=True)
+    # every body is above text_upper_len, so every file is streamed in segments of about 30 chars
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=segmented, corenlp_pool=pools[0],
+                       segment_len=30).pos_tag_the_corpus(apply_prep_rules=True, spell_norm=True, text_upper_len=40)
+    for i in range(4):
+        words = _words(os.path.join(plain, f"f{i}.xml"))
+        assert len(words) > 12 and words == _words(os.path.join(segmented, f"f{i}.xml"))
+
+
+def test_deduplicated_runs_remake_the_same_bytes(tmp_path, corpus, stubs, pools):
+    # two more files with the bodies of f1 and f2 under headers of their own
+    for i, j in ((4, 1), (5, 2)):
+        with open(os.path.join(corpus, f"f{i}.xml"), "w") as f:
+            f.write(f"<TEI.2><teiHeader><title>F{i}</title></teiHeader><text><body>{_body(j)}</body></text></TEI.2>")
+    plain, deduped = str(tmp_path / "plain"), str(tmp_path / "deduped")
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=plain, corenlp_pool=pools[0]).pos_tag_the_corpus()
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=deduped, corenlp_pool=pools[1],
+                       dedup=True).pos_tag_the_corpus()
+    assert stubs[1].requests < stubs[0].requests
+    for i in range(6):
+        with open(os.path.join(plain, f"f{i}.xml"), "rb") as a, open(os.path.join(deduped, f"f{i}.xml"), "rb") as b:
+            assert a.read() == b.read()
+    with open(os.path.join(deduped, ".remake_stats.json")) as f:
+        stats = json.load(f)["dedup"]
+    assert (stats["bodies"], stats["duplicates"], stats["dedup_ratio"]) == (6, 2, round(2 / 6, 4))
+
+
+@pytest.mark.parametrize("mode, run", [("pos_tag", "pos_tag_the_corpus"), ("pos_lemma", "corpus_with_pos_lemma")])
+def test_remaking_in_memory_gives_the_bytes_of_the_corpus_run(tmp_path, corpus, stubs, pools, mode, run):
+    dst_dir = str(tmp_path / "remade")
+    options = {"apply_prep_rules": True, "spell_norm": True}
+    remaker = X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=dst_dir, corenlp_pool=pools[0])
+    getattr(remaker, run)(**options)
+    docs, saved = [], []
+    for i in range(4):
+        with open(os.path.join(corpus, f"f{i}.xml"), "rb") as f:
+            docs.append(f.read())
+        with open(os.path.join(dst_dir, f"f{i}.xml"), "rb") as f:
+            saved.append(f.read())
+    # the module level functions use the shared clients, pointed at the stub in this thread only
+    requests = stubs[0].requests
+    with ExitStack() as stack:
+        for client in (X.stTK, X.sta, X.stfa):
+            stack.enter_context(client.scoped(pool=pools[0]))
+        assert [X.remake(doc, "teiHeader", "text", mode, options=options) for doc in docs] == saved
+        # batches of a few documents each, and one batch of them all
+        assert X.remake_batch(docs, "teiHeader", "text", mode, options=options, batch_chars=200) == saved
+        assert X.remake_batch(docs, "teiHeader", "text", mode, options=options) == saved
+    assert stubs[0].requests > requests
+
+
+@pytest.mark.parametrize("spell_norm", [False, True])
+def test_fused_runs_remake_the_same_bytes_in_fewer_requests(tmp_path, corpus, stubs, pools, spell_norm):
+    plain, fused = str(tmp_path / "plain"), str(tmp_path / "fused")
+    options = {"apply_prep_rules": True, "spell_norm": spell_norm}
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=plain, corenlp_pool=pools[0]).corpus_with_pos_lemma(**options)
+    X.xmlCorpusRemaker(corpus, "teiHeader", "text", dst_dir=fused, corenlp_pool=pools[1],
+                       fused=True).corpus_with_pos_lemma(**options)
+    for i in range(4):
+        with open(os.path.join(plain, f"f{i}.xml"), "rb") as a, open(os.path.join(fused, f"f{i}.xml"), "rb") as b:
+            assert a.read() == b.read()
+    with open(os.path.join(fused, ".remake_stats.json")) as f:
+        stats = json.load(f)["fused"]
+    if spell_norm:
+        # the sentences with a word changed by the rules ("loveth", "quoth") are annotated again, in one request a file
+        assert stats["partial"] == 4 and stats["reannotated_sentences"] > 0
+        assert stubs[1].requests == 4 + stats["partial"]
+    else:
+        # one request per file instead of one to tokenize it and one to annotate it
+        assert stats["fused"] == 4 and stats["fallback"] == 0
+        assert stubs[0].requests == 8 and stubs[1].requests == 4
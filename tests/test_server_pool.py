@@ -0,0 +1,92 @@
+'''coreNLPServerPool spreads the requests over stub servers, fails over when one goes down, and brings it back
+into rotation once its health check passes again.'''
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import requests
+
+from corenlpToolbox import coreNLPServerPool, coreNLPUnavailable, stanfordTokenizer
+from stubCoreNLP import stubCoreNLP
+
+
+@pytest.fixture
+def stubs():
+    servers = [stubCoreNLP().start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        if server._server is not None:
+            try:
+                server.stop()
+            except OSError:
+                pass
+
+
+def _healthy(pool):
+    return {s["url"]: s["healthy"] for s in pool.stats()}
+
+
+def test_requests_go_to_the_least_busy_server(stubs):
+    for server in stubs:
+        server.delay = 0.2
+    with coreNLPServerPool([s.port for s in stubs], health_interval=3600) as pool:
+        tokenizer = stanfordTokenizer(pool=pool)
+        with ThreadPoolExecutor(4) as executor:
+            tokens = list(executor.map(lambda _: tokenizer.tokenize("Hello there ."), range(10)))
+    assert tokens == [["Hello", "there", "."]] * 10
+    assert all(s.requests for s in stubs)
+    assert sum(s.requests for s in stubs) == 10
+
+
+def test_failover_and_health_check(stubs):
+    down, up = stubs
+    with coreNLPServerPool([s.port for s in stubs], health_interval=3600) as pool:
+        tokenizer = stanfordTokenizer(pool=pool)
+        down.stop()
+        for _ in range(4):
+            assert tokenizer.tokenize("Hello there .") == ["Hello", "there", "."]
+        assert _healthy(pool) == {down.url: False, up.url: True}
+        served = up.requests
+
+        # the server back on its port is only in rotation again once the health check finds it live
+        down.start()
+        tokenizer.tokenize("Hello there .")
+        assert up.requests == served + 1 and down.requests == 0
+        pool.health_check()
+        assert _healthy(pool) == {down.url: True, up.url: True}
+        for _ in range(4):
+            tokenizer.tokenize("Hello there .")
+        assert down.requests > 0
+
+
+def test_no_live_server(stubs):
+    ports = [s.port for s in stubs]
+    for server in stubs:
+        server.stop()
+    with pytest.raises(RuntimeError):
+        coreNLPServerPool(ports, startup_timeout=1)
+
+
+def test_a_timeout_does_not_take_a_server_out_of_rotation(stubs):
+    slow, _ = stubs
+    slow.delay = 0.5
+    with coreNLPServerPool([slow.port], request_timeout=0.1, health_interval=3600, max_timeouts=3) as pool:
+        for timeouts in range(1, 4):
+            with pytest.raises(requests.Timeout):
+                pool.annotate("Hello there .", {"annotators": "tokenize", "outputFormat": "json"})
+            assert pool.stats()[0]["healthy"] == (timeouts < 3)
+        # no server left (nor live, for the health check to bring back): a ConnectionError, which the 
+        # annotators retry after a backoff
+        slow.stop()
+        with pytest.raises(coreNLPUnavailable) as e:
+            pool.annotate("Hello there .", {"annotators": "tokenize", "outputFormat": "json"})
+        assert isinstance(e.value, requests.ConnectionError)
+
+
+def test_timed_out_requests_are_not_latency_samples(stubs):
+    slow, _ = stubs
+    slow.delay = 0.5
+    with coreNLPServerPool([slow.port], request_timeout=0.1, health_interval=3600) as pool:
+        tokenizer = stanfordTokenizer(pool=pool)
+        tokenizer._max_retries, tokenizer._backoff = 1, 0.01
+        assert tokenizer.tokenize("Hello there .") is None
+        assert tokenizer.latency_stats()["timeouts"] == 2
+        assert tokenizer._latency.percentile(50, min_samples=1) is None
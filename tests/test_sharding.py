@@ -0,0 +1,125 @@
+'''The shards of a corpus, computed by separate processes sharing one manifest, are disjoint and cover it.'''
+import subprocess
+import json
+import sys
+import os
+
+import pytest
+
+from conftest import ROOT
+from stubCoreNLP import stubCoreNLP
+
+
+SHARD = '''
+import sys, json
+sys.path.insert(0, {root!r})
+from corpusManifest import corpusManifest, shard_filenames
+manifest = corpusManifest({corpus!r}, file_format=".xml", manifest_path={manifest!r}, refresh=False)
+sizes = dict((f, s) for f, s, _ in manifest) if {balance!r} else None
+print(json.dumps(shard_filenames(manifest.filenames(), {index!r}, {count!r}, sizes)))
+'''
+
+REMAKE_SHARD = '''
+import sys
+sys.path.insert(0, {root!r})
+from remakeLogger import configure_logging
+configure_logging("silent")
+from corenlpToolbox import coreNLPServerPool
+from xmlRemaker import xmlCorpusRemaker
+with coreNLPServerPool([{port!r}], health_interval=3600) as pool:
+    remaker = xmlCorpusRemaker({corpus!r}, "teiHeader", "text", dst_dir={dst!r}, shard_index={index!r},
+                               shard_count={count!r}, corenlp_pool=pool)
+    remaker.tokenize_the_corpus(skip_exists=False)
+'''
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    for i in range(60):
+        (corpus_dir / f"doc{i:03}.xml").write_text("<TEI.2><text>" + "word " * (i * 37 % 500) + "</text></TEI.2>")
+    (corpus_dir / "notes.txt").write_text("not a corpus file")
+    return corpus_dir
+
+
+def _run_shards(corpus_dir, manifest_path, count, balance):
+    procs = [subprocess.Popen([sys.executable, "-c", SHARD.format(root=ROOT, corpus=str(corpus_dir) + "/",
+                                                                 manifest=str(manifest_path), balance=balance,
+                                                                 index=i, count=count)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for i in range(count)]
+    shards = []
+    for proc in procs:
+        out, err = proc.communicate(timeout=60)
+        assert proc.returncode == 0, err
+        shards.append(json.loads(out))
+    return shards
+
+
+@pytest.mark.parametrize("balance", [False, True])
+@pytest.mark.parametrize("manifest_exists", [False, True])
+def test_shards_are_disjoint_and_cover_the_corpus(tmp_path, corpus, balance, manifest_exists):
+    manifest_path = tmp_path / "corpus.manifest"
+    if manifest_exists:
+        from corpusManifest import corpusManifest
+        corpusManifest(str(corpus) + "/", file_format=".xml", manifest_path=str(manifest_path))
+    shards = _run_shards(corpus, manifest_path, 4, balance)
+    
+    files = sorted(f for f in os.listdir(corpus) if f.endswith(".xml"))
+    seen = [f for shard in shards for f in shard]
+    assert len(seen) == len(set(seen))
+    assert sorted(seen) == files
+    assert all(shards)
+    # the shard processes leave no half written manifest behind
+    assert sorted(os.listdir(tmp_path)) == ["corpus", "corpus.manifest"]
+
+
+def test_shard_processes_do_not_rewrite_a_shared_manifest(tmp_path, corpus):
+    from corpusManifest import corpusManifest
+    manifest_path = tmp_path / "corpus.manifest"
+    corpusManifest(str(corpus) + "/", file_format=".xml", manifest_path=str(manifest_path))
+    before = manifest_path.read_bytes()
+    (corpus / "doc999.xml").write_text("<TEI.2><text>new</text></TEI.2>")
+    
+    shards = _run_shards(corpus, manifest_path, 3, True)
+    assert manifest_path.read_bytes() == before
+    assert "doc999.xml" not in [f for shard in shards for f in shard]
+
+
+def _remake_shards(corpus_dir, dst_dir, port, count):
+    procs = [subprocess.Popen([sys.executable, "-c", REMAKE_SHARD.format(root=ROOT, corpus=str(corpus_dir) + "/",
+                                                                        dst=str(dst_dir), port=port, index=i, count=count)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+             for i in range(count)]
+    for proc in procs:
+        _, err = proc.communicate(timeout=120)
+        assert proc.returncode == 0, err
+
+
+def test_remade_shards_merge_into_one_run(tmp_path, capsys):
+    from xmlRemaker import merge_shard_stats
+    corpus_dir = tmp_path / "corpus"
+    corpus_dir.mkdir()
+    for i in range(6):
+        (corpus_dir / f"f{i}.xml").write_text(f"<TEI.2><teiHeader><title>F{i}</title></teiHeader>"
+                                              f"<text><p>Then {i} men came and went.</p></text></TEI.2>")
+    dst_dir = tmp_path / "remade"
+    stub = stubCoreNLP().start()
+    try:
+        _remake_shards(corpus_dir, dst_dir, stub.port, 3)
+        _remake_shards(corpus_dir, dst_dir, stub.port, 2)
+    finally:
+        stub.stop()
+    
+    files = [f"f{i}.xml" for i in range(6)]
+    assert sorted(f for f in os.listdir(dst_dir) if f.endswith(".xml")) == files
+    # the stats left by the 3 shards of the first run are not mixed into those of the 2 shards of the last one
+    merged = merge_shard_stats(str(dst_dir))
+    assert merged["shards"] == [0, 1] and merged["missing_shards"] == []
+    assert sorted(rec["filename"] for rec in merged["files"]) == files
+    assert merged["counts"] == {"remade": 6}
+    assert "of another shard_count than 2 are ignored" in capsys.readouterr().out
+    merged = merge_shard_stats(str(dst_dir), save=False, shard_count=3)
+    assert merged["shards"] == [0, 1, 2]
+    assert sorted(rec["filename"] for rec in merged["files"]) == files
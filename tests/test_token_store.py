@@ -0,0 +1,32 @@
+'''A document added to the token store in spilled parts reads back the same as added whole.'''
+from tokenStore import tokenColumns, tokenStoreWriter, tokenStore, read_spilled
+
+
+def _words(columns, words, start=0, tag_every=3):
+    for i, word in enumerate(words, start):
+        if i % tag_every == 0:
+            columns.add_tag(f"<p n='{i}'>")
+        columns.add_word(("Original", "pos", "lemma"), (word, "NN", word.lower()))
+
+
+def _read(store_dir, name):
+    store = tokenStore(store_dir)
+    doc = store.doc(name)
+    return {k: list(v) if k == "tag_slots" else store.decode(v) for k, v in doc.items()}
+
+
+def test_spilled_parts_read_back_as_the_whole_document(tmp_path):
+    words = [f"Word{i % 7}" for i in range(50)]
+    whole = tokenColumns()
+    _words(whole, words)
+    tokenStoreWriter(str(tmp_path / "whole")).add("doc", whole)
+
+    spill = tmp_path / "doc.columns.part"
+    with open(spill, "w", encoding="utf-8") as f:
+        parts = tokenColumns()
+        for start in range(0, len(words), 12):
+            _words(parts, words[start:start + 12], start)
+            parts.spill(f)
+    writer = tokenStoreWriter(str(tmp_path / "parts"))
+    writer.add_parts("doc", read_spilled(spill))
+    assert _read(str(tmp_path / "parts"), "doc") == _read(str(tmp_path / "whole"), "doc")
@@ -77,7 +77,13 @@ def v_past_tense(verb, irreg_v_dict=irreg_v_dict, rand_idx=0):
     return verb + "ed"
     
 
-def textNormalizing(text, norm_rules=norm_rules, verbs=verbs):
+def verb_patterns(verb):
+    '''Return the regex sources (matched case-insensitively) of the third and second person singular
+    of a common verb in early modern English, e.g., loveth and lov'dst.'''
+    return fr"\b{verb}e?th\b", fr"\b{verb}'?e?d?st\b"
+
+
+def textNormalizing(text, norm_rules=norm_rules, verbs=verbs, irreg_v_dict=irreg_v_dict):
     '''The main function for text spelling Normalization. This function is a general one,
     but the imported norm_rules and verbs to convert are very specific to Early Modern English texts.
     If these rules are not relevant, you should choose not not normalize your texts using this function.'''
@@ -93,10 +99,11 @@ def textNormalizing(text, norm_rules=norm_rules, verbs=verbs):
     vb, vbz, vbd = verbs
 
     for i in range(len(vb)):
+        third, second = verb_patterns(vb[i])
         # for third person singular
-        text = re.sub(fr"\b{vb[i]}e?th\b", vbz[i], text, flags=re.IGNORECASE)
+        text = compiled_pattern(third).sub(vbz[i], text)
         # for second person singular
-        text = re.sub(fr"\b{vb[i]}'?e?d?st\b", vb[i], text, flags=re.IGNORECASE)
+        text = compiled_pattern(second).sub(vb[i], text)
     
     # 嗨 is a Chinese word for "hi", used as a marker to locate past tense verbs to convert. 
     # Simply changing 'd ---> ed should be much less accurate than looking at them case by case. 
@@ -0,0 +1,268 @@
+'''
+- Author: Zhengxiang (Jack) Wang
+- Date: 2026-10-19
+- GitHub: https://github.com/jaaack-wang
+- About: A compact columnar token store emitted alongside the remade xml files, so that the
+token/normalized/pos/lemma sequences can be used without re-parsing any xml.
+
+A store is a directory holding:
+    - vocab.jsonl: the interned strings, one json string per line, the line number being the id (0 is "");
+    - <column>.u32: one little-endian uint32 vocab id per word token for each of the columns
+      Original, Normalized, pos and lemma (0 where a document has no such column);
+    - tag_slots.u32 and tag_ids.u32: for every original tag in the body, the number of words before it
+      (its slot) and its vocab id;
+    - docs.jsonl: one json line per document with its token and tag ranges.
+
+The reader memory-maps the columns as NumPy arrays without copying, so that corpus-scale counting is a
+vectorized operation, e.g., numpy.bincount(store.column("lemma")).
+'''
+from os.path import join, exists, getsize
+from os import makedirs, replace
+from threading import Lock
+from array import array
+import json
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+columns = ("Original", "Normalized", "pos", "lemma")
+
+
+class tokenColumns:
+    '''Collects the word attributes and the tag slots of one document while _build_new_body builds its new body.'''
+    def __init__(self):
+        self.values = {c: [] for c in columns}
+        self.tag_slots = []
+        self.tags = []
+        self.num_words = 0
+
+    def add_word(self, keys, values):
+        for k, v in zip(keys, values):
+            if k in self.values:
+                self.values[k].append(v)
+        self.num_words += 1
+        # keep the columns aligned when a document does not have all of them
+        for k in columns:
+            if len(self.values[k]) < self.num_words:
+                self.values[k].append("")
+
+    def add_tag(self, tag):
+        self.tag_slots.append(self.num_words)
+        self.tags.append(tag)
+
+    def spill(self, f):
+        '''Write the columns collected so far to the file f as a json line and start over, so that a document
+        built segment by segment is never held in memory as a whole. See read_spilled.'''
+        f.write(json.dumps([self.values, self.tag_slots, self.tags, self.num_words], ensure_ascii=False) + "\n")
+        self.__init__()
+
+
+def read_spilled(path):
+    '''Yield the tokenColumns spilled to the file at path (see tokenColumns.spill) one by one, i.e., the
+    consecutive parts of a document, whose tag slots count the words from the start of their part.'''
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            part = tokenColumns()
+            part.values, part.tag_slots, part.tags, part.num_words = json.loads(line)
+            yield part
+
+
+def _u32(ids):
+    '''Return the ids as little-endian uint32 bytes.'''
+    arr = array("I", ids)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr.tobytes()
+
+
+class tokenStoreWriter:
+    '''A thread-safe, appendable writer of a token store directory. A store can hold a single document or
+    all the documents of a run/shard. Reopening an existing store appends to it and extends its vocab.
+    Adding a document already in the store replaces it: the new one is appended, and the ids of the old one
+    are zeroed (i.e., "", which the counts leave out) once it is dropped from docs.jsonl.
+
+    Args (initialization):
+        - store_dir(str): the directory of the store, created if it does not exist.
+    '''
+    def __init__(self, store_dir):
+        self._store_dir = store_dir
+        self._lock = Lock()
+        self._vocab = {"": 0}
+        self._num_tokens = 0
+        self._num_tags = 0
+        # name --> the docs.jsonl line of the document
+        self._docs = {}
+        makedirs(store_dir, exist_ok=True)
+
+        if exists(join(store_dir, "vocab.jsonl")):
+            with open(join(store_dir, "vocab.jsonl"), "r") as f:
+                for i, line in enumerate(f):
+                    self._vocab[json.loads(line)] = i
+        else:
+            with open(join(store_dir, "vocab.jsonl"), "w") as f:
+                f.write(json.dumps("") + "\n")
+        if exists(join(store_dir, "docs.jsonl")):
+            with open(join(store_dir, "docs.jsonl"), "r") as f:
+                for line in f:
+                    doc = json.loads(line)
+                    self._docs[doc["name"]] = doc
+                    self._num_tokens = doc["token_start"] + doc["token_count"]
+                    self._num_tags = doc["tag_start"] + doc["tag_count"]
+        # drop whatever a crashed run wrote after the last complete document
+        self._truncate()
+
+    def _truncate(self):
+        for name, size in [(c, self._num_tokens) for c in columns] + \
+                          [("tag_slots", self._num_tags), ("tag_ids", self._num_tags)]:
+            with open(join(self._store_dir, name + ".u32"), "ab") as f:
+                f.truncate(size * 4)
+
+    def __contains__(self, name):
+        return name in self._docs
+
+    def _intern(self, values, new_words):
+        ids = []
+        for v in values:
+            i = self._vocab.get(v)
+            if i is None:
+                i = self._vocab[v] = len(self._vocab)
+                new_words.append(v)
+            ids.append(i)
+        return ids
+
+    def _zero(self, name, start, count):
+        with open(join(self._store_dir, name + ".u32"), "r+b") as f:
+            f.seek(start * 4)
+            f.write(bytes(count * 4))
+
+    def _drop(self, old, new):
+        '''Replace the docs.jsonl line of a re-added document at once, and zero the ids of the old one.'''
+        tmp = join(self._store_dir, "docs.jsonl.tmp")
+        with open(tmp, "w") as f:
+            f.writelines(json.dumps(doc) + "\n" for doc in self._docs.values())
+            f.write(json.dumps(new) + "\n")
+        replace(tmp, join(self._store_dir, "docs.jsonl"))
+        for c in columns:
+            self._zero(c, old["token_start"], old["token_count"])
+        for c in ("tag_slots", "tag_ids"):
+            self._zero(c, old["tag_start"], old["tag_count"])
+
+    def add(self, name, token_columns):
+        '''Append a document's tokenColumns to the store under the given name, replacing the document
+        of that name if the store has one.'''
+        self.add_parts(name, [token_columns])
+
+    def add_parts(self, name, parts):
+        '''The same as add, but the document is given as the tokenColumns of its consecutive parts (e.g., read
+        back by read_spilled), which are appended one by one.'''
+        with self._lock:
+            num_words, num_tags, used = 0, 0, set()
+            try:
+                for part in parts:
+                    new_words = []
+                    ids = {c: self._intern(part.values[c], new_words) for c in columns}
+                    tag_ids = self._intern(part.tags, new_words)
+                    with open(join(self._store_dir, "vocab.jsonl"), "a") as f:
+                        f.writelines(json.dumps(w) + "\n" for w in new_words)
+                    for c in columns:
+                        with open(join(self._store_dir, c + ".u32"), "ab") as f:
+                            f.write(_u32(ids[c]))
+                    with open(join(self._store_dir, "tag_slots.u32"), "ab") as f:
+                        f.write(_u32([slot + num_words for slot in part.tag_slots]))
+                    with open(join(self._store_dir, "tag_ids.u32"), "ab") as f:
+                        f.write(_u32(tag_ids))
+                    used.update(c for c in columns if any(ids[c]))
+                    num_words += part.num_words
+                    num_tags += len(tag_ids)
+            except BaseException:
+                # the parts written so far belong to no document: drop them for the next one
+                self._truncate()
+                raise
+            doc = {"name": name, "token_start": self._num_tokens, "token_count": num_words,
+                   "tag_start": self._num_tags, "tag_count": num_tags,
+                   "columns": [c for c in columns if c in used]}
+            # the docs line goes last: a document is only in the store once it is complete
+            old = self._docs.pop(name, None)
+            if old is None:
+                with open(join(self._store_dir, "docs.jsonl"), "a") as f:
+                    f.write(json.dumps(doc) + "\n")
+            else:
+                self._drop(old, doc)
+            self._num_tokens += num_words
+            self._num_tags += num_tags
+            self._docs[name] = doc
+
+
+class tokenStore:
+    '''A reader of a token store directory. The columns are NumPy uint32 arrays memory-mapped from the files
+    (no copying), and the vocab maps the ids back to strings.
+
+    ##############
+    Example usage:
+    ##############
+
+    >>> store = tokenStore(store_dir)
+    >>> store.doc_names()
+    >>> doc = store.doc("A12345.xml")           # {"Original": array, ..., "tag_slots": array, "tag_ids": array}
+    >>> store.decode(doc["lemma"][:10])          # the first 10 lemmas as strings
+    >>> store.counts("lemma")["love"]            # corpus-wide frequency, computed by numpy.bincount
+    '''
+    def __init__(self, store_dir):
+        assert np is not None, "NumPy is needed to read a token store. Please pip install numpy."
+        self._store_dir = store_dir
+        with open(join(store_dir, "vocab.jsonl"), "r") as f:
+            self.vocab = [json.loads(line) for line in f]
+        self._ids = None
+        self._docs = {}
+        with open(join(store_dir, "docs.jsonl"), "r") as f:
+            for line in f:
+                doc = json.loads(line)
+                self._docs[doc["name"]] = doc
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            filepath = join(self._store_dir, name + ".u32")
+            if not exists(filepath) or getsize(filepath) == 0:
+                self._arrays[name] = np.zeros(0, dtype="<u4")
+            else:
+                self._arrays[name] = np.memmap(filepath, dtype="<u4", mode="r")
+        return self._arrays[name]
+
+    def __len__(self):
+        return len(self._docs)
+
+    def doc_names(self):
+        return list(self._docs)
+
+    def column(self, name):
+        '''Return a whole column (Original, Normalized, pos, lemma, tag_slots or tag_ids) of the store.'''
+        return self._array(name)
+
+    def doc(self, name):
+        '''Return a document's columns as zero-copy array views.'''
+        doc = self._docs[name]
+        t0, t1 = doc["token_start"], doc["token_start"] + doc["token_count"]
+        g0, g1 = doc["tag_start"], doc["tag_start"] + doc["tag_count"]
+        out = {c: self._array(c)[t0:t1] for c in columns}
+        out["tag_slots"] = self._array("tag_slots")[g0:g1]
+        out["tag_ids"] = self._array("tag_ids")[g0:g1]
+        return out
+
+    def lookup(self, value):
+        '''Return the vocab id of a string, or None if it is not in the store.'''
+        if self._ids is None:
+            self._ids = {w: i for i, w in enumerate(self.vocab)}
+        return self._ids.get(value)
+
+    def decode(self, ids):
+        return [self.vocab[i] for i in ids]
+
+    def counts(self, name):
+        '''Return a dict of value --> frequency for a column, counted over the whole store.'''
+        counts = np.bincount(self._array(name), minlength=len(self.vocab))
+        return {self.vocab[i]: int(counts[i]) for i in np.nonzero(counts)[0] if i != 0}
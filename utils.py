@@ -4,14 +4,71 @@ Date: 2021-08-25
 GitHub: https://github.com/jaaack-wang 
 About: Helper functions for the Historical English Language Processing Toolkit (HELPtk).
 '''
-from os import listdir, walk
-from os.path import isfile, join
+from configBundle import bundled_config
+from os import scandir
+from os.path import join
+from threading import local
+from time import perf_counter
 import re
 import json
 import random  
 
+
+# the compressed file formats read and written transparently by xmlHandler
+compressed_suffixes = (".gz", ".bz2", ".xz")
+
+
+def with_compressed_formats(file_format):
+    '''Return a tuple of the file format(s) plus their compressed versions, e.g., ".xml" --> 
+    (".xml", ".xml.gz", ".xml.bz2", ".xml.xz").'''
+    file_format = (file_format,) if isinstance(file_format, str) else tuple(file_format)
+    return file_format + tuple(f + c for f in file_format for c in compressed_suffixes)
+
+
+def strip_compressed_suffix(filename):
+    '''Strip the compression suffix (if any) from a filename, e.g., a.xml.gz --> a.xml.'''
+    for c in compressed_suffixes:
+        if filename.endswith(c):
+            return filename[:-len(c)]
+    return filename
+
         
-def get_filenames_from_dir(file_dir, include_sub_dir=False, file_format=None, shuffle=False):
+def scan_dir(file_dir, include_sub_dir=False, file_format=None, with_stat=False):
+    '''Stream the files in a file directory using os.scandir, which gets the file type from the 
+    directory listing itself, so no extra isfile/exists call is made per file.
+    
+    Args:
+        - file_dir(str): file_dir.
+        - include_sub_dir(bool): whether to include all files within the sub_dir, defaults to False. 
+                                 When set True, the yielded filenames will be prefixed with the sub_dir. 
+        - file_format(str or tuple or None): When set, only yield files in the chosen format(s).
+        - with_stat(bool): when set True, yield (filename, size, mtime) instead of just the filename.
+        
+    Yield(str or tuple): filenames, or (filename, size, mtime) tuples if with_stat=True.'''
+    
+    sub_dirs = [""]
+    while sub_dirs:
+        sub_dir = sub_dirs.pop()
+        with scandir(join(file_dir, sub_dir) if sub_dir else file_dir) as entries:
+            for entry in entries:
+                name = sub_dir + "/" + entry.name if sub_dir else entry.name
+                if entry.is_dir():
+                    if include_sub_dir:
+                        sub_dirs.append(name)
+                    continue
+                if not entry.is_file():
+                    continue
+                if file_format and not name.endswith(file_format):
+                    continue
+                if with_stat:
+                    st = entry.stat()
+                    yield name, st.st_size, st.st_mtime
+                else:
+                    yield name
+
+
+def get_filenames_from_dir(file_dir, include_sub_dir=False, file_format=None, shuffle=False,
+                           include_compressed=False):
     '''Return a list of filenames given a file directory and some conditions.
     
     Args:
@@ -20,23 +77,18 @@ def get_filenames_from_dir(file_dir, include_sub_dir=False, file_format=None, sh
                                  When set True, the returned filenames will be prefixed with the sub_dir. 
         - file_format(str or tuple or list or None): When set, only return files in the chosen format(s).
         - shuffle(bool): shuffle the filenames if set True. Otherwise, return a sorted list of filenames.
+        - include_compressed(bool): when set True, also return the gzip/bz2/xz compressed files in the 
+                                 chosen format(s), e.g., .xml.gz, .xml.bz2 and .xml.xz for ".xml".
         
     Return(list): a list of filenames.'''
     
-    if include_sub_dir:
-        filenames = []
-        for root, _, files in walk(file_dir, topdown=False):
-            for f in files:
-                filenames.append(join(root, f).replace(file_dir + "/", ""))
-    else:
-        filenames = [f for f in listdir(file_dir) if isfile(join(file_dir, f))]
-        
     if file_format:
         if not isinstance(file_format, (str, list, tuple)):
             raise TypeError("file_format must be str, list or tuple.")
         file_format = tuple(file_format) if isinstance(file_format, list) else file_format
-        format_checker = lambda f: f.endswith(file_format)
-        filenames = list(filter(format_checker, filenames))
+        if include_compressed:
+            file_format = with_compressed_formats(file_format)
+    filenames = list(scan_dir(file_dir, include_sub_dir, file_format))
 
     if shuffle:
         random.shuffle(filenames)
@@ -48,8 +100,16 @@ def get_filenames_from_dir(file_dir, include_sub_dir=False, file_format=None, sh
 
 def _get_trans_rules(filepath, delimiter="\t"):
     '''Reads preprocessing_rules.txt and normalizing_rules.txt stored in config folder
-    and returns a tuple of rules that contain the target pattern and replacement pattern pairs.'''
+    and returns a tuple of rules that contain the target pattern and replacement pattern pairs.
+    The rules are taken from the config bundle instead when it is up to date (see configBundle.py).'''
     
+    bundled = bundled_config(filepath, delimiter)
+    if bundled is not None:
+        return tuple(tuple(rule) for rule in bundled)
+    return _read_trans_rules(filepath, delimiter)
+
+
+def _read_trans_rules(filepath, delimiter="\t"):
     f = open(filepath, 'r')
     targets, replaces = [], []
     for line in f:
@@ -60,15 +120,60 @@ def _get_trans_rules(filepath, delimiter="\t"):
     return tuple(zip(targets, replaces))
 
 
+def _trans_rule_pattern(target):
+    '''Return the regex source that apply_trans_rules uses for a target pattern. Targets 
+    with a captured (\w) or (\S) are used as they are, the rest are wrapped in word boundaries.'''
+    if "(\w)" in target or "(\S)" in target:
+        return fr"{target}"
+    return fr"\b{target}\b"
+
+
+# the compiled regexes by (source, flags). The patterns of the rules and the verbs outnumber the 512 regexes that
+# re caches, which would otherwise recompile most of them on every call of textNormalizing
+_compiled = {}
+
+
+def compiled_pattern(source, flags=re.IGNORECASE):
+    '''Return the compiled regex of a pattern source, compiled once per process.'''
+    pattern = _compiled.get((source, flags))
+    if pattern is None:
+        pattern = _compiled[(source, flags)] = re.compile(source, flags)
+    return pattern
+
+
+def _compile_trans_rule(target):
+    '''Compile a target pattern exactly the way apply_trans_rules applies it.'''
+    return compiled_pattern(_trans_rule_pattern(target))
+
+
+# the seconds spent per rule by apply_trans_rules in the current thread, see start_rule_timing()
+_rule_timing = local()
+
+
+def start_rule_timing():
+    '''Start timing every rule applied by apply_trans_rules in the current thread, e.g., to profile a file.'''
+    _rule_timing.times = {}
+
+
+def stop_rule_timing():
+    '''Stop timing the rules in the current thread. Return a dict of rule target --> seconds spent.'''
+    times = getattr(_rule_timing, "times", None) or {}
+    _rule_timing.times = None
+    return times
+
+
 def apply_trans_rules(rules, text, final_trim=True):
     '''Apply tranformation rules to the input text. The rules should be a list/tuple of 
     tranformation rules that contain the target pattern and replacement pattern pairs.'''
     
+    times = getattr(_rule_timing, "times", None)
     for target, replace in rules:
-        if "(\w)" in target or "(\S)" in target:
-            text = re.sub(fr"{target}", fr"{replace}", text, flags=re.IGNORECASE)
+        if times is None:
+            text = _compile_trans_rule(target).sub(fr"{replace}", text)
         else:
-            text = re.sub(fr"\b{target}\b", fr"{replace}", text, flags=re.IGNORECASE)
+            start = perf_counter()
+            text = _compile_trans_rule(target).sub(fr"{replace}", text)
+            times[target] = times.get(target, 0) + perf_counter() - start
         
     if final_trim: return re.sub(r"\s+", " ", text).strip()
     else: return text
@@ -89,6 +194,13 @@ def get_common_verbs(filepath='config/common_verbs.txt', delimiter="\t"):
     '''Retrieve the common verbs along with their third person singular and 
     simple past tense inflections (verified) stored in the config folder.'''
 
+    bundled = bundled_config(filepath, delimiter)
+    if bundled is not None:
+        return tuple(bundled)
+    return _read_common_verbs(filepath, delimiter)
+
+
+def _read_common_verbs(filepath, delimiter="\t"):
     # base verb (vb), third person singular (vbz) and simple past tense (vbd)
     vb, vbz, vbd = [], [], []
     verbs = open(filepath, 'r')
@@ -104,4 +216,7 @@ def get_common_verbs(filepath='config/common_verbs.txt', delimiter="\t"):
 def get_irreg_v_past_inflect_dict(filepath="config/irregular_v_past_inflections.json"):
     '''Retrieve the irregular verb past tense inflections dictionary. The dictionary is based 
     on data scraped from https://www.englishpage.com/irregularverbs/irregularverbs2.html'''
+    bundled = bundled_config(filepath)
+    if bundled is not None:
+        return bundled
     return json.load(open(filepath, "r"))
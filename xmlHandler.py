@@ -7,11 +7,45 @@
 from bs4 import BeautifulSoup as bs
 from lxml import etree
 from os.path import join
+from utils import strip_compressed_suffix
+from remakeLogger import log_event
+from xml.sax.saxutils import escape, quoteattr
+from shutil import copyfileobj
+import codecs
+import gzip
+import bz2
+import lzma
+import io
+
+
+# magic bytes --> opener. The compression of an input file is detected from its first bytes, not its suffix.
+_magic_openers = ((b"\x1f\x8b", gzip.open), (b"BZh", bz2.open), (b"\xfd7zXZ\x00", lzma.open))
+_compression_openers = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+
+
+def open_xml(filepath):
+    '''Open a (possibly gzip/bz2/xz compressed) file for binary reading. The compressed stream
+    is decompressed on the fly, the format being detected from the magic bytes. The filepath can
+    also be the bytes of a file, e.g., a member read from a tar/zip archive.'''
+    if isinstance(filepath, bytes):
+        f = io.BytesIO(filepath)
+        head = f.read(6)
+        f.seek(0)
+    else:
+        with open(filepath, "rb") as f:
+            head = f.read(6)
+        # a compressed file is opened by its path, so that closing the stream also closes the file
+        f = None
+    for magic, opener in _magic_openers:
+        if head.startswith(magic):
+            return opener(filepath if f is None else f, "rb")
+    return open(filepath, "rb") if f is None else f
 
 
 def readXML(filepath):
-    ''''Reads XML files as bs4.BeautifulSoup type.'''
-    return bs(open(filepath, "rb"), "xml")
+    ''''Reads XML files (plain or gzip/bz2/xz compressed) as bs4.BeautifulSoup type.'''
+    with open_xml(filepath) as f:
+        return bs(f, "xml")
     
     
 def _get_node(soup, filepath, node_name, as_str=False):
@@ -22,8 +56,8 @@ def _get_node(soup, filepath, node_name, as_str=False):
             return node.prettify()
         return node
     else:
-        print(f"\033[32mNodeNotFound\033[0m: \"{node_name}\" not found in {filepath}." \
-              " Return empty string instead.")
+        log_event("node_not_found", f"\033[32mNodeNotFound\033[0m: \"{node_name}\" not found in {filepath}." \
+                  " Return empty string instead.", filepath, "read", "warning", node=node_name)
         return ""
 
 
@@ -41,7 +75,8 @@ def get_nodes(filepath, node_name):
     if nodes:
         return nodes
     else:
-        print(f"\033[32mNodeNotFound\033[0m: \"{node_name}\" not found in {filepath}. Return None.")
+        log_event("node_not_found", f"\033[32mNodeNotFound\033[0m: \"{node_name}\" not found in {filepath}. Return None.",
+                  filepath, "read", "warning", node=node_name)
         return 
 
 
@@ -55,18 +90,41 @@ def get_body(filepath, body_node, as_str=False):
     return get_node(filepath, body_node, as_str)
     
 
-def get_header_body_as_str(filepath, head_node, body_node):
+def get_header_body_as_str(filepath, head_node, body_node, source=None):
     '''Return formatted header and body parts of a xml file as str.
-    If a node name is not found, return an empty string'''
+    If a node name is not found, return an empty string. If the source (bytes) 
+    is given, it is read instead of the filepath, which is then only a name.'''
     
-    soup = readXML(filepath)
+    soup = readXML(filepath if source is None else source)
     header = _get_node(soup, filepath, head_node, as_str=True)
     body = _get_node(soup, filepath, body_node, as_str=True)
     return header, body
 
 
+def compress_bytes(data, compression=None, compresslevel=None):
+    '''Compress bytes as "gz", "bz2" or "xz" (see createXmlFileFromStr). If compression is None, return as is.'''
+    if not compression:
+        return data
+    if compression not in _compression_openers:
+        raise ValueError(f"compression must be one of {list(_compression_openers)} or None.")
+    buf = io.BytesIO()
+    with _compression_openers[compression](buf, "wb", **_compression_kwargs(compression, compresslevel)) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def _compression_kwargs(compression, compresslevel=None):
+    low = 1 if compression == "bz2" else 0
+    if compresslevel is not None and not low <= compresslevel <= 9:
+        raise ValueError(f"compresslevel must be from {low} to 9 for {compression}.")
+    level = {} if compresslevel is None else {"preset" if compression == "xz" else "compresslevel": compresslevel}
+    if compression == "gz" and compresslevel is None:
+        level = {"compresslevel": 6}
+    return level
+
+
 def createXmlFileFromStr(filename=None, root_name="TEI.2", header="", 
-                         body="", dst_dir="./", save=True):
+                         body="", dst_dir="./", save=True, compression=None, compresslevel=None):
     '''Creates a XML file given a set of xml-formatted strings. 
     Args:
         - filename(str): filename for the new xml file, defaults to None.  
@@ -76,32 +134,235 @@ def createXmlFileFromStr(filename=None, root_name="TEI.2", header="",
         - body(str): xml-like string, body part, defaults to empty str.
         - dst_dir(str): path-like string. If not given, defaults to the current dir.
         - save(bool): whether to save, defaluts to True. 
+        - compression(str or None): "gz", "bz2" or "xz" to save the file compressed (the suffix is added to
+                                    the filename), defaults to None (plain xml). 
+        - compresslevel(int or None): the compression level from 0 (fast) to 9 (small), or from 1 for bz2. Defaults
+                                    to None, which is 6 for gz and xz, and 9 for bz2.
         
     Return:
-        - if save set False, return lxml.etree._ElementTree. Otherwise, no returns. 
+        - if save set False, return lxml.etree._ElementTree. Otherwise, the filepath of the created file,
+        or None if the file could not be created. 
     '''
+    if compression and compression not in _compression_openers:
+        raise ValueError(f"compression must be one of {list(_compression_openers)} or None.")
+    if compression:
+        _compression_kwargs(compression, compresslevel)
     if not filename:
         save = False
     else:
+        filename = strip_compressed_suffix(filename)
         filename = filename if filename.endswith('.xml') else filename + '.xml'
+        if compression:
+            filename += "." + compression
     content = f'<{root_name}>' + header + body + f'</{root_name}>'
     try:
         content = bs(content, 'xml').prettify()
         content = content.replace('<?xml version="1.0" encoding="utf-8"?>\n', '')
     except Exception as e:
-        print(f"\033[32mGenerated XML text for {filename} cannot be prettified\033[0m due to ",  e)
-        print("But this has no really bad effects on the created xml file other than being less" \
-              " pretty when read in plain text software.")
+        log_event("not_prettified", f"\033[32mGenerated XML text for {filename} cannot be prettified\033[0m due to {e}\n" \
+                  "But this has no really bad effects on the created xml file other than being less" \
+                  " pretty when read in plain text software.", filename, "save", "warning", error=str(e))
     parser = etree.XMLParser(recover=True)
     try:
         root = etree.fromstring(content, parser=parser)
         tree = etree.ElementTree(root)
         if save:
             filepath = join(dst_dir, filename)
-            tree.write(filepath)
-            print(filepath + " has been created!")
+            if compression:
+                with open(filepath, "wb") as f:
+                    f.write(compress_bytes(etree.tostring(tree), compression, compresslevel))
+            else:
+                tree.write(filepath)
+            log_event("created", filepath + " has been created!", filepath, "save")
+            return filepath
         else:
             return tree
             
     except Exception as e:
-        print(f"\033[1m\033[31mA problem creating {join(dst_dir, filename)} as follows: \033[0m{e}\n")
+        log_event("failed", f"\033[1m\033[31mA problem creating {join(dst_dir, filename)} as follows: \033[0m{e}\n",
+                  join(dst_dir, filename) if filename else None, "save", "error", error=str(e))
+
+
+def xml_size(filepath):
+    '''Return the (decompressed) size in bytes of a xml file, or of the bytes of one. A compressed
+    file is decompressed on the fly to count it, without holding it in memory.'''
+    with open_xml(filepath) as f:
+        if isinstance(f, io.BytesIO):
+            return len(f.getbuffer())
+        if not isinstance(f, (gzip.GzipFile, bz2.BZ2File, lzma.LZMAFile)):
+            return f.seek(0, io.SEEK_END)
+        size = 0
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            size += len(chunk)
+        return size
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else None
+
+
+def _qualified_name(name, nsmap):
+    '''Turn an lxml {uri}name into prefix:name, given the namespaces in scope.'''
+    if not name.startswith("{"):
+        return name
+    uri, local = name[1:].split("}", 1)
+    if uri == "http://www.w3.org/XML/1998/namespace":
+        return "xml:" + local
+    for prefix, u in nsmap.items():
+        if u == uri:
+            return f"{prefix}:{local}" if prefix else local
+    return local
+
+
+def _start_tag(elem, declare_all=False):
+    '''Return the start tag of an element as a str, declaring the namespaces its parent does not.'''
+    parent = elem.getparent()
+    inherited = {} if declare_all or parent is None else parent.nsmap
+    attrs = [(f"xmlns:{p}" if p else "xmlns", uri) for p, uri in elem.nsmap.items() if inherited.get(p) != uri]
+    attrs += [(_qualified_name(k, elem.nsmap), v) for k, v in elem.attrib.items()]
+    attrs = "".join(f" {k}={quoteattr(v)}" for k, v in attrs)
+    return f"<{_qualified_name(elem.tag, elem.nsmap)}{attrs}>"
+
+
+class xmlBodySegments:
+    '''Stream the body node of a xml file (plain or compressed) as xml-like str segments of about segment_len
+    characters, without ever holding the whole body in memory. The body is cut at the end of one of its top-level
+    child elements once a segment reaches segment_len characters, or at the end of any element inside it once a 
+    segment reaches twice that, so that a single oversized child (e.g., the <body> of a <text>) is cut as well.
+    Joined together, the segments make up the body node, its own start and end tags included.
+
+    Iterating yields the segments. Once iterated through, the header node (str, an empty string if not found) and 
+    the length of the body (counted by characters) are available as self.header and self.body_len. The header is
+    also found when it comes after the body. As with get_node, the first node of either name is taken.
+
+    Args (initialization):
+        - filepath(str): the filepath of the xml file, or the bytes of one (e.g., read from an archive).
+        - head_node(str): the name of the header node.
+        - body_node(str): the name of the body node.
+        - segment_len(int): the number of characters a segment is cut after, defaults to 200000.
+    '''
+    def __init__(self, filepath, head_node, body_node, segment_len=200000):
+        self._filepath = filepath
+        self._head_node = head_node
+        self._body_node = body_node
+        self._segment_len = segment_len
+        self.header = ""
+        self.body_len = 0
+        self.body_found = False
+
+    def __iter__(self):
+        events = ("start", "end", "comment", "pi")
+        head, body, body_done, depth = None, None, False, 0
+        pieces, size, cut_due, pending = [], 0, False, None
+        with open_xml(self._filepath) as f:
+            for event, elem in etree.iterparse(f, events=events, recover=True, huge_tree=True):
+                if body is not None and not body_done:
+                    # the text after the last event is complete now: the text of the element started 
+                    # last, or the tail of the element ended last, which can then be let go of
+                    last = pending
+                    if pending is not None:
+                        node, attr = pending
+                        text = getattr(node, attr)
+                        if text:
+                            pieces.append(escape(text))
+                            size += len(pieces[-1])
+                        if attr == "tail":
+                            node.clear()
+                            parent = node.getparent()
+                            while node.getprevious() is not None:
+                                del parent[0]
+                        pending = None
+                    if cut_due:
+                        self.body_len += size
+                        yield "".join(pieces)
+                        pieces, size, cut_due = [], 0, False
+                    
+                    if event == "start":
+                        depth += 1
+                        tag = _start_tag(elem)
+                        pieces.append(tag)
+                        size += len(tag)
+                        pending = (elem, "text")
+                    elif event == "end" and elem is not body:
+                        if last == (elem, "text") and not elem.text:
+                            # an empty element, e.g., <lb/>
+                            size -= len(pieces[-1])
+                            pieces[-1] = pieces[-1][:-1] + "/>"
+                            size += len(pieces[-1])
+                        else:
+                            tag = f"</{_qualified_name(elem.tag, elem.nsmap)}>"
+                            pieces.append(tag)
+                            size += len(tag)
+                        depth -= 1
+                        pending = (elem, "tail")
+                        cut_due = size >= self._segment_len and (depth == 0 or size >= 2 * self._segment_len)
+                    elif event in ("comment", "pi"):
+                        node = etree.tostring(elem, encoding=str, with_tail=False)
+                        pieces.append(node)
+                        size += len(node)
+                        pending = (elem, "tail")
+                    else:
+                        tag = f"</{_qualified_name(body.tag, body.nsmap)}>"
+                        pieces.append(tag)
+                        self.body_len += size + len(tag)
+                        yield "".join(pieces)
+                        pieces, body_done = [], True
+                        body.clear()
+                        if head is not None and self.header:
+                            break
+                    continue
+                
+                name = _local_name(elem.tag)
+                if event == "start":
+                    # the body node is not looked for inside the header
+                    if body is None and name == self._body_node and (head is None or self.header):
+                        body, self.body_found = elem, True
+                        tag = _start_tag(elem, declare_all=True)
+                        pieces, size, pending = [tag], len(tag), (elem, "text")
+                    elif head is None and name == self._head_node:
+                        head = elem
+                elif event == "end":
+                    if elem is head:
+                        self.header = etree.tostring(elem, encoding=str, with_tail=False)
+                        if body_done:
+                            break
+                    if head is None or self.header:
+                        # outside both the header and the body, nothing needs to be kept
+                        elem.clear()
+        if not self.body_found:
+            log_event("node_not_found", f"\033[32mNodeNotFound\033[0m: \"{self._body_node}\" not found in {_name(self._filepath)}.",
+                      _name(self._filepath), "read", "warning", node=self._body_node)
+        if not self.header:
+            log_event("node_not_found", f"\033[32mNodeNotFound\033[0m: \"{self._head_node}\" not found in {_name(self._filepath)}." \
+                      " Return empty string instead.", _name(self._filepath), "read", "warning", node=self._head_node)
+
+
+def _name(filepath):
+    return "the given bytes" if isinstance(filepath, bytes) else filepath
+
+
+def write_xml_file_stream(filepath, root_name, header, body_file, compression=None, compresslevel=None):
+    '''Create a xml file from a header (str) and a body streamed from a text file in chunks, e.g., the new
+    body of a file too large to be remade in memory. Like createXmlFileFromStr, the file is written with the
+    non-ASCII characters as character references, but it is neither prettified nor re-parsed.
+    
+    Args:
+        - filepath(str): the filepath of the xml file to create, with its compression suffix if any.
+        - root_name(str): the name of the first super node for the xml file.
+        - header(str): xml-like string, header part.
+        - body_file(str): the path to a utf-8 text file holding the xml-like body part.
+        - compression(str or None), compresslevel(int or None): see createXmlFileFromStr.
+    '''
+    if compression and compression not in _compression_openers:
+        raise ValueError(f"compression must be one of {list(_compression_openers)} or None.")
+    if compression:
+        out = _compression_openers[compression](filepath, "wb", **_compression_kwargs(compression, compresslevel))
+    else:
+        out = open(filepath, "wb")
+    with out, open(body_file, "r", encoding="utf-8") as body:
+        writer = codecs.getwriter("ascii")(out, errors="xmlcharrefreplace")
+        writer.write(f"<{root_name}>{header}\n")
+        copyfileobj(body, writer, 1 << 20)
+        writer.write(f"</{root_name}>")
+    log_event("created", filepath + " has been created!", filepath, "save")
+    return filepath
@@ -26,9 +26,30 @@ Even if you are not fluent in feature engeering or regular expressions, changing
 in a word-to-word pair manner can also help you utilize this framework to the fullest and make it
 more specific to your text processing needs.  
 '''
-from corenlpToolbox import stanfordAnnotator as STA
+from corenlpToolbox import stanfordAnnotator as STA, stanfordTokenAnnotator, start_request_log, request_log, percentile, \
+                           set_request_job
+from corpusManifest import corpusManifest, shard_filenames
+from corpusArchive import is_archive, strip_archive_suffix, iter_archive_members, \
+                          archiveShardWriter, load_archive_index
+from tokenStore import tokenColumns, tokenStoreWriter, read_spilled
+from corpusIndex import corpusIndex
+from normalizationState import normalizationState, load_norm_rule_set, norm_rule_set_fingerprint
+from stageCheckpoints import stageCheckpoints, content_hash, config_fingerprint
+from parallelRules import parallel_apply_trans_rules, parallel_text_normalizing
+from remakeProfiler import remakeProfiler
+from corpusScheduler import memoryScheduler
+from bodyDedup import bodyDedup
+from remakeLogger import log_event, flush_logs
+from offlineLemmatizer import offlineLemmatizer
+from runPlanner import throughputModel, stats_files, plan_files, summarize_plan, body_span, near_limit
 from debugger import * 
-from threading import Thread
+from threading import Thread, Lock
+from collections import deque
+from contextlib import ExitStack
+from os import makedirs, remove, devnull
+from os.path import getsize
+from shutil import rmtree
+from time import time
 # besides its only functionalities, importing debugger saves us from importing the following: 
 # from utils import *
 # from xmlHandler import *
@@ -41,6 +62,8 @@ from threading import Thread
 # In the future release of HELPtk, I may include more portable as the alternative 
 # Tokenizer and Annotator. 
 sta = STA()
+# the client of the fused requests, which tokenize and annotate a body at once (see _fused_tokenize_and_annotate)
+stfa = stanfordTokenAnnotator()
 
 
 def _make_attr_pair(key, value):
@@ -84,7 +107,7 @@ def _lst_as_func(lst):
 
 
 def _build_new_body(filepath, tokenized, normalized, tags,
-                    annotation_keys=[], annotation_values=[]):
+                    annotation_keys=[], annotation_values=[], columns=None):
     '''Build a new body for a xml file to be remade.
     
     Args:
@@ -104,6 +127,9 @@ def _build_new_body(filepath, tokenized, normalized, tags,
                                 
         - annotation_values(list): the list of annotations corresponding to the annotation_keys. 
         When empty list is given, that means no annotations were performed. 
+        
+        - columns(tokenStore.tokenColumns or None): when given, the word attributes and the tag slots 
+        are also collected there, for a columnar token store.
     
     Return(str):
         The remade xml-like body text with word nodes (with or without attributes).
@@ -121,10 +147,13 @@ def _build_new_body(filepath, tokenized, normalized, tags,
 
         # debugging whether the annotation align with the tokenized body
         if annotation_keys:
-            if len(tokenized) != len(annotation_values[0]):
-                print(f"\033[31mLength not equal. Filepath: {filepath}\033[0m")
+            # a single annotation comes as a list of values, several annotations as a tuple of lists
+            first_values = annotation_values[0] if len(annotation_keys) > 1 else annotation_values
+            if len(tokenized) != len(first_values):
+                log_event("misaligned", f"\033[31mLength not equal. Filepath: {filepath}\033[0m", filepath, "annotated",
+                          "error", tokens=len(tokenized), values=len(first_values))
                 # log the words misalignments. This is automatic, unless the code is removed.
-                words_misalignments_logger(filepath, body.split(), annotation_values[0], "Annotated")
+                words_misalignments_logger(filepath, tokenized, list(first_values), "Annotated")
                 return
         
         # aligning tags and words one by one.
@@ -132,15 +161,18 @@ def _build_new_body(filepath, tokenized, normalized, tags,
             for i in range(len(tokenized)):
                 if tokenized[i][0] == "<" and tokenized[i][-1] == ">": # or if tokenized[i] == "<tag>":
                     new_body.append(tags[tag_idx])
+                    if columns: columns.add_tag(tags[tag_idx])
                     tag_idx += 1
                 else:
                     # the will be always [] if no annotation_values was given and a corresponding list if it is not empty. 
                     values = [tokenized[i], normalized[i]] + annotated(i) 
                     attr = _make_attr_pairs(keys, values) # make the word attributes.
                     new_body.append(_make_word_node(tokenized[i], " " + attr))
+                    if columns: columns.add_word(keys, values)
                     
         except Exception as e:
-            print(f"\033[32mWordMisalignmentError: \033[0m for {filepath}", e)
+            log_event("misaligned", f"\033[32mWordMisalignmentError: \033[0m for {filepath} {e}", filepath, "build",
+                      "error", error=str(e))
             
     # if no normalized text was made
     else:
@@ -150,21 +182,26 @@ def _build_new_body(filepath, tokenized, normalized, tags,
                 for i in range(len(tokenized)):
                     if tokenized[i][0] == "<" and tokenized[i][-1] == ">":
                         new_body.append(tags[tag_idx])
+                        if columns: columns.add_tag(tags[tag_idx])
                         tag_idx += 1
                     else:
                         values = [tokenized[i]] + annotated(i)
                         attr = _make_attr_pairs(keys, values)
                         new_body.append(_make_word_node(tokenized[i], " " + attr))
+                        if columns: columns.add_word(keys, values)
             else:
                 for i in range(len(tokenized)):
                     if tokenized[i][0] == "<" and tokenized[i][-1] == ">":
                         new_body.append(tags[tag_idx])
+                        if columns: columns.add_tag(tags[tag_idx])
                         tag_idx += 1
                     else:
                         new_body.append(_make_word_node(tokenized[i], ""))
+                        if columns: columns.add_word(['Original'], [tokenized[i]])
                         
         except Exception as e:
-            print(f"\033[32mWordMisalignmentError: \033[0m for {filepath}", e)
+            log_event("misaligned", f"\033[32mWordMisalignmentError: \033[0m for {filepath} {e}", filepath, "build",
+                      "error", error=str(e))
             
     return ' '.join(new_body)
 
@@ -178,7 +215,8 @@ def _debug(file_dir, filename, spell_norm, word_alignment_debug):
     or print_attr_diff_in_xml_word_nodes() from debugger.py intead.'''
     
     if not spell_norm and word_alignment_debug:
-        print("word_alignment_debug is for spelling normalized text only.")
+        log_event("options_adjusted", "word_alignment_debug is for spelling normalized text only.", join(file_dir, filename),
+                  level="warning")
         return
     if not word_alignment_debug:
         return 
@@ -187,30 +225,96 @@ def _debug(file_dir, filename, spell_norm, word_alignment_debug):
     words_alignment_debugger(filepath)
 
         
+def _out_filename(filename, compression=None):
+    '''Return the name of the remade file: the basename of the input file, with its compression 
+    suffix (if any) swapped for the output compression suffix (if any).'''
+    fn_out = strip_compressed_suffix(filename.split("/")[-1])
+    fn_out = fn_out if fn_out.endswith('.xml') else fn_out + '.xml'
+    return fn_out + "." + compression if compression else fn_out
+
+
 def _skip_exists(filepath, skip_exists):
     '''When skip_exists set True, return True when the file already exists. Otherwise, False.'''
     if skip_exists:
         if exists(filepath):
-            print(f"\033[33m{filepath} also exists. If you want to overwrite this file, do skip_exists=False.\033[0m")
+            log_event("exists", f"\033[33m{filepath} also exists. If you want to overwrite this file, do skip_exists=False.\033[0m",
+                      filepath, level="warning")
             return True
     return False
     
 
 def _text_len_check(text, low=0, high=1000000):
-    '''Check whether the given text falls into the desired range.'''
+    '''Check whether the given text (or text length) falls into the desired range.'''
     if high == None:
         return 0
     if not isinstance(high, int):
         raise TypeError("The upper limit for the text must be an integer or None.")
-    if len(text) > low and len(text) <= high:
+    length = text if isinstance(text, int) else len(text)
+    if length > low and length <= high:
         return 0
-    if len(text) < low:
+    if length < low:
         return -1
     return 1
+
+
+def _text_len_skipped(filepath, length, low=0, high=1000000):
+    '''Performing the body text length test to see whether the body text falls in the desired length range.
+    Return True (with the reason logged) if the file is to be skipped.'''
+    len_ch = _text_len_check(length, low, high)
+    if len_ch == 1:
+        log_event("skipped", f"\033[34mSkipping {filepath}: body text {length} chars, exceeds the preset upper text limit: {high}.\n" \
+                  "\033[0mYou can either reset the upper text limit or turn it off by setting text_upper_len=None.",
+                  filepath, "length_check", "notice", length=length, limit=high, reason="upper")
+        return True
+    if len_ch == -1:
+        log_event("skipped", f"\033[34mSkipping {filepath}: body text {length} chars, below the preset text_lower_len: {low} chars.\n" \
+                  "\033[0mYou can either reset the lower text limit or turn it off by setting text_lower_len=0.",
+                  filepath, "length_check", "notice", length=length, limit=low, reason="lower")
+        return True
+    return False
+
+
+def _substitute_tags(body):
+    '''Replace the original tags of a body with <tag>. Return the body and the tags.'''
+    return re.sub(r"<[^>]+>", " <tag> ", body), re.findall(r"<[^>]+>", body)
+
+
+def _tokenize_body(body):
+    '''Replace the original tags of a body with <tag> and tokenize it. Return the tokenized body and the tags.'''
+    body, tags = _substitute_tags(body)
+    return textPreprocessing(body, apply_prep_rules=False), tags
+
+
+def _preprocess_body(tokenized, rule_workers=None, verify_rules=False):
+    '''Apply the preprocessing rules to a tokenized body, the same as textPreprocessing(apply_prep_rules=True) does.
+    With rule_workers, a very large body is processed in chunks by as many processes (see parallelRules.py).'''
+    if rule_workers:
+        return parallel_apply_trans_rules(prep_rules, tokenized, rule_workers, verify=verify_rules)
+    return apply_trans_rules(prep_rules, tokenized)
+
+
+def _normalize_body(filepath, body, rule_workers=None, verify_rules=False):
+    '''Normalize a preprocessed body (with its 嗨 markers). Return the normalized body, or None when
+    its tokens do not align with the preprocessed body. See _preprocess_body for rule_workers.'''
+    if rule_workers:
+        body_norm = parallel_text_normalizing(body, workers=rule_workers, verify=verify_rules)
+    else:
+        body_norm = textNormalizing(body)
+    # 嗨 is a marker to locate past tense verb ending with 'd, now change it back 
+    # to where it should be after the text has been normalized.
+    body = re.sub(r"嗨", "", body) 
+    if len(body_norm.split()) != len(body.split()):
+        log_event("misaligned", f"\033[31mLength not equal. Filepath: {filepath}\033[0m", filepath, "normalized", "error",
+                  tokens=len(body.split()), values=len(body_norm.split()))
+        # log the words misalignments. This is automatic, unless the code is removed.
+        words_misalignments_logger(filepath, body.split(), body_norm.split())
+        return
+    return body_norm
     
     
 def _tokenize_xml(filepath, head_node, body_node, apply_prep_rules=False, spell_norm=False,
-                  text_lower_len=0, text_upper_len=1000000):
+                  text_lower_len=0, text_upper_len=1000000, source=None, keep_marks=False,
+                  rule_workers=None, verify_rules=False, extracted=None):
     
     '''Tokenize/preprocess and/or normalize the body text of a given xml filepath. 
     
@@ -236,6 +340,19 @@ def _tokenize_xml(filepath, head_node, body_node, apply_prep_rules=False, spell_
         Defaults to 1000000, which empirically will gaurantee a fast processing of the algorithms even
         when the richest text annotations are turned on. If none is given, there will be no body text length limit.
         
+        - source(bytes or None): the bytes of the xml file, e.g., read from an archive. When given, the filepath is only a name.
+        
+        - keep_marks(bool): whether to keep the 嗨 markers in the returned body when spell_norm=True, i.e., return
+        the body exactly as textNormalizing was given it. Defaults to False.
+        
+        - rule_workers(int or None): when given, the preprocessing rules and the spelling normalization of a body of 
+        1,000,000 chars or more are run in chunks by a pool of as many processes, cut where the output is the same.
+        
+        - verify_rules(bool): whether to also check the output of the rule_workers against the sequential path. As the
+        cuts are only checked on the text around them, the unverified output may differ in rare cases.
+        
+        - extracted(tuple or None): the (header, body) of the file if they have been extracted already.
+        
     Returns:
         - header(str): xml-like header text, including all the tags. 
         - body(str): xml-like body text, re-tokenized (so that the tokens are separated by whitespcaes) or preprocessed
@@ -245,43 +362,364 @@ def _tokenize_xml(filepath, head_node, body_node, apply_prep_rules=False, spell_
         
         - tags(list): the original tags in the body text.'''
     
-    header, body = get_header_body_as_str(filepath, head_node, body_node)
-    
-    # performing the body text length test to see whether the body text falls in the desired length range.
-    len_ch = _text_len_check(body, text_lower_len, text_upper_len)
-    if len_ch == 1:
-        print(f"\033[34mSkipping {filepath}: body text {len(body)} chars, exceeds the preset upper text limit: {text_upper_len}.")
-        print("\033[0mYou can either reset the upper text limit or turn it off by setting text_upper_len=None.")
-        return 
-    if len_ch == -1:
-        print(f"\033[34mSkipping {filepath}: body text {len(body)} chars, below the preset text_lower_len: {text_lower_len} chars.")
-        print("\033[0mYou can either reset the lower text limit or turn it off by setting text_lower_len=0.")
+    if extracted is None:
+        extracted = get_header_body_as_str(filepath, head_node, body_node, source)
+    header, body = extracted
+    if _text_len_skipped(filepath, len(body), text_lower_len, text_upper_len):
         return 
     
-    tags = re.findall(r"<[^>]+>", body)
-    body = re.sub(r"<[^>]+>", " <tag> ", body)
-    body = textPreprocessing(body, apply_prep_rules=apply_prep_rules)
+    body, tags = _tokenize_body(body)
+    res = _apply_rules(filepath, body, apply_prep_rules, spell_norm, keep_marks, rule_workers, verify_rules)
+    if res is None:
+        return
+    return (header,) + res + (tags,)
+
+
+def _apply_rules(filepath, body, apply_prep_rules=False, spell_norm=False, keep_marks=False,
+                 rule_workers=None, verify_rules=False):
+    '''Preprocess and/or normalize a tokenized body. Return the body and the normalized body (or None), or None
+    if the normalization is misaligned. See _tokenize_xml for the args.'''
+    if apply_prep_rules:
+        body = _preprocess_body(body, rule_workers, verify_rules)
     if spell_norm:
-        body_norm = textNormalizing(body)
-        # 嗨 is a marker to locate past tense verb ending with 'd, now change it back 
-        # to where it should be after the text has been normalized.
-        body = re.sub(r"嗨", "", body) 
-        if len(body_norm.split()) != len(body.split()):
-            print(f"\033[31mLength not equal. Filepath: {filepath}\033[0m")
-            # log the words misalignments. This is automatic, unless the code is removed.
-            words_misalignments_logger(filepath, body.split(), body_norm.split())
+        body_norm = _normalize_body(filepath, body, rule_workers, verify_rules)
+        if body_norm is None:
             return
-        
-        return header, body, body_norm, tags
+        return body if keep_marks else re.sub(r"嗨", "", body), body_norm
     
     # if no spell norm is performed, also need to remove the 嗨 
-    body = re.sub(r"嗨", "", body)
-    return header, body, None, tags
+    return re.sub(r"嗨", "", body), None
+    
+
+def _staged_tokenize_xml(checkpoints, filepath, head_node, body_node, apply_prep_rules=False, spell_norm=False,
+                         text_lower_len=0, text_upper_len=1000000, source=None, keep_marks=False,
+                         rule_workers=None, verify_rules=False, extracted=None):
+    '''The same as _tokenize_xml, but every stage starts from its checkpoint when there is a valid one and saves
+    its checkpoint otherwise (see stageCheckpoints.py). Return the same as _tokenize_xml plus the key of the last
+    stage run, for the annotation stage to chain on, or None if the file is skipped. The file is only parsed if a
+    stage needs its header or body and they are not given as extracted.'''
+    if source is None:
+        with open(filepath, "rb") as f:
+            source = f.read()
+    
+    key = checkpoints.key("header", content_hash(source), {"head_node": head_node, "body_node": body_node})
+    ckpt, body = checkpoints.get("header", key), None
+    if ckpt is None:
+        header, body = extracted or get_header_body_as_str(filepath, head_node, body_node, source)
+        ckpt = {"header": header, "body_len": len(body)}
+        checkpoints.put("header", key, ckpt)
+    header = ckpt["header"]
+    if _text_len_skipped(filepath, ckpt["body_len"], text_lower_len, text_upper_len):
+        return
+    
+    # the tokenizer's props (e.g., tokenize.whitespace, splitHyphenated) decide the tokens as much as the body
+    key = checkpoints.key("tokenized", key, config_fingerprint(stTK.props))
+    ckpt = checkpoints.get("tokenized", key)
+    if ckpt is None:
+        if body is None:
+            _, body = extracted or get_header_body_as_str(filepath, head_node, body_node, source)
+        tokenized, tags = _tokenize_body(body)
+        ckpt = {"body": tokenized, "tags": tags}
+        checkpoints.put("tokenized", key, ckpt)
+    body, tags = ckpt["body"], ckpt["tags"]
+    
+    if apply_prep_rules:
+        key = checkpoints.key("preprocessed", key, config_fingerprint(prep_rules))
+        ckpt = checkpoints.get("preprocessed", key)
+        if ckpt is None:
+            ckpt = {"body": _preprocess_body(body, rule_workers, verify_rules)}
+            checkpoints.put("preprocessed", key, ckpt)
+        body = ckpt["body"]
+    
+    body_norm = None
+    if spell_norm:
+        key = checkpoints.key("normalized", key, norm_rule_set_fingerprint((norm_rules, verbs, irreg_v_dict)))
+        ckpt = checkpoints.get("normalized", key)
+        if ckpt is None:
+            # a misaligned normalization is also kept (as None), so that it is not tried again in vain
+            ckpt = {"body_norm": _normalize_body(filepath, body, rule_workers, verify_rules)}
+            checkpoints.put("normalized", key, ckpt)
+        elif ckpt["body_norm"] is None:
+            log_event("misaligned", f"\033[31mLength not equal. Filepath: {filepath}\033[0m (checkpointed)", filepath,
+                      "normalized", "error", checkpointed=True)
+        body_norm = ckpt["body_norm"]
+        if body_norm is None:
+            return
+    if not (spell_norm and keep_marks):
+        body = re.sub(r"嗨", "", body)
+    return header, body, body_norm, tags, key
+
+
+def _annotate(annotation_func, annotation_keys, text, checkpoints=None, key=None):
+    '''Run the annotation_func on the text, or start from its checkpoint when the checkpoints are given.
+    A failed annotation (None or empty) is not checkpointed, so that the next run tries it again.'''
+    if checkpoints is None:
+        return annotation_func(text)
+    key = checkpoints.key("annotated", key, {"annotation_keys": annotation_keys, "props": sta.props,
+                                             "func": getattr(annotation_func, "__qualname__", str(annotation_func))})
+    ckpt = checkpoints.get("annotated", key)
+    if ckpt is not None:
+        return ckpt["values"]
+    values = annotation_func(text)
+    if values:
+        checkpoints.put("annotated", key, {"values": values})
+    return values
+
+
+# a bare ampersand in a new body (e.g., a lemma "&" of "&amp;"), which createXmlFileFromStr would have recovered from
+_bare_ampersand = re.compile(r"&(?!#?\w+;)")
+
+
+def _segmented(filepath, source, segment_len, text_upper_len):
+    '''Whether a file is to be remade segmented: when segment_len is given and the (decompressed) file is larger
+    than text_upper_len bytes, or than segment_len if there is no upper limit. The size of the file is checked 
+    instead of the length of its body, so that a large file is never read into memory as a whole.'''
+    if not segment_len:
+        return False
+    return xml_size(filepath if source is None else source) > (text_upper_len or segment_len)
+
+
+def _execute_segmented(filepath, fn_out, head_node, body_node, root_name='TEI.2', dst_dir='./',
+                       apply_prep_rules=False, spell_norm=False, annotation_keys=[], annotation_func=None,
+                       segment_len=200000, compression=None, compresslevel=None, source=None, 
+                       archive_writer=None, token_store=None):
+    '''Remake a xml file whose body is too large to be held in memory at once. The body is streamed in segments 
+    cut at element boundaries (see xmlHandler.xmlBodySegments), every segment is tokenized, preprocessed, normalized
+    and annotated on its own, and its word nodes are appended to a .part file in the dst_dir, from which the remade
+    file is written out in chunks (and streamed into the archive, if any). With a token_store, the columns of every
+    segment are likewise spilled to a .columns.part file and appended to the store part by part once the file is
+    saved. The memory used is thus bounded by segment_len, not by the size of the body. See _execute for the args.
+    The stage checkpoints and the re-normalization state are not kept for such a file.
+    
+    Return(str): the same as _execute.'''
+    segments = xmlBodySegments(filepath if source is None else source, head_node, body_node, segment_len)
+    part = join(dst_dir, fn_out + ".part")
+    columns = tokenColumns() if token_store else None
+    spill = join(dst_dir, fn_out + ".columns.part") if token_store else None
+    status = None
+    with open(part, "w", encoding="utf-8") as out, open(spill or devnull, "w", encoding="utf-8") as spill_f:
+        for i, segment in enumerate(segments):
+            name = f"{filepath} (segment {i})"
+            body, tags = _tokenize_body(segment)
+            if apply_prep_rules:
+                body = _preprocess_body(body)
+            body_norm = None
+            if spell_norm:
+                body_norm = _normalize_body(name, body)
+                if body_norm is None:
+                    status = "skipped"
+                    break
+            body = re.sub(r"嗨", "", body)
+            annotation_values = annotation_func(body_norm or body) if annotation_keys else []
+            new_body = _build_new_body(name, body, body_norm, tags, annotation_keys, annotation_values, columns)
+            if new_body == None:
+                status = "misaligned"
+                break
+            out.write(_bare_ampersand.sub("&amp;", new_body) + "\n")
+            if columns is not None:
+                columns.spill(spill_f)
+    
+    if status is None and not segments.body_found:
+        status = "skipped"
+    if status is not None:
+        remove(part)
+        if spill:
+            remove(spill)
+        return status
+    log_event("segmented", f"\033[34m{filepath}: remade in {i + 1} segments, body text {segments.body_len} chars.\033[0m",
+              filepath, segments=i + 1, length=segments.body_len)
+    try:
+        if archive_writer is not None:
+            tmp = part[:-len(".part")] + ".tmp"
+            write_xml_file_stream(tmp, root_name, segments.header, part, compression, compresslevel)
+            try:
+                archive_writer.add_file(fn_out, tmp)
+            finally:
+                remove(tmp)
+        else:
+            write_xml_file_stream(join(dst_dir, fn_out), root_name, segments.header, part, compression, compresslevel)
+    except Exception as e:
+        log_event("failed", f"\033[1m\033[31mA problem creating {join(dst_dir, fn_out)} as follows: \033[0m{e}\n",
+                  filepath, "save", "error", error=str(e))
+        if spill:
+            remove(spill)
+        return "failed"
+    finally:
+        remove(part)
+    if spill:
+        try:
+            _add_to_token_store(token_store, dst_dir, fn_out, read_spilled(spill))
+        finally:
+            remove(spill)
+    return "remade"
+
+
+# how the fused remakes went: annotated from the fused request as it is, with the sentences changed by the rules
+# re-annotated, or annotated anew (see _fused_tokenize_and_annotate)
+_fused_counts = {"fused": 0, "partial": 0, "reannotated_sentences": 0, "fallback": 0}
+_fused_lock = Lock()
+
+
+def _count_fused(how, sentences=0):
+    with _fused_lock:
+        _fused_counts[how] += 1
+        _fused_counts["reannotated_sentences"] += sentences
+
+
+def _fusable(annotation_keys, annotation_func, checkpoints=None):
+    '''Whether the annotations can come from the fused request: a pos and/or lemma remake by the stanfordAnnotator,
+    without the stage checkpoints, which save the tokenized body and the annotations apart.'''
+    return bool(annotation_keys) and checkpoints is None and \
+        annotation_func in (sta.get_pos_tags, sta.get_lemma, sta.get_pos_and_lemma)
+
+
+def _reannotate_sentences(annotation_func, several, words, sentences, changed, values):
+    '''Re-annotate the sentences (given by their numbers of tokens) with a word changed by the rules, in one request,
+    and put their values in place of the fused ones. Return the values and the number of sentences re-annotated,
+    or None if the values of the request do not add up.'''
+    spans, start = [], 0
+    for count in sentences:
+        if changed[0] < start + count:
+            spans.append((start, start + count))
+            changed = [i for i in changed if i >= start + count]
+            if not changed:
+                break
+        start += count
+    with sta.extra_props({"ssplit.newlineIsSentenceBreak": "two"}):
+        new = annotation_func("\n\n".join(" ".join(words[a:b]) for a, b in spans))
+    split = _split_values(new, [b - a for a, b in spans], several) if new else None
+    if split is None:
+        return
+    columns = [list(column) for column in (values if several else (values,))]
+    for (a, b), part in zip(spans, split):
+        for column, new_column in zip(columns, part if several else (part,)):
+            column[a:b] = new_column
+    return (tuple(columns) if several else columns[0]), len(spans)
+
+
+def _fused_tokenize_and_annotate(filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                                 text_upper_len, annotation_keys, annotation_func, source=None, keep_marks=False,
+                                 rule_workers=None, verify_rules=False, extracted=None):
+    '''The same as _tokenize_and_annotate, but the body is tokenized and annotated by one request (tokenize,ssplit,
+    pos,lemma) instead of two, and the preprocessing and normalization rules are applied in between. The tokens the
+    rules leave unchanged keep the annotations of the request; the sentences with a changed token are re-annotated
+    in one more request, and the whole text is annotated anew if the rules split or merge tokens, so that the values
+    always align with the Original/Normalized tokens. Falls back to the two requests if the fused one fails.'''
+    header, body = extracted if extracted is not None else get_header_body_as_str(filepath, head_node, body_node, source)
+    if _text_len_skipped(filepath, len(body), text_lower_len, text_upper_len):
+        return
+    
+    substituted, tags = _substitute_tags(body)
+    # the same text as textPreprocessing sends to the stanfordTokenizer
+    fused = stfa.tokenize_and_annotate(re.sub("%", " was_percent_sign", substituted))
+    tokens = fused["tokens"] if fused else None
+    if not tokens or len(" ".join(tokens).split()) != len(tokens):
+        _count_fused("fallback")
+        return _tokenize_and_annotate(filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                                      text_upper_len, annotation_keys, annotation_func, source, keep_marks,
+                                      rule_workers=rule_workers, verify_rules=verify_rules, extracted=(header, body))
+    
+    res = _apply_rules(filepath, " ".join(tokens), apply_prep_rules, spell_norm, keep_marks, rule_workers, verify_rules)
+    if res is None:
+        return
+    body, body_norm = res
+    text = body_norm if spell_norm else body
+    words = text.split()
+    several = len(annotation_keys) > 1
+    values = tuple(fused[key] for key in annotation_keys) if several else fused[annotation_keys[0]]
+    if len(words) != len(tokens):
+        _count_fused("fallback")
+        return header, body, body_norm, tags, annotation_func(text)
     
+    changed = [i for i, (word, token) in enumerate(zip(words, tokens)) if word != token]
+    if not changed:
+        _count_fused("fused")
+        return header, body, body_norm, tags, values
+    reannotated = _reannotate_sentences(annotation_func, several, words, fused["sentences"], changed, values)
+    if reannotated is None:
+        _count_fused("fallback")
+        return header, body, body_norm, tags, annotation_func(text)
+    _count_fused("partial", reannotated[1])
+    return header, body, body_norm, tags, reannotated[0]
+
+
+def _tokenize_and_annotate(filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                           text_upper_len, annotation_keys, annotation_func, source=None, keep_marks=False,
+                           checkpoints=None, rule_workers=None, verify_rules=False, extracted=None, fused=False):
+    '''Tokenize/preprocess and/or normalize the body of a file and annotate it. See _execute for the args.
+    Return the header, the body (with its 嗨 markers if keep_marks), the normalized body (or None), the tags and
+    the annotation values, or None if the file is skipped.'''
+    if fused and _fusable(annotation_keys, annotation_func, checkpoints):
+        return _fused_tokenize_and_annotate(filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                                            text_upper_len, annotation_keys, annotation_func, source, keep_marks,
+                                            rule_workers, verify_rules, extracted)
+    if checkpoints is not None:
+        res = _staged_tokenize_xml(checkpoints, filepath, head_node, body_node, 
+                                   apply_prep_rules, spell_norm, text_lower_len, text_upper_len, source, keep_marks,
+                                   rule_workers, verify_rules, extracted)
+    else:
+        res = _tokenize_xml(filepath, head_node, body_node, 
+                            apply_prep_rules, spell_norm, text_lower_len, text_upper_len, source, keep_marks,
+                            rule_workers, verify_rules, extracted)
+    if res == None:
+        return
+
+    header, body, body_norm, tags = res[:4]
+    stage_key = res[4] if checkpoints is not None else None
+    if not annotation_keys:
+        annotation_values = []
+    else:
+        annotation_values = _annotate(annotation_func, annotation_keys, body_norm if spell_norm else body,
+                                      checkpoints, stage_key)
+    return header, body, body_norm, tags, annotation_values
+
+
+def _dedup_tokenize_and_annotate(dedup, filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                                 text_upper_len, annotation_keys, annotation_func, source=None, keep_marks=False,
+                                 checkpoints=None, rule_workers=None, verify_rules=False, fused=False):
+    '''The same as _tokenize_and_annotate, but a body already processed in the run (the same text once its tags are
+    replaced by <tag>, with the same options) is taken from the dedup cache and only paired with the file's own
+    header and tags (see bodyDedup.py).'''
+    header, body = get_header_body_as_str(filepath, head_node, body_node, source)
+    if _text_len_skipped(filepath, len(body), text_lower_len, text_upper_len):
+        return
+    
+    substituted, tags = _substitute_tags(body)
+    key = dedup.key(substituted, {"apply_prep_rules": apply_prep_rules, "spell_norm": spell_norm, "keep_marks": keep_marks,
+                                  "annotation_keys": annotation_keys, "props": sta.props if annotation_keys else None,
+                                  "func": getattr(annotation_func, "__qualname__", str(annotation_func))})
+    cached = dedup.claim(key, filepath, len(substituted))
+    if cached is not None:
+        if cached["body"] is None:
+            log_event("misaligned", f"\033[31mLength not equal. Filepath: {filepath}\033[0m (the same body as {cached['filename']})",
+                      filepath, "normalized", "error", duplicate_of=cached["filename"])
+            return
+        return header, cached["body"], cached["body_norm"], tags, cached["annotation_values"]
+    
+    try:
+        res = _tokenize_and_annotate(filepath, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len,
+                                     text_upper_len, annotation_keys, annotation_func, source, keep_marks, checkpoints,
+                                     rule_workers, verify_rules, (header, body), fused)
+    except BaseException:
+        dedup.abandon(key)
+        raise
+    if res is None:
+        # the normalization is misaligned, which it will be for the same body again
+        dedup.put(key, {"filename": filepath, "body": None})
+    elif annotation_keys and not res[4]:
+        # a failed annotation is left for the next file of the body to try again
+        dedup.abandon(key)
+    else:
+        dedup.put(key, {"filename": filepath, "body": res[1], "body_norm": res[2], "annotation_values": res[4]})
+    return res
+
 
 def _execute(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./',
              apply_prep_rules=False, spell_norm=False, word_alignment_debug=False, skip_exists=True,
-             text_lower_len=0, text_upper_len=1000000, annotation_keys=[], annotation_func=None):
+             text_lower_len=0, text_upper_len=1000000, annotation_keys=[], annotation_func=None,
+             compression=None, compresslevel=None, source=None, archive_writer=None,
+             token_store=None, norm_state=None, checkpoints=None, segment_len=None, rule_workers=None,
+             verify_rules=False, dedup=None, lemmatizer="corenlp", fused=False):
     ''''The abstract func to execute: tokenization/preprocessing, normalization, pos tagging, 
     lemmatization and all of their combinations.
     
@@ -315,86 +753,404 @@ def _execute(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_di
                                  
         - annotation_func(method or None): the correponding annotation_func that can get the annotation_values to 
                                          build the new body for the xml file to be remade.
+        
+        - compression(str or None): "gz", "bz2" or "xz" to save the remade xml file compressed, defaults to None.
+                                  The input file can be gzip/bz2/xz compressed regardless, which is auto-detected.
+        
+        - compresslevel(int or None): the output compression level from 0 (1 for bz2) to 9, see createXmlFileFromStr.
+        
+        - source(bytes or None): the bytes of the xml file to remake, e.g., a member read from a tar/zip archive.
+                               When given, file_dir and filename are only used to name the file.
+        
+        - archive_writer(corpusArchive.archiveShardWriter or None): when given, the remade xml file is added to
+                               the writer's tar shards instead of being saved in the dst_dir.
+        
+        - token_store(str or tokenStore.tokenStoreWriter or None): also emit the Original/Normalized/pos/lemma values 
+                               and the tag slots as a columnar token store. "document" makes a store per file 
+                               (<remade filename>.tokens in the dst_dir), while a tokenStoreWriter collects the files
+                               of a whole run or shard in one store. Defaults to None. See tokenStore.py.
+        
+        - norm_state(normalizationState.normalizationState or None): when given and spell_norm=True, the preprocessed
+                               body, header and tags of the file are recorded with the fingerprint of the normalization
+                               rules, so that the file can be re-normalized without being re-tokenized once the rules
+                               change. See normalizationState.py.
+        
+        - checkpoints(stageCheckpoints.stageCheckpoints or None): when given, every stage (header, tokenized, preprocessed,
+                               normalized, annotated) starts from its checkpoint if its input and config are unchanged,
+                               and saves its checkpoint otherwise. See stageCheckpoints.py.
+        
+        - segment_len(int or None): when given, a file larger than text_upper_len (or than segment_len if text_upper_len=None)
+                               is not skipped but remade segmented: its body is streamed in segments of about segment_len
+                               chars, cut at element boundaries, which are processed one by one, so that the memory used
+                               does not grow with the size of the body. Defaults to None. See _execute_segmented.
+        
+        - rule_workers(int or None), verify_rules(bool): run the regex stages of a very large body in chunks by a pool
+                               of rule_workers processes, optionally verified against the sequential path. See _tokenize_xml.
+        
+        - dedup(bodyDedup.bodyDedup or None): when given, a body already processed in the run (the same text once its
+                               tags are replaced by <tag>) is not tokenized, normalized or annotated again, but taken
+                               from the cache and paired with the file's own header and tags. See bodyDedup.py.
+        
+        - lemmatizer(str): "corenlp" (default), "offline" or "hybrid". With "offline", a lemma-only remake is lemmatized
+                               in process from the config tables and suffix rules instead of by the CoreNLP annotator; with
+                               "hybrid", the unknown or ambiguous tokens are then sent to the annotator in their sentences.
+                               Pos tagging is always done by the annotator. See offlineLemmatizer.py.
+        
+        - fused(bool): whether a pos and/or lemma remake tokenizes and annotates the body in one CoreNLP request instead
+                               of two, the rules being applied in between. Defaults to False. Not used by the segmented
+                               remakes and with the checkpoints. See _fused_tokenize_and_annotate.
+    
+    Return(str):
+        The status of the file: "exists" (skipped as the remade file exists), "skipped" (body text length out of
+        range, or words misalignment after normalization), "misaligned" (annotations misaligned), "failed" (the
+        remade file could not be created) or "remade".
                                          '''
     if not apply_prep_rules and spell_norm:
-        print("If apply_prep_rules=False, spell_norm must also be set False to avoid words misalignment problem.")
-        print("\033[32mspell_norm and word_alignment_debug (if on) accordingly have been turned off.\033[0m")
+        log_event("options_adjusted", "If apply_prep_rules=False, spell_norm must also be set False to avoid words misalignment " \
+                  "problem.\n\033[32mspell_norm and word_alignment_debug (if on) accordingly have been turned off.\033[0m",
+                  join(file_dir, filename), level="warning")
         spell_norm = False
         word_alignment_debug = False
+    if lemmatizer != "corenlp" and annotation_keys == ['lemma']:
+        annotation_func = _lemma_func(lemmatizer, rule_workers)
         
     filepath_in = join(file_dir, filename)
-    fn_out = filename if "/" not in filename else filename.split("/")[-1]
-    if _skip_exists(join(dst_dir, fn_out), skip_exists):
-        return
+    fn_out = _out_filename(filename, compression)
+    if archive_writer is not None:
+        if skip_exists and fn_out in archive_writer:
+            log_event("exists", f"\033[33m{fn_out} also exists in the archive shards. If you want to add it again, do skip_exists=False.\033[0m",
+                      fn_out, level="warning")
+            return "exists"
+    elif _skip_exists(join(dst_dir, fn_out), skip_exists):
+        return "exists"
+    
+    if _segmented(filepath_in, source, segment_len, text_upper_len):
+        status = _execute_segmented(filepath_in, fn_out, head_node, body_node, root_name, dst_dir, apply_prep_rules, 
+                                    spell_norm, annotation_keys, annotation_func, segment_len, compression, compresslevel,
+                                    source, archive_writer, token_store)
+        if status == "remade" and archive_writer is None:
+            _debug(dst_dir, fn_out, spell_norm, word_alignment_debug)
+        return status
     
-    res = _tokenize_xml(filepath_in, head_node, body_node, 
-                        apply_prep_rules, spell_norm, text_lower_len, text_upper_len)
+    keep_marks = bool(spell_norm and norm_state is not None)
+    args = (filepath_in, head_node, body_node, apply_prep_rules, spell_norm, text_lower_len, text_upper_len,
+            annotation_keys, annotation_func, source, keep_marks, checkpoints, rule_workers, verify_rules)
+    if dedup is None:
+        res = _tokenize_and_annotate(*args, fused=fused)
+    else:
+        res = _dedup_tokenize_and_annotate(dedup, *args, fused=fused)
     
     # if res == None, either the body text length test fails (either the file too small or to big), 
     # or there are words misalignments between the normalized body (if any) and the tokenized/preprocessed body.
     if res == None:
-        return
+        return "skipped"
+
+    header, body, body_norm, tags, annotation_values = res
+    if keep_marks:
+        norm_state.record(fn_out, norm_state.fingerprint, body, header=header, tags=tags, root_name=root_name,
+                          annotation_keys=annotation_keys, compression=compression, lemmatizer=lemmatizer)
+        body = re.sub(r"嗨", "", body)
+
+    columns = tokenColumns() if token_store else None
+    new_body = _build_new_body(filepath_in, body, body_norm, tags, annotation_keys, annotation_values, columns)
+    if new_body == None:
+        return "misaligned"
+    status = _save_new_body(fn_out, root_name, header, new_body, dst_dir, compression, compresslevel,
+                            archive_writer, token_store, columns)
+    if status == "remade":
+        _debug(dst_dir, fn_out, spell_norm, word_alignment_debug)
+    return status
 
-    header, body, body_norm, tags = res
-    
-    if not annotation_keys:
-        annotation_values = []
-    else:
-        if spell_norm:
-            annotation_values = annotation_func(body_norm)
-        else:
-            annotation_values = annotation_func(body)
 
-    new_body = _build_new_body(filepath_in, body, body_norm, tags, annotation_keys, annotation_values)
-    createXmlFileFromStr(fn_out, root_name, header, new_body, dst_dir)
-    _debug(dst_dir, fn_out, spell_norm, word_alignment_debug)
+def _save_new_body(fn_out, root_name, header, new_body, dst_dir, compression=None, compresslevel=None,
+                   archive_writer=None, token_store=None, columns=None):
+    '''Save a remade xml file (and its token store columns, if any) in the dst_dir or the archive shards.
+    See _execute for the args. Return(str): "remade" or "failed".'''
+    if archive_writer is not None:
+        tree = createXmlFileFromStr(fn_out, root_name, header, new_body, save=False)
+        if tree is None:
+            return "failed"
+        archive_writer.add(fn_out, compress_bytes(etree.tostring(tree), compression, compresslevel))
+        log_event("created", f"{fn_out} has been added to the archive shards in {dst_dir}!", fn_out, "save")
+    elif not createXmlFileFromStr(fn_out, root_name, header, new_body, dst_dir, 
+                                  compression=compression, compresslevel=compresslevel):
+        return "failed"
+    _add_to_token_store(token_store, dst_dir, fn_out, columns)
+    return "remade"
+
+
+def _add_to_token_store(token_store, dst_dir, fn_out, columns):
+    '''Add the columns of a remade file to its token store, once the file is saved: to a store of its own if
+    token_store="document", otherwise to the store of the run (where it replaces the file's previous columns).
+    The columns are a tokenColumns, or an iterable of the tokenColumns of the file's segments.'''
+    parts = [columns] if isinstance(columns, tokenColumns) else columns
+    if token_store == "document":
+        store_dir = join(dst_dir, fn_out + ".tokens")
+        if exists(store_dir):
+            rmtree(store_dir)
+        tokenStoreWriter(store_dir).add_parts(fn_out, parts)
+    elif token_store:
+        token_store.add_parts(fn_out, parts)
 
 
 def tokenize_xml_body(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./',
                       apply_prep_rules=False, spell_norm=False, word_alignment_debug=False, skip_exists=True,
-                      text_lower_len=0, text_upper_len=1000000):
+                      text_lower_len=0, text_upper_len=1000000, **kwargs):
     '''Function to tokenize a single xml file's body with further preprocessing and spelling normalization optional.
-    More about the args, please do print(xmlRemaker._execute.__doc__) to check it out.'''
+    More about the args, including the keyword-only options passed on as kwargs (e.g., compression),
+    please do print(xmlRemaker._execute.__doc__) to check it out.'''
     
-    _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
-             word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=[], annotation_func=None)
+    return _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
+                    word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=[], annotation_func=None,
+                    **kwargs)
         
 
 def pos_tag_xml_body(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./',
                        apply_prep_rules=False, spell_norm=False, word_alignment_debug=False, skip_exists=True,
-                       text_lower_len=0, text_upper_len=1000000):
+                       text_lower_len=0, text_upper_len=1000000, **kwargs):
     ''''Function to pos tag a single xml file's body with further preprocessing and spelling normalization optional.
-    More about the args, please do print(xmlRemaker._execute.__doc__) to check it out.'''
+    More about the args, including the keyword-only options passed on as kwargs (e.g., compression),
+    please do print(xmlRemaker._execute.__doc__) to check it out.'''
     
-    _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
-             word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=['pos'], annotation_func=sta.get_pos_tags)
+    return _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
+                    word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=['pos'], annotation_func=sta.get_pos_tags,
+                    **kwargs)
     
 
 def lemmatize_xml_body(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./',
                        apply_prep_rules=False, spell_norm=False, word_alignment_debug=False, skip_exists=True,
-                       text_lower_len=0, text_upper_len=1000000):
+                       text_lower_len=0, text_upper_len=1000000, **kwargs):
     ''''Function to lemmatize a single xml file's body with further preprocessing and spelling normalization optional.
-    More about the args, please do print(xmlRemaker._execute.__doc__) to check it out.'''
+    More about the args, including the keyword-only options passed on as kwargs (e.g., compression),
+    please do print(xmlRemaker._execute.__doc__) to check it out.'''
     
-    _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
-             word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=['lemma'], annotation_func=sta.get_lemma)
+    return _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
+                    word_alignment_debug, skip_exists, text_lower_len, text_upper_len, annotation_keys=['lemma'], annotation_func=sta.get_lemma,
+                    **kwargs)
     
 
 def xml_body_with_pos_lemma(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./',
                             apply_prep_rules=False, spell_norm=False, word_alignment_debug=False, skip_exists=True,
-                            text_lower_len=0, text_upper_len=1000000):
+                            text_lower_len=0, text_upper_len=1000000, **kwargs):
     '''Function to pos tag and lemmatize a single xml file's body with further preprocessing and spelling normalization optional.
-    More about the args, please do print(xmlRemaker._execute.__doc__) to check it out.'''
+    More about the args, including the keyword-only options passed on as kwargs (e.g., compression),
+    please do print(xmlRemaker._execute.__doc__) to check it out.'''
     
-    _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
-             word_alignment_debug, skip_exists, text_lower_len, text_upper_len, ['pos', 'lemma'], sta.get_pos_and_lemma)
+    return _execute(file_dir, filename, head_node, body_node, root_name, dst_dir, apply_prep_rules, spell_norm,
+                    word_alignment_debug, skip_exists, text_lower_len, text_upper_len, ['pos', 'lemma'], sta.get_pos_and_lemma,
+                    **kwargs)
+
+
+_annotation_funcs = {(): None, ('pos',): sta.get_pos_tags, ('lemma',): sta.get_lemma,
+                     ('pos', 'lemma'): sta.get_pos_and_lemma}
+
+# the lemmatizers of the lemma-only remakes (see _execute), the offline ones built on first use
+lemmatizers = ("corenlp", "offline", "hybrid")
+_offline_lemmatizers = {}
+_offline_lemmatizers_lock = Lock()
+
+
+def _lemma_func(lemmatizer, rule_workers=None):
+    '''Return the annotation_func of an offline or hybrid lemmatizer (see offlineLemmatizer.py).'''
+    if lemmatizer not in lemmatizers[1:]:
+        raise ValueError(f"lemmatizer must be one of {list(lemmatizers)}.")
+    with _offline_lemmatizers_lock:
+        if lemmatizer not in _offline_lemmatizers:
+            fallback = sta.get_lemma if lemmatizer == "hybrid" else None
+            _offline_lemmatizers[lemmatizer] = offlineLemmatizer(fallback=fallback)
+    lemmatize = _offline_lemmatizers[lemmatizer].get_lemma
+    
+    def annotation_func(text):
+        return lemmatize(text, workers=rule_workers)
+    # the checkpoints and the dedup cache tell the annotations apart by the name of the func
+    annotation_func.__qualname__ = f"offlineLemmatizer.get_lemma[{lemmatizer}]"
+    return annotation_func
+
+
+# the annotation_keys of each mode of remake()
+remake_modes = {"tokenize": (), "pos_tag": ('pos',), "lemmatize": ('lemma',), "pos_lemma": ('pos', 'lemma')}
+
+# the options of remake(), with their defaults
+remake_options = {"apply_prep_rules": False, "spell_norm": False, "text_lower_len": 0, "text_upper_len": 1000000,
+                  "compression": None, "compresslevel": None, "rule_workers": None, "verify_rules": False,
+                  "lemmatizer": "corenlp", "fused": False}
+
+
+def _split_values(values, counts, several):
+    '''Split the annotation values of texts annotated in one request into the values of each text, given the
+    numbers of their tokens. Return None if the values do not add up.'''
+    columns = values if several else (values,)
+    if any(len(column) != sum(counts) for column in columns):
+        return
+    out, start = [], 0
+    for count in counts:
+        split = tuple(column[start:start + count] for column in columns)
+        out.append(split if several else split[0])
+        start += count
+    return out
+
+
+def _annotate_batch(annotation_func, several, texts, batch_chars=100000):
+    '''Annotate the texts in as few requests as possible: consecutive texts are joined by blank lines, which are
+    made sentence breaks, up to batch_chars chars per request. A group whose values do not add up is annotated
+    text by text instead. Return the annotation values of every text.'''
+    groups, group, size = [], [], 0
+    for i, text in enumerate(texts):
+        if group and size + len(text) > batch_chars:
+            groups.append(group)
+            group, size = [], 0
+        group.append(i)
+        size += len(text) + 2
+    if group:
+        groups.append(group)
+    
+    out = [None] * len(texts)
+    for group in groups:
+        split = None
+        if len(group) > 1:
+            with sta.extra_props({"ssplit.newlineIsSentenceBreak": "two"}):
+                values = annotation_func("\n\n".join(texts[i] for i in group))
+            if values:
+                split = _split_values(values, [len(texts[i].split()) for i in group], several)
+        if split is None:
+            split = [annotation_func(texts[i]) for i in group]
+        for i, values in zip(group, split):
+            out[i] = values
+    return out
+
+
+def remake_batch(docs, head_node, body_node, mode="tokenize", root_name='TEI.2', options=None, batch_chars=100000):
+    '''The same as remake(), but for many xml documents at once, whose annotations are requested from CoreNLP 
+    together: the texts of consecutive documents are sent in one request of up to batch_chars chars.
+    Return the list of the remade documents (bytes, or None for a document skipped, misaligned or failed).'''
+    if mode not in remake_modes:
+        raise ValueError(f"mode must be one of {list(remake_modes)}.")
+    options = dict(remake_options, **(options or {}))
+    if len(options) != len(remake_options):
+        raise TypeError(f"Unknown options: {', '.join(sorted(set(options) - set(remake_options)))}.")
+    if not options["apply_prep_rules"] and options["spell_norm"]:
+        log_event("option_off", "If apply_prep_rules=False, spell_norm must also be set False to avoid words misalignment " \
+                  "problem.\n\033[32mspell_norm has been turned off.\033[0m", stage="remake_batch", level="notice",
+                  option="spell_norm")
+        options["spell_norm"] = False
+    annotation_keys = list(remake_modes[mode])
+    annotation_func = _annotation_funcs[remake_modes[mode]]
+    if options["lemmatizer"] != "corenlp" and mode == "lemmatize":
+        annotation_func = _lemma_func(options["lemmatizer"], options["rule_workers"])
+    
+    # the documents are only named in the messages by their position
+    names = [f"<document {i}>" for i in range(len(docs))]
+    if options["fused"] and _fusable(annotation_keys, annotation_func):
+        # each document is tokenized and annotated by one request, rather than tokenized by one and annotated in batches
+        fused = [_fused_tokenize_and_annotate(name, head_node, body_node, options["apply_prep_rules"], options["spell_norm"],
+                                              options["text_lower_len"], options["text_upper_len"], annotation_keys,
+                                              annotation_func, doc, rule_workers=options["rule_workers"],
+                                              verify_rules=options["verify_rules"])
+                 for name, doc in zip(names, docs)]
+        processed = [None if res is None else res[:4] for res in fused]
+        annotations = [[] if res is None else res[4] for res in fused]
+    else:
+        processed = [_tokenize_xml(name, head_node, body_node, options["apply_prep_rules"], options["spell_norm"],
+                                   options["text_lower_len"], options["text_upper_len"], doc, 
+                                   rule_workers=options["rule_workers"], verify_rules=options["verify_rules"])
+                     for name, doc in zip(names, docs)]
+        annotations = [[] for _ in docs]
+        if annotation_keys:
+            todo = [i for i, res in enumerate(processed) if res is not None]
+            texts = [processed[i][2] if options["spell_norm"] else processed[i][1] for i in todo]
+            for i, values in zip(todo, _annotate_batch(annotation_func, len(annotation_keys) > 1, texts, batch_chars)):
+                annotations[i] = values
+    
+    out = []
+    for name, res, annotation_values in zip(names, processed, annotations):
+        if res is None:
+            out.append(None)
+            continue
+        header, body, body_norm, tags = res
+        new_body = _build_new_body(name, body, body_norm, tags, annotation_keys, annotation_values)
+        tree = None if new_body is None else createXmlFileFromStr(None, root_name, header, new_body, save=False)
+        if tree is None:
+            out.append(None)
+            continue
+        out.append(compress_bytes(etree.tostring(tree), options["compression"], options["compresslevel"]))
+    return out
+
+
+def remake(xml_bytes, head_node, body_node, mode="tokenize", root_name='TEI.2', options=None):
+    '''Remake a xml document in memory: the same pipeline as _execute, but from the bytes of the document to the
+    bytes of the remade document (exactly what _execute would have saved), with no file read or written (bar the
+    words misalignment logs, if any).
+    
+    Args:
+        - xml_bytes(bytes): the xml document, plain or gzip/bz2/xz compressed.
+        - head_node(str), body_node(str), root_name(str): see _execute.
+        - mode(str): "tokenize" (default), "pos_tag", "lemmatize" or "pos_lemma".
+        - options(dict or None): any of apply_prep_rules, spell_norm, text_lower_len, text_upper_len, compression, 
+        compresslevel, rule_workers, verify_rules, lemmatizer and fused (see _execute), with the same defaults.
+    
+    Return(bytes or None):
+        The remade document, or None if it was skipped (body text length out of range, or words misalignment after
+        normalization), misaligned (annotations) or could not be created.
+    
+    ##############
+    Example usage:
+    ##############
+    
+    >>> remake(xml_bytes, "teiHeader", "text", mode="pos_lemma", options={"apply_prep_rules": True, "spell_norm": True})
+    >>> remake_batch([xml_bytes1, xml_bytes2, ...], "teiHeader", "text", mode="pos_tag")   # [bytes or None, ...]
+    '''
+    return remake_batch([xml_bytes], head_node, body_node, mode, root_name, options)[0]
+
+
+def renormalize_xml_body(file_dir, filename, head_node, body_node, root_name='TEI.2', dst_dir='./', 
+                         rule_set=None, norm_state=None, compresslevel=None, archive_writer=None, 
+                         token_store=None, **kwargs):
+    '''Re-normalize a remade xml file from the state recorded by its spell normalized remake (see normalizationState.py),
+    without re-reading or re-tokenizing the original file. The annotations (if any) are re-done, as they were made on
+    the normalized text, by the lemmatizer recorded. The file_dir, head_node and body_node are not used, the filename
+    is the remade filename.
+    
+    Args:
+        - rule_set(tuple): the new (norm_rules, verbs, irreg_v_dict), see normalizationState.load_norm_rule_set.
+        - norm_state(normalizationState.normalizationState): the state, whose fingerprint is that of the rule_set.
+        - compresslevel, archive_writer, token_store: see _execute.
+    
+    Return(str): "skipped" (words misalignment after normalization), "misaligned", "failed" or "remade".'''
+    state = norm_state.load(filename)
+    body_norm = textNormalizing(state["body"], *rule_set)
+    body = re.sub(r"嗨", "", state["body"])
+    if len(body_norm.split()) != len(body.split()):
+        log_event("misaligned", f"\033[31mLength not equal. Filepath: {filename}\033[0m", filename, "normalized", "error",
+                  tokens=len(body.split()), values=len(body_norm.split()))
+        words_misalignments_logger(filename, body.split(), body_norm.split())
+        return "skipped"
+    
+    annotation_keys = state["annotation_keys"]
+    # the states recorded before the lemmatizer was are those of CoreNLP remakes
+    lemmatizer = state.get("lemmatizer", "corenlp")
+    if lemmatizer != "corenlp" and annotation_keys == ['lemma']:
+        annotation_func = _lemma_func(lemmatizer, kwargs.get("rule_workers"))
+    else:
+        annotation_func = _annotation_funcs[tuple(annotation_keys)]
+    annotation_values = annotation_func(body_norm) if annotation_func else []
+    columns = tokenColumns() if token_store else None
+    new_body = _build_new_body(join(dst_dir, filename), body, body_norm, state["tags"], 
+                               annotation_keys, annotation_values, columns)
+    if new_body == None:
+        return "misaligned"
+    status = _save_new_body(filename, state["root_name"], state["header"], new_body, dst_dir, state["compression"],
+                            compresslevel, archive_writer, token_store, columns)
+    if status == "remade":
+        norm_state.set_fingerprint([filename], norm_state.fingerprint)
+    return status
         
 
 class xmlCorpusRemaker:
     '''Class method for remaking a corpus of xml files, partial or entire. 
     
     Args (initialization): 
-        - corpus_dir(str): corpus directory. 
+        - corpus_dir(str): corpus directory, or a .tar(.gz/.bz2/.xz)/.zip archive of the corpus, which is read
+        member by member in a streaming fashion without extraction. 
         - head_node(str): head_node name.
         - body_node(str): body_node name.
         - root_name(str): the name of the first super node for the xml file, defaults to "TEI.2".
@@ -408,6 +1164,87 @@ class xmlCorpusRemaker:
         
         - shuffle(bool): defaults to False. When set True, the filenames will be shuffled. Another way to shuffle
         the filenames is to use the function shuffle_filename() included in the class method. Check the bottom line of this doc.
+        
+        - manifest_path(str or None): where to persist the corpus manifest (filenames, sizes and mtimes). When the
+        file exists, the corpus is not re-listed from scratch but refreshed by mtime. See corpusManifest.py. With
+        shard_count, an existing manifest is used as it is (not refreshed or rewritten), to be shared by the shards.
+        
+        - shard_index(int or None), shard_count(int or None): when both given, only remake the shard_index-th of
+        shard_count disjoint shards of the corpus, assigned by a stable hash of the filenames. Independent processes
+        or hosts sharing the filesystem can thus split a corpus with no coordination and no duplicate work.
+        
+        - balance_by_size(bool): defaults to False. When set True, the shards are balanced by byte size instead.
+        Every shard must then see the same corpus, e.g., by sharing one persisted manifest_path.
+        
+        - filenames(list or None): a slice of the corpus to remake (e.g., from a manifest), instead of all the files.
+        Sharding, if any, is applied on top of it.
+        
+        - compression(str or None): "gz", "bz2" or "xz" to save the remade xml files compressed, defaults to None.
+        gzip/bz2/xz compressed xml files (e.g., .xml.gz) in the corpus_dir are read transparently regardless.
+        
+        - compresslevel(int or None): the output compression level from 0 (fast) to 9 (small), or from 1 for bz2. 
+        
+        - archive_out(bool): defaults to False. When set True, the remade xml files are written into size-capped tar
+        shards (remade-00000.tar, ...) in the dst_dir instead of loose files, with an index of the member offsets
+        (remade.index.jsonl) for random access. A shard process writes its own (remade.shard-0-of-4-00000.tar and
+        remade.shard-0-of-4.index.jsonl, ...), which corpusArchive.load_archive_index(dst_dir) merges. See corpusArchive.py.
+        
+        - archive_max_bytes(int): the size cap of a tar shard, defaults to 1GB.
+        
+        - token_store(str or None): also emit a columnar token store (vocab-interned uint32 arrays of the Original,
+        Normalized, pos and lemma values plus the tag slots) alongside the remade xml files. "document" for a store
+        per file (<remade filename>.tokens), "shard" for one store per run or shard (tokens, or tokens.shard-i-of-n,
+        in the dst_dir). Defaults to None. Read the stores with tokenStore.tokenStore. 
+        
+        - keep_norm_state(bool): defaults to False. When set True, the spell normalized runs record the preprocessed
+        body, header and tags of every file with a fingerprint of the normalization rules (.renorm.sqlite in the dst_dir),
+        so that renormalize_the_corpus() can later re-normalize only the files affected by a rule change. 
+        
+        - checkpoints(bool or str): defaults to False. When set True (or a directory, instead of .checkpoints in the 
+        dst_dir), compact checkpoints are saved after every stage of the pipeline (header, tokenized, preprocessed, 
+        normalized and annotated), keyed by the content hash of the input file and the config of the stages, so that
+        any later run (e.g., with skip_exists=False after changing root_name) restarts from the deepest valid one.
+        
+        - corenlp_pool(corenlpToolbox.coreNLPServerPool or None): when given, the CoreNLP tokenization and annotation
+        requests are spread over the servers of the pool instead of the single server at localhost:9999.
+        
+        - request_timeout(float or None), max_retries(int), hedge_requests(bool): the deadline (seconds) of a CoreNLP request,
+        the number of retries (with a jittered backoff) after a timeout or connection error, and whether to send a duplicate 
+        of a request running past the p95 latency, taking the first answer. Defaults to None, 0 and False. The per file
+        request count and p99 latency, and the latency stats of the run, go into the run stats. See corenlpToolbox.CoreNLP.
+        The pool and the deadlines apply to the runs of this remaker only, not to the other remakers of the process.
+        
+        - segment_len(int or None): defaults to None. When given (e.g., 200000), the files larger than text_upper_len are
+        no longer skipped but remade segmented: their bodies are streamed in segments of about segment_len chars cut at
+        element boundaries, so that arbitrarily large texts are remade with bounded memory. See _execute_segmented.
+        
+        - rule_workers(int or None): defaults to None. When given, the preprocessing rules and the spelling normalization
+        of a body of 1,000,000 chars or more run in chunks on a pool of as many processes, instead of on one core. The
+        chunks are cut at <tag> placeholders or sentence ends where the output is unchanged. See parallelRules.py.
+        
+        - verify_rules(bool): defaults to False. When set True, the chunked output of the rule_workers is also checked
+        against the sequential path (which is kept if they differ), at the cost of running both. Otherwise, as the
+        cuts are only checked on the text around them, the output may differ from the sequential one in rare cases.
+        
+        - memory_budget(int or str or None): defaults to None. When given (e.g., "4g"), the multitasking runs no longer
+        go in fixed batches of threads_num files: a file is started as soon as its estimated peak memory (its size times
+        a ratio learned from the memory actually used) fits in the budget, up to threads_num files at a time, so that
+        large bodies are not run all at once and small ones fill the room left. See corpusScheduler.py.
+        
+        - dedup(bool): defaults to False. When set True, the body of every file is hashed once extracted (with its tags
+        replaced by <tag>), and a body already processed in the run (e.g., a reprint whose header alone differs) is not
+        tokenized, normalized or annotated again: its cached processed body is paired with the file's own header and
+        tags. The dedup ratio is reported in the run stats. See bodyDedup.py.
+        
+        - lemmatizer(str): "corenlp" (default), "offline" or "hybrid". With "offline", lemmatize_the_corpus() lemmatizes
+        the tokens in process from hashed tables (config/english_lexicon.txt, common_verbs.txt and the irregular verbs)
+        and suffix rules, and sends no annotation request to CoreNLP (the tokenizer is still used); with "hybrid", the
+        unknown or ambiguous tokens are sent to the annotator in their sentences. The counts of the tokens resolved 
+        each way are reported in the run stats. See offlineLemmatizer.py.
+        - fused(bool): whether the pos tagging and/or lemmatization runs tokenize and annotate each body in one CoreNLP
+        request instead of two (the tokenizer's, then the annotator's), halving the requests and the bytes sent. The
+        tokens changed by the preprocessing or normalization rules are re-annotated in their sentences. The counts of
+        the files annotated each way are reported in the run stats. Defaults to False.
     
     ##############
     Example usage:
@@ -455,6 +1292,11 @@ class xmlCorpusRemaker:
     *
     * - threads_num(int): number of threads occuring at the runtime, defaults to 10.
     * - remain_files_only(bool): whether to only process files that have not been processed. 
+    *
+    * - profile(bool or str): whether to profile the run (cProfile plus sampled call stacks, see remakeProfiler.py),
+    * with the report (remake.prof, remake.collapsed, report.txt) saved in .profile in the dst_dir (or the given dir).
+    *
+    * - profile_rate(float): the fraction of the files to profile when profile=True, defaults to 1.0.
     **************************************************************************************************************
     
     # Besides, the class also provide handy method to show the corpus files by
@@ -466,31 +1308,104 @@ class xmlCorpusRemaker:
     >>> remaker.remaining_files()
     # to debug the remade xml files if they have been normalized
     >>> remaker.debug_remade_corpus()
+    
+    # Every run saves the status and time of each file in the dst_dir (.remake_stats.json, or one file per shard). 
+    # To remake a corpus in 4 shards, start 4 processes (on one box or more) with shard_index 0 to 3:
+    >>> xmlCorpusRemaker(corpus_dir, head_node, body_node, shard_index=i, shard_count=4).tokenize_the_corpus()
+    # and then combine the shards' logs and stats once they are all done:
+    >>> merge_shard_stats(dst_dir)
+    
+    # With keep_norm_state=True, after editing config/normalizing_rules.txt or config/common_verbs.txt:
+    >>> remaker.renormalize_the_corpus(dry_run=True)   # the remade files affected by the rule changes
+    >>> remaker.renormalize_the_corpus()               # re-normalize them from the recorded state
     '''
     def __init__(self, corpus_dir, head_node, body_node, root_name='TEI.2', dst_dir=None,
-                 include_sub_dir=False, shuffle=False):
+                 include_sub_dir=False, shuffle=False, manifest_path=None, 
+                 shard_index=None, shard_count=None, balance_by_size=False, filenames=None,
+                 compression=None, compresslevel=None, archive_out=False, archive_max_bytes=1 << 30,
+                 token_store=None, keep_norm_state=False, checkpoints=False, corenlp_pool=None,
+                 request_timeout=None, max_retries=0, hedge_requests=False, segment_len=None,
+                 rule_workers=None, verify_rules=False, memory_budget=None, dedup=False, lemmatizer="corenlp",
+                 fused=False):
         
         self._corpus_dir = corpus_dir  + "/" if not corpus_dir.endswith("/") else corpus_dir
-        self._filenames = get_filenames_from_dir(corpus_dir, include_sub_dir, ".xml", shuffle)
+        self._archive = is_archive(corpus_dir)
+        # the shards share an existing manifest as it is, so that they all split the same files
+        self._manifest = corpusManifest(corpus_dir, include_sub_dir, with_compressed_formats(".xml"), manifest_path,
+                                        refresh=shard_count is None)
+        self._filenames = self._manifest.filenames() if filenames is None else list(filenames)
+        self._shard = None
+        if shard_count is not None:
+            sizes = dict((f, s) for f, s, _ in self._manifest) if balance_by_size else None
+            self._filenames = shard_filenames(self._filenames, shard_index, shard_count, sizes)
+            self._shard = (shard_index, shard_count)
+        if shuffle:
+            random.shuffle(self._filenames)
         self._head_node = head_node
         self._body_node = body_node
-        if not get_node(join(corpus_dir, self._filenames[0]), head_node):
-            print("Test run. head_node not found. Please double check and/or recall this class.")
-        if not get_node(join(corpus_dir, self._filenames[0]), body_node):
-            print("Test run. body_node not found. Please double check and/or recall this class.")
+        if self._filenames:
+            if self._archive:
+                filename, source = next(iter_archive_members(corpus_dir, names=set(self._filenames)))
+            else:
+                filename, source = self._filenames[0], None
+            soup = readXML(join(corpus_dir, filename) if source is None else source)
+            if not soup.find(head_node):
+                print("Test run. head_node not found. Please double check and/or recall this class.")
+            if not soup.find(body_node):
+                print("Test run. body_node not found. Please double check and/or recall this class.")
         
         if dst_dir:
             self._dst_dir = dst_dir
+        elif self._archive:
+            self._dst_dir = strip_archive_suffix(corpus_dir) + "_remade/"
         else:
             if not corpus_dir.endswith("/"):
                 self._dst_dir = corpus_dir + "_remade/"
             else:
                 self._dst_dir = "/".join(corpus_dir.split("/")) + "_remade/"
         if not exists(self._dst_dir):
-            mkdir(self._dst_dir)
+            # several shards may be creating the same dst_dir at once
+            makedirs(self._dst_dir, exist_ok=True)
             print(self._dst_dir + " has been created.")
         
         self._root_name = root_name    
+        self._stats = []
+        self._profiler = None
+        self._memory_budget = memory_budget
+        self._memory_stats = None
+        self._dedup = dedup
+        self._dedup_stats = None
+        self._run_options = None
+        self._lemma_stats = None
+        self._fused_stats = None
+        self._job = None
+        # the options passed on to _execute as kwargs for every file
+        self._exec_kwargs = {"compression": compression, "compresslevel": compresslevel, "segment_len": segment_len,
+                             "rule_workers": rule_workers, "verify_rules": verify_rules, "lemmatizer": lemmatizer,
+                             "fused": fused}
+        if lemmatizer not in lemmatizers:
+            raise ValueError(f"lemmatizer must be one of {list(lemmatizers)}.")
+        if compression:
+            # a bad compression or compresslevel is raised here rather than failing every file
+            compress_bytes(b"", compression, compresslevel)
+        self._archive_out = archive_out
+        self._archive_max_bytes = archive_max_bytes
+        if token_store not in (None, "document", "shard"):
+            raise ValueError('token_store must be None, "document" or "shard".')
+        self._token_store = token_store
+        self._keep_norm_state = keep_norm_state
+        if checkpoints:
+            ckpt_dir = checkpoints if isinstance(checkpoints, str) else join(self._dst_dir, ".checkpoints")
+            self._exec_kwargs["checkpoints"] = stageCheckpoints(ckpt_dir)
+        # the pool and deadlines of the requests of this remaker's runs only, which share the tokenizer and the
+        # annotators with any other remaker of the process (see _corenlp_scope)
+        self._corenlp_settings = {"pool": corenlp_pool, "request_timeout": request_timeout, 
+                                  "max_retries": max_retries or None, "hedge": hedge_requests or None}
+    
+    def set_job(self, name):
+        '''Tag the CoreNLP requests of the runs with a job name, so that a jobScheduler.fairShareScheduler can share
+        the backend between this corpus and the others run at the same time. None to untag them.'''
+        self._job = name
     
     def show_filenames(self, num_to_show=None):
         return self._filenames[:num_to_show]
@@ -498,15 +1413,17 @@ class xmlCorpusRemaker:
     def shuffle_filenames(self):
         random.shuffle(self._filenames)
 
-    def remaining_files(self):
-        out = []
-        for f in self._filenames:
-            if not exists(join(self._dst_dir, f)):
-                out.append(f)
-        return out
+    def remaining_files(self, include_stale=False):
+        '''Return the filenames not remade yet, by a single scan of the dst_dir. If include_stale=True, 
+        also return the files modified after their remade file was made.'''
+        out_name = lambda f: _out_filename(f, self._exec_kwargs["compression"])
+        if self._archive_out:
+            done = load_archive_index(self._dst_dir)
+            return [f for f in self._filenames if out_name(f) not in done]
+        return self._manifest.remaining(self._dst_dir, self._filenames, include_stale, out_name)
 
     def get_remade_xml_filepaths(self):
-        filenames = get_filenames_from_dir(self._dst_dir, False, ".xml")
+        filenames = get_filenames_from_dir(self._dst_dir, False, ".xml", include_compressed=True)
         return [join(self._dst_dir, f) for f in filenames]
     
     def _get_part(self, num_or_ratio):
@@ -519,18 +1436,176 @@ class xmlCorpusRemaker:
         else:
             raise TypeError("num_or_ratio must be either int, float in (0, 1), or not given (None).")
     
+    def _iter_files(self, filenames):
+        '''Yield (filename, source) for the files to remake. The source is the bytes of the file when
+        the corpus is an archive, which is read sequentially in its own order. Otherwise, None.'''
+        if self._archive:
+            yield from iter_archive_members(self._corpus_dir.rstrip("/"), names=set(filenames))
+        else:
+            for filename in filenames:
+                yield filename, None
+    
+    def _corenlp_scope(self):
+        '''Apply the corenlp_pool and the deadlines of the remaker to the CoreNLP requests made by the current
+        thread within the with block, and not to those of the other remakers of the process.'''
+        stack = ExitStack()
+        for client in (stTK, sta, stfa):
+            stack.enter_context(client.scoped(**self._corenlp_settings))
+        return stack
+    
+    def _run_file(self, func, filename, source, *args):
+        '''Remake a file and record its status, time and size in the run stats. Return the record.'''
+        start = time()
+        start_request_log()
+        set_request_job(self._job)
+        try:
+            with self._corenlp_scope():
+                if self._profiler is not None:
+                    status = self._profiler.run(filename, func, self._corpus_dir, filename, self._head_node, self._body_node,
+                                                self._root_name, self._dst_dir, *args, source=source, **self._exec_kwargs)
+                else:
+                    status = func(self._corpus_dir, filename, self._head_node, self._body_node,
+                                  self._root_name, self._dst_dir, *args, source=source, **self._exec_kwargs)
+        except Exception as e:
+            log_event("failed", f"\033[1m\033[31mA problem remaking {filename} as follows: \033[0m{e}\n", filename,
+                      func.__name__, "error", time() - start, error=repr(e))
+            status = "failed"
+        latencies = request_log()
+        p99 = percentile([seconds for seconds, _ in latencies], 99)
+        # a structured record per file, with no console message
+        log_event("file_done", None, filename, func.__name__, duration=time() - start, status=status,
+                  requests=len(latencies))
+        rec = {"filename": filename, "status": status, "seconds": round(time() - start, 4),
+               "bytes": self._manifest.size(filename) if filename in self._manifest else None,
+               "requests": len(latencies), "p99_seconds": round(p99, 4) if p99 is not None else None,
+               "timeouts": sum(timed_out for _, timed_out in latencies)}
+        self._stats.append(rec)
+        return rec
+    
+    def _stats_path(self):
+        if self._shard is None:
+            return join(self._dst_dir, ".remake_stats.json")
+        return join(self._dst_dir, ".remake_stats.shard-%i-of-%i.json" % self._shard)
+    
+    def _save_stats(self, func, started):
+        '''Save the per-file log and the counts of the last run in the dst_dir.'''
+        counts = {}
+        for rec in self._stats:
+            counts[rec["status"]] = counts.get(rec["status"], 0) + 1
+        stats = {"mode": func.__name__, "shard": self._shard, "started": started, "finished": time(),
+                 "options": self._run_options, "counts": counts, "files": self._stats}
+        if "checkpoints" in self._exec_kwargs:
+            stats["checkpoints"] = self._exec_kwargs["checkpoints"].stats()
+        # a worker stalled on a file when one of the file's requests ran into its deadline
+        stats["stalled_workers"] = sum(1 for rec in self._stats if rec.get("timeouts"))
+        stats["corenlp"] = {"tokenizer": stTK.latency_stats(), "annotator": sta.latency_stats()}
+        if self._fused_stats is not None:
+            stats["corenlp"]["fused"] = stfa.latency_stats()
+            stats["fused"] = self._fused_stats
+        if self._memory_stats is not None:
+            stats["memory"] = self._memory_stats
+        if self._dedup_stats is not None:
+            stats["dedup"] = self._dedup_stats
+        if self._lemma_stats is not None:
+            stats["lemmatizer"] = self._lemma_stats
+        if self._profiler is not None:
+            stats["profile"] = {"files": len(self._profiler.files), "stages": self._profiler.stage_times(),
+                                "report": self._profiler.write_report()}
+            log_event("profile_saved", f"\033[32mThe profile report is saved in {stats['profile']['report']}\033[0m",
+                      stage="profile", report=stats["profile"]["report"])
+        with open(self._stats_path(), "w") as f:
+            json.dump(stats, f)
+        return stats
+    
+    def get_run_stats(self):
+        '''Return the per-file records (filename, status, seconds, bytes, requests, p99_seconds, timeouts) of the last run.'''
+        return self._stats
+
+    def _body_len_ratio(self, files, sample_size=5):
+        '''Return the median ratio of the body length seen by _text_len_check (the prettified body) to the byte
+        span of the body, over a sample of the (filename, source) files fully parsed. 1.0 if none can be measured.'''
+        ratios = []
+        for filename, source in files[:sample_size]:
+            span = body_span(join(self._corpus_dir, filename) if source is None else source, self._body_node)
+            if span:
+                _, body = get_header_body_as_str(join(self._corpus_dir, filename), self._head_node,
+                                                 self._body_node, source=source)
+                ratios.append(len(body) / span)
+        return sorted(ratios)[len(ratios) // 2] if ratios else 1.0
+
+    def plan_the_corpus(self, mode="tokenize", apply_prep_rules=False, spell_norm=False, num_or_ratio=None,
+                        text_lower_len=0, text_upper_len=1000000, threads_num=10, remain_files_only=False,
+                        sample_size=5, stats_paths=None, reorder=False, save=True):
+        '''Estimate the cost of a run without remaking anything (a dry run, see runPlanner.py): the files to be
+        skipped by text_lower_len/text_upper_len, the CoreNLP requests, and the wall time on threads_num threads.
+        Return the plan: the per-file estimates ("files"), the totals ("total") and the model used ("model").
+
+        Args:
+            - mode(str): one of "tokenize", "pos_tag", "lemmatize" and "pos_lemma", i.e., the run to plan.
+            - stats_paths(list): the stats files (.remake_stats*.json) of the previous runs to calibrate on.
+            Defaults to the ones in the dst_dir. Only the runs of the same mode are used.
+            - sample_size(int): the number of files fully parsed to calibrate the body length estimates on.
+            - reorder(bool): whether to order the files of the next runs by their estimated seconds, the longest
+            first, and the files to be skipped last, so that a long file does not hold up the end of a run.
+            - save(bool): whether to save the plan in the dst_dir as .remake_plan.json.
+            The other args are the same as those of the runs.
+        '''
+        if mode not in remake_modes:
+            raise ValueError(f"mode must be one of {list(remake_modes)}.")
+        func = {"tokenize": tokenize_xml_body, "pos_tag": pos_tag_xml_body, "lemmatize": lemmatize_xml_body,
+                "pos_lemma": xml_body_with_pos_lemma}[mode]
+        filenames = self.remaining_files() if remain_files_only else self._filenames
+        part = self._get_part(num_or_ratio)
+        files = list(self._iter_files(filenames[:int(part) if part is not None else None]))
+
+        ratio = self._body_len_ratio(files, sample_size)
+        options = {"apply_prep_rules": apply_prep_rules, "spell_norm": spell_norm}
+        model = throughputModel.from_stats(stats_files(self._dst_dir) if stats_paths is None else stats_paths,
+                                           func.__name__, options, annotated=bool(remake_modes[mode]))
+        segment_len = self._exec_kwargs["segment_len"]
+        segmented = lambda filename, source: _segmented(join(self._corpus_dir, filename), source,
+                                                        segment_len, text_upper_len)
+        triples = [(filename, join(self._corpus_dir, filename) if source is None else source,
+                    self._file_size(filename, source)) for filename, source in files]
+        per_file = plan_files(triples, self._body_node, model, text_lower_len, text_upper_len, ratio,
+                              segmented if segment_len else None)
+        total = summarize_plan(per_file, threads_num)
+        plan = {"mode": func.__name__, "options": options, "created": time(), "body_len_ratio": round(ratio, 4),
+                "model": model.describe(), "total": total, "files": per_file}
+
+        if reorder:
+            rank = dict((rec["filename"], (rec["status"] not in ("remake", "segmented"), -rec["seconds"]))
+                        for rec in per_file)
+            self._filenames.sort(key=lambda f: rank.get(f, (True, 0)))
+        if save:
+            with open(join(self._dst_dir, ".remake_plan.json"), "w") as f:
+                json.dump(plan, f)
+
+        counts = total["counts"]
+        print(f"\033[32mPlan of {func.__name__} over {total['files']} files\033[0m" \
+              f" ({'calibrated on %i files' % model.records if model.calibrated else 'not calibrated, rough defaults'}):")
+        print(f"  {counts.get('remake', 0)} to remake, {counts.get('segmented', 0)} segmented, " \
+              f"{counts.get('skip_lower', 0)} below text_lower_len, {counts.get('skip_upper', 0)} above text_upper_len " \
+              f"({total['near_limit']} within {int(near_limit * 100)}% of a limit).")
+        print(f"  ~{total['requests']} CoreNLP requests, ~{total['wall_seconds_batched']}s with multitasking " \
+              f"(~{total['wall_seconds_continuous']}s under a memory_budget) on {threads_num} threads, " \
+              f"~{total['wall_seconds_sequential']}s sequentially.")
+        return plan
+
     def _run(self, func, apply_prep_rules, spell_norm, num_or_ratio, word_alignment_debug,
-             skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only=False):
+             skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only=False,
+             profile=False, profile_rate=1.0):
 
         if not apply_prep_rules and spell_norm:
-            print("If apply_prep_rules=False, spell_norm must also be set False to avoid words misalignment problem.")
-            print("\033[32mspell_norm and word_alignment_debug (if on) accordingly have been turned off.\033[0m")
+            log_event("options_adjusted", "If apply_prep_rules=False, spell_norm must also be set False to avoid words " \
+                      "misalignment problem.\n\033[32mspell_norm and word_alignment_debug (if on) accordingly have been " \
+                      "turned off.\033[0m", stage=func.__name__, level="warning")
             spell_norm = False
             word_alignment_debug = False
 
         if not spell_norm and word_alignment_debug:
-            print("word_alignment_debug is for spelling normalized text only")
-            print("\033[32mword_alignment_debug has been turned off.\033[0m")
+            log_event("options_adjusted", "word_alignment_debug is for spelling normalized text only.\n\033[32m" \
+                      "word_alignment_debug has been turned off.\033[0m", stage=func.__name__, level="warning")
             word_alignment_debug = False
 
         if remain_files_only:
@@ -538,59 +1613,213 @@ class xmlCorpusRemaker:
             self._filenames = self.remaining_files()
         
         part = self._get_part(num_or_ratio)
-        if not multitasking:
-            for filename in self._filenames[:part]:
-                func(self._corpus_dir, filename, self._head_node, self._body_node, 
-                             self._root_name, self._dst_dir, apply_prep_rules, spell_norm,   
-                              word_alignment_debug, skip_exists, text_lower_len, text_upper_len)
-        else:
-            end = len(self._filenames[:part])
-            for i in range(0, end, threads_num):
-                threads = []
-                for filename in self._filenames[:part][i: i + threads_num if i + threads_num <= end else end]:
-                    
-                    t = Thread(target=func, args=(self._corpus_dir, filename, self._head_node, self._body_node, 
-                                                  self._root_name, self._dst_dir, apply_prep_rules, spell_norm,   
-                                                  word_alignment_debug, skip_exists, text_lower_len, text_upper_len,))
-                    t.start()
-                    threads.append(t)
-                for t in threads:
-                    t.join()
+        self._stats, started = [], time()
+        # recorded in the stats, for the planner to calibrate on the runs of the same options
+        self._run_options = {"apply_prep_rules": apply_prep_rules, "spell_norm": spell_norm}
+        self._memory_stats = self._dedup_stats = self._lemma_stats = self._fused_stats = None
+        lemmatizer = self._exec_kwargs["lemmatizer"]
+        offline = lemmatizer != "corenlp" and func is lemmatize_xml_body
+        if offline:
+            # the lemmatizer is shared by the runs of the process, so the counts of this run are the difference
+            _lemma_func(lemmatizer)
+            counts_before = _offline_lemmatizers[lemmatizer].stats()
+        fused = self._exec_kwargs["fused"] and func is not tokenize_xml_body and not offline
+        if fused:
+            with _fused_lock:
+                fused_before = dict(_fused_counts)
+        if profile:
+            profile_dir = profile if isinstance(profile, str) else join(self._dst_dir, ".profile")
+            self._profiler = remakeProfiler(profile_dir, profile_rate)
+        args = (apply_prep_rules, spell_norm, word_alignment_debug, skip_exists, text_lower_len, text_upper_len)
+        self._open_writers()
+        if self._keep_norm_state and spell_norm:
+            self._exec_kwargs["norm_state"] = normalizationState(self._dst_dir, (norm_rules, verbs, irreg_v_dict))
+        if self._dedup:
+            self._exec_kwargs["dedup"] = bodyDedup(join(self._dst_dir, ".dedup"))
+        
+        self._run_files(func, self._iter_files(self._filenames[:part]), args, multitasking, threads_num)
+        # the messages of the files come before the summary of the run
+        flush_logs()
                     
+        if self._dedup:
+            dedup = self._exec_kwargs.pop("dedup")
+            self._dedup_stats = dedup.stats()
+            dedup.close()
+            log_event("dedup_done", f"\033[32m{self._dedup_stats['duplicates']} of {self._dedup_stats['bodies']} bodies " \
+                      "were duplicates.\033[0m", stage="dedup", **self._dedup_stats)
+        if offline:
+            counts = _offline_lemmatizers[lemmatizer].stats()
+            self._lemma_stats = dict({k: v - counts_before[k] for k, v in counts.items()}, name=lemmatizer)
+        if fused:
+            with _fused_lock:
+                self._fused_stats = {k: v - fused_before[k] for k, v in _fused_counts.items()}
+        self._close_writers()
         if remain_files_only:
             self._filenames = fnames_copy
+        self._save_stats(func, started)
+        self._profiler = None
+    
+    def _open_writers(self):
+        '''Set up the archive shard writer and the token store writer (if any) of a run.'''
+        if self._archive_out:
+            # the shard processes write tar shards and indexes of their own, not to interleave theirs
+            prefix = "remade" if self._shard is None else "remade.shard-%i-of-%i" % self._shard
+            self._exec_kwargs["archive_writer"] = archiveShardWriter(self._dst_dir, prefix, self._archive_max_bytes)
+        if self._token_store == "shard":
+            store_name = "tokens" if self._shard is None else "tokens.shard-%i-of-%i" % self._shard
+            self._exec_kwargs["token_store"] = tokenStoreWriter(join(self._dst_dir, store_name))
+        else:
+            self._exec_kwargs["token_store"] = self._token_store
+    
+    def _close_writers(self):
+        if self._archive_out:
+            self._exec_kwargs.pop("archive_writer").close()
+        if "norm_state" in self._exec_kwargs:
+            self._exec_kwargs.pop("norm_state").close()
+    
+    def _run_files(self, func, files, args, multitasking=False, threads_num=10):
+        '''Run func over the (filename, source) pairs, sequentially or in batches of threads_num threads.'''
+        if multitasking and self._memory_budget is not None:
+            self._run_files_scheduled(func, files, args, threads_num)
+        elif not multitasking:
+            for filename, source in files:
+                self._run_file(func, filename, source, *args)
+        else:
+            threads = []
+            for filename, source in files:
+                t = Thread(target=self._run_file, args=(func, filename, source) + args)
+                t.start()
+                threads.append(t)
+                # a batch of threads_num files at a time
+                if len(threads) == threads_num:
+                    for t in threads:
+                        t.join()
+                    threads = []
+            for t in threads:
+                t.join()
+    
+    def _file_size(self, filename, source):
+        if filename in self._manifest:
+            return self._manifest.size(filename)
+        if source is not None:
+            return len(source)
+        # e.g., a remade file to re-normalize, which is not in the corpus_dir
+        return getsize(join(self._corpus_dir, filename)) if exists(join(self._corpus_dir, filename)) else 0
+    
+    def _run_files_scheduled(self, func, files, args, threads_num=10):
+        '''Run func over the (filename, source) pairs in threads admitted under the memory budget (see corpusScheduler.py).
+        A file that does not fit yet lets the ones behind it (up to 2 * threads_num of them) go first, but only so many
+        times, so that a large file is not held back for good.'''
+        scheduler = memoryScheduler(self._memory_budget, threads_num)
+        files, pending, threads = iter(files), deque(), []
+        exhausted, passed_over = False, 0
+        
+        def run(filename, source):
+            try:
+                rec = self._run_file(func, filename, source, *args)
+            finally:
+                memory = scheduler.release(filename)
+            rec.update(memory)
+        
+        while pending or not exhausted:
+            while not exhausted and len(pending) < 2 * threads_num:
+                nxt = next(files, None)
+                if nxt is None:
+                    exhausted = True
+                else:
+                    pending.append(nxt + (self._file_size(*nxt),))
+            # the first file is always tried, the ones behind it only until it has been passed over threads_num times
+            candidates = list(pending) if passed_over < threads_num else list(pending)[:1]
+            for i, (filename, source, size) in enumerate(candidates):
+                if scheduler.try_admit(filename, size):
+                    del pending[i]
+                    passed_over = passed_over + 1 if i else 0
+                    t = Thread(target=run, args=(filename, source))
+                    t.start()
+                    threads.append(t)
+                    break
+            else:
+                if pending:
+                    scheduler.wait()
+        for t in threads:
+            t.join()
+        self._memory_stats = scheduler.stats()
+        scheduler.close()
     
     def tokenize_the_corpus(self, apply_prep_rules=False, spell_norm=False, num_or_ratio=None,
                             word_alignment_debug=False, skip_exists=True,
                             text_lower_len=0, text_upper_len=1000000,
-                            multitasking=False, threads_num=10, remain_files_only=False):
+                            multitasking=False, threads_num=10, remain_files_only=False,
+                            profile=False, profile_rate=1.0):
         
         self._run(tokenize_xml_body, apply_prep_rules, spell_norm, num_or_ratio, word_alignment_debug, 
-                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only)
+                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only,
+                  profile, profile_rate)
                 
     def pos_tag_the_corpus(self, apply_prep_rules=False, spell_norm=False, num_or_ratio=None,
                            word_alignment_debug=False, skip_exists=True,
                            text_lower_len=0, text_upper_len=1000000,
-                           multitasking=False, threads_num=10, remain_files_only=False):
+                           multitasking=False, threads_num=10, remain_files_only=False,
+                           profile=False, profile_rate=1.0):
         
         self._run(pos_tag_xml_body, apply_prep_rules, spell_norm, num_or_ratio, word_alignment_debug, 
-                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only)
+                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only,
+                  profile, profile_rate)
     
     def lemmatize_the_corpus(self, apply_prep_rules=False, spell_norm=False, num_or_ratio=None,
                              word_alignment_debug=False, skip_exists=True,
                              text_lower_len=0, text_upper_len=1000000,
-                             multitasking=False, threads_num=10, remain_files_only=False):
+                             multitasking=False, threads_num=10, remain_files_only=False,
+                             profile=False, profile_rate=1.0):
         
         self._run(lemmatize_xml_body, apply_prep_rules, spell_norm, num_or_ratio, word_alignment_debug, 
-                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only)
+                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only,
+                  profile, profile_rate)
     
     def corpus_with_pos_lemma(self, apply_prep_rules=False, spell_norm=False, num_or_ratio=None,
                               word_alignment_debug=False, skip_exists=True,
                               text_lower_len=0, text_upper_len=1000000,
-                              multitasking=False, threads_num=10, remain_files_only=False):
+                              multitasking=False, threads_num=10, remain_files_only=False,
+                              profile=False, profile_rate=1.0):
         
         self._run(xml_body_with_pos_lemma, apply_prep_rules, spell_norm, num_or_ratio, word_alignment_debug, 
-                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only)
+                  skip_exists, text_lower_len, text_upper_len, multitasking, threads_num, remain_files_only,
+                  profile, profile_rate)
+
+    def renormalize_the_corpus(self, norm_rules_path='config/normalizing_rules.txt', verbs_path='config/common_verbs.txt',
+                               irreg_v_path="config/irregular_v_past_inflections.json", dry_run=False, 
+                               multitasking=False, threads_num=10):
+        '''Re-normalize only the remade files affected by the changes made to the normalization rules since they 
+        were remade, from the state recorded with keep_norm_state=True (no re-tokenization). The added, removed and
+        changed rules and verbs are matched against the recorded token types of the files. The files that are not 
+        affected are kept as they are and marked as up to date.
+        
+        Args:
+            - norm_rules_path(str), verbs_path(str), irreg_v_path(str): the current normalization rule files.
+            - dry_run(bool): when set True, only return the affected remade filenames. Defaults to False.
+            - multitasking(bool), threads_num(int): same as for the other corpus methods.
+        
+        Return(list): the affected remade filenames.'''
+        if not exists(join(self._dst_dir, ".renorm.sqlite")):
+            print("\033[31mNo normalization state found in the dst_dir.\033[0m Remake the corpus with keep_norm_state=True" \
+                  " and spell_norm=True first.")
+            return []
+        rule_set = load_norm_rule_set(norm_rules_path, verbs_path, irreg_v_path)
+        state = normalizationState(self._dst_dir, rule_set)
+        affected, unaffected = state.affected_files(rule_set)
+        print(f"\033[32m{len(affected)} of {len(state)} remade files are affected by the rule changes.\033[0m")
+        if dry_run:
+            state.close()
+            return affected
+        
+        self._stats, started = [], time()
+        self._open_writers()
+        self._exec_kwargs["norm_state"] = state
+        self._run_files(renormalize_xml_body, ((f, None) for f in affected), (rule_set,), multitasking, threads_num)
+        state.set_fingerprint(unaffected, state.fingerprint)
+        self._close_writers()
+        self._save_stats(renormalize_xml_body, started)
+        return affected
 
     def debug_remade_corpus(self, num_or_ratio=None, check_num=10, err_threshold=0.1, print_msg=True):
         part = self._get_part(num_or_ratio)
@@ -603,3 +1832,64 @@ class xmlCorpusRemaker:
                   " is for Normalized remade xml files only. To compare differences between" \
                   "attributes, call attr_diff_in_xml_word_nodes or print_attr_diff_in_xml_word_nodes" \
                   "from debugger.py instead.")
+
+    def index_remade_corpus(self, index_path=None):
+        '''Build (or extend) an inverted index over the remade corpus for KWIC concordance queries 
+        (see corpusIndex.py). The token stores are indexed if the corpus was remade with a token_store,
+        otherwise the tar shards or the remade xml files. Defaults to concordance.sqlite in the dst_dir.'''
+        index = corpusIndex(index_path or join(self._dst_dir, "concordance.sqlite"))
+        index.add_remade_dir(self._dst_dir)
+        return index
+
+
+def merge_shard_stats(dst_dir, save=True, shard_count=None):
+    '''Combine the per-shard logs and stats saved by sharded xmlCorpusRemaker runs in the dst_dir. Only the
+    shards of one generation, i.e., of one shard_count, are merged: the stats of the shards split otherwise (e.g.,
+    left by an earlier run with another shard_count) are ignored, with a warning.
+    
+    Args:
+        - dst_dir(str): the dst_dir shared by the shards.
+        - save(bool): whether to save the merged stats as .remake_stats.json in the dst_dir. Defaults to True.
+        - shard_count(int or None): the shard_count of the shards to merge. Defaults to None, i.e., that of the
+        shard finished last.
+    
+    Return(dict):
+        The merged stats, with the per-file records of all the shards ("files"), the summed status counts
+        ("counts"), the shards found ("shards") and the missing shards if any ("missing_shards").
+    '''
+    shard_stats = []
+    for f in get_filenames_from_dir(dst_dir, False, ".json"):
+        if re.fullmatch(r"\.remake_stats\.shard-\d+-of-\d+\.json", f):
+            with open(join(dst_dir, f), "r") as fr:
+                shard_stats.append(json.load(fr))
+    if not shard_stats:
+        print(f"\033[32mNo shard stats found in {dst_dir}.\033[0m")
+        return 
+    
+    if shard_count is None:
+        shard_count = max(shard_stats, key=lambda stats: stats["finished"])["shard"][1]
+    ignored = [stats for stats in shard_stats if stats["shard"][1] != shard_count]
+    if ignored:
+        print(f"\033[31mThe stats of {len(ignored)} shards ({sum(len(stats['files']) for stats in ignored)} files) " \
+              f"of another shard_count than {shard_count} are ignored.\033[0m")
+    shard_stats = [stats for stats in shard_stats if stats["shard"][1] == shard_count]
+    if not shard_stats:
+        print(f"\033[32mNo stats of {shard_count} shards found in {dst_dir}.\033[0m")
+        return
+    shards = sorted(stats["shard"][0] for stats in shard_stats)
+    merged = {"mode": sorted(set(stats["mode"] for stats in shard_stats)), "shards": shards, 
+              "missing_shards": [i for i in range(shard_count) if i not in shards],
+              "started": min(stats["started"] for stats in shard_stats), 
+              "finished": max(stats["finished"] for stats in shard_stats), "counts": {}, "files": []}
+    for stats in shard_stats:
+        for status, count in stats["counts"].items():
+            merged["counts"][status] = merged["counts"].get(status, 0) + count
+        merged["files"] += stats["files"]
+    
+    if merged["missing_shards"]:
+        print(f"\033[31mShards {merged['missing_shards']} of {shard_count} have no stats yet.\033[0m")
+    print(f"{len(merged['files'])} files from {len(shards)} shards: {merged['counts']}")
+    if save:
+        with open(join(dst_dir, ".remake_stats.json"), "w") as f:
+            json.dump(merged, f)
+    return merged